@@ -10,16 +10,30 @@
 # - Display of temperature data from two sources (DS18B20)
 # - RSS feed reader (displaying last header in feed)
 #
+# Options:
+# -d          run as a daemon
+# --headless  render frames into a dummy device without a display
+# --bench     print the startup benchmark and exit
+# --profile   profile the first seconds after the start
+#
+# Signals: SIGUSR1 writes a sampled stack profile of all processes to profiles/,
+# SIGUSR2 starts the allocations tracing on the first signal and dumps the top allocations on the next ones
+#
 # (c) Hansom 2018
 
 __version__ = '0.0.1b'
+import time
+_START_TIME = time.monotonic()
 import sys
 from multiprocessing import freeze_support
-from pilot import PilotClock as Clock
 
 
-def main():
-    pilot = Clock()
+def main(headless=False, profile=False):
+    # The clock is imported here, so the sensor processes importing this module do not load the display libraries
+    from pilot import PilotClock as Clock
+    pilot = Clock(headless)
+    if profile:
+        pilot.startProfile()
     print("Starting clock...")
     try:
         pilot.run()
@@ -30,11 +44,74 @@ def main():
         print("Program finished")
 
 
+def benchmark(top=15, frames_time=3):
+    """
+    Startup benchmark with the headless device: import time of the modules in a fresh interpreter,
+    time from the start of the program to the first frame and overhead of the metrics per frame
+    :param top: Number of the slowest imports to print
+    :param frames_time: Time in seconds the main loop is run for measuring frames
+    :return:
+    """
+    import os
+    import threading
+    import subprocess
+    from pilot import PilotClock as Clock
+    imported = time.monotonic()
+    pilot = Clock(headless=True)
+    ready = time.monotonic()
+    pilot._fonts_thread.join()
+    print('Imports in this process:  {0:8.1f} ms'.format((imported - _START_TIME) * 1000))
+    print('First frame (logo):       {0:8.1f} ms'.format((pilot.first_frame_time - _START_TIME) * 1000))
+    print('Sensors started:          {0:8.1f} ms'.format((ready - _START_TIME) * 1000))
+    print('Bitmap fonts built:       {0:8.1f} ms'.format((pilot.fonts_loaded_time - _START_TIME) * 1000))
+    # Instrumentation overhead against the measured cost of the frames rendered by the main loop
+    from pilot_metrics import frameOverhead
+    draw = pilot._metrics['frame_draw_seconds']
+    display = pilot._metrics['frame_display_seconds']
+    loop = threading.Thread(target=pilot.run, daemon=True)
+    loop.start()
+    # Only the clock face frames are counted, the logo is shown for the first 5 seconds
+    time.sleep(max(5.5 - (time.monotonic() - pilot.first_frame_time), 0))
+    logo = (draw.count(), draw.sum() + display.sum())
+    time.sleep(frames_time)
+    pilot._loop = False
+    loop.join()
+    frames = draw.count() - logo[0]
+    if frames:
+        frame_cost = (draw.sum() + display.sum() - logo[1]) / frames
+        overhead = frameOverhead()
+        print('Clock frames rendered:    {0:8d}, {1:.2f} ms each'.format(int(frames), frame_cost * 1000))
+        print('Metrics per frame:        {0:8.1f} us, {1:.2f}% of the frame, {2:.3f}% of the 30 fps period'.format(
+            overhead * 1e6, overhead / frame_cost * 100, overhead * 30 * 100))
+    print('Memory of the processes:')
+    for name, memory in pilot._sensors.getMemoryStats().items():
+        if memory is not None:
+            print('  {0:6s} RSS {1:7d} kB  PSS {2} kB'.format(name, memory[0], memory[1]))
+    pilot.stop()
+
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import pilot'],
+                            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, universal_newlines=True,
+                            cwd=os.path.dirname(os.path.abspath(__file__)))
+    imports = []
+    for line in result.stderr.splitlines():
+        # Format: "import time: self [us] | cumulative | imported package"
+        parts = line.split('|')
+        if len(parts) == 3 and parts[1].strip().isdigit():
+            name = parts[2].rstrip()
+            # Only the modules imported directly by pilot and its libraries, nested imports are in their cumulative time
+            if len(name) - len(name.lstrip()) <= 3:
+                imports.append((int(parts[1]), name.strip()))
+    print('Slowest imports of pilot (cumulative):')
+    for cumulative, name in sorted(imports, reverse=True)[:top]:
+        print('  {0:8.1f} ms  {1}'.format(cumulative / 1000, name))
+
 if __name__ == '__main__':
     freeze_support()
-    if len(sys.argv) >= 2 and '-d' in sys.argv[1:]:
+    if '--bench' in sys.argv[1:]:
+        benchmark()
+    elif len(sys.argv) >= 2 and '-d' in sys.argv[1:]:
         from daemonize import Daemonize
-        daemon = Daemonize(app="pilot-clock", pid='/tmp/pilot-clock-daemon.pid', action=main)
+        daemon = Daemonize(app="pilot-clock", pid='/tmp/pilot-clock-daemon.pid', action=lambda: main('--headless' in sys.argv[1:], '--profile' in sys.argv[1:]))
         daemon.start()
     else:
-        main()
+        main('--headless' in sys.argv[1:], '--profile' in sys.argv[1:])
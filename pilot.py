@@ -5,29 +5,47 @@
 # (c) Hansom 2018
 
 import os
-import sys
 import json
+import threading
 from math import floor, ceil
-from time import sleep
+from time import sleep, monotonic, perf_counter
 from datetime import datetime, timedelta
 from PIL import Image, ImageDraw
 from luma.led_matrix.device import max7219
 from luma.core.interface.serial import spi, noop
 from luma.core.render import canvas
+from luma.core.device import dummy
 from pilot_fonts import font2bitmapFont, DIGITS_FONT_SLIM, DATE_OUT_FONT, RUN_LINE_FONT, THERM_DIGITS_FONT
-from pilot_sensors import PilotSensors as Sensors
+from pilot_fonts import RUN_LINE_HEIGHT, RUN_LINE_MARGIN
+from pilot_adc import AnalogSensor
 
 if os.name is 'nt':
     from luma.emulator.device import pygame as max7219emu
 
-DIGITS_FONT_SLIM_B = font2bitmapFont(DIGITS_FONT_SLIM, 10)
-DATE_OUT_FONT_B = font2bitmapFont(DATE_OUT_FONT, 6)
-RUN_LINE_FONT_B = font2bitmapFont(RUN_LINE_FONT, 9)
-THERM_DIGITS_FONT_B = font2bitmapFont(THERM_DIGITS_FONT, 7)
-SCRIPT_PATH = os.path.abspath(os.path.dirname(sys.argv[0]))
+# Bitmap fonts are built on the first use or in background while the logo is shown: (font bit pattern, height)
+BITMAP_FONTS = {
+    'digits_slim': (DIGITS_FONT_SLIM, 10),
+    'date_out': (DATE_OUT_FONT, 6),
+    'run_line': (RUN_LINE_FONT, RUN_LINE_HEIGHT),
+    'therm_digits': (THERM_DIGITS_FONT, 7),
+}
+_bitmap_fonts = {}
+SCRIPT_PATH = os.path.abspath(os.path.dirname(__file__))
 CONFIG_PATH = 'pilot-clock.conf'
 
 
+def bitmapFont(name='run_line'):
+    """
+    Method of obtaining a bitmap font, it is built on the first call
+    :param name: Font name from BITMAP_FONTS
+    :return: List of glyph images
+    """
+    font = _bitmap_fonts.get(name)
+    if font is None:
+        font = _bitmap_fonts[name] = font2bitmapFont(*BITMAP_FONTS[name])
+    return font
+
+
 def drawBText(draw, xy, txt, fill=None, font=None, align='left'):
     """
     Method for output text on display
@@ -39,7 +57,7 @@ def drawBText(draw, xy, txt, fill=None, font=None, align='left'):
     :param align: Text align (left, right or center)
     :return:
     """
-    font = font or RUN_LINE_FONT_B
+    font = font or bitmapFont('run_line')
     x, y = xy
     align = align.lower()
     if align == 'right':
@@ -58,7 +76,7 @@ def getBTextSize(txt, font=None):
     :param font:
     :return:
     """
-    font = font or RUN_LINE_FONT_B
+    font = font or bitmapFont('run_line')
     src = [font[ascii_code].width for ascii_code in txt.encode('iso8859-5', errors='replace')]
     return sum(src), font[0].height
 
@@ -79,12 +97,12 @@ class PilotClock(object):
     # _alarm_time = [(datetime.strptime("06:10:00", '%H:%M:%S'), datetime.strptime("07:10:00", '%H:%M:%S'), [0, 1, 2, 3, 4]),
     #                (datetime.strptime("17:30:00", '%H:%M:%S'), datetime.strptime("22:00:00", '%H:%M:%S'), [5, 6]),
     #                (datetime.strptime("11:00:00", '%H:%M:%S'), datetime.strptime("23:00:00", '%H:%M:%S'))]
-    # Alarm clock format must be (alarm time, alarm melody number, [days of week])
+    # Alarm clock format must be (alarm time, alarm sound name, [days of week])
     # days of week - is optional parameter. If not specified, then all days of week is true
     _alarm_clock = []
-    # _alarm_clock = [(datetime.strptime("06:10", '%H:%M'), 2, [0, 1, 2, 3, 4]),
-    #                 (datetime.strptime("18:30", '%H:%M'), 2, [5, 6]),
-    #                 (datetime.strptime("11:00", '%H:%M'), 1)]
+    # _alarm_clock = [(datetime.strptime("06:10", '%H:%M'), 'alarm2', [0, 1, 2, 3, 4]),
+    #                 (datetime.strptime("18:30", '%H:%M'), 'alarm2', [5, 6]),
+    #                 (datetime.strptime("11:00", '%H:%M'), 'alarm1')]
 
     _scroll_text_show_count = 3  # run line repeat show count
     _scroll_repeat_time = 10     # repeat interval in seconds
@@ -95,21 +113,93 @@ class PilotClock(object):
     _scroll_text_pos_x = 0
     _scroll_text_shows_num = 0
     _no_scroll_time = 0
-    _last_scroll_time = datetime.now()
+    _last_scroll_time = None
     _scroll_text_img = None
     _scroll_alarm_played = True
     _config_mtime = None
+    _config_path = CONFIG_PATH
+    first_frame_time = None  # monotonic time of the logo frame
+    fonts_loaded_time = None  # monotonic time when all bitmap fonts are built
+    _metrics_exporter = None
 
-    def __init__(self):
-        if os.name == 'nt':
+    def __init__(self, headless=False, sensors=None, now=None, sleeper=None):
+        """
+        :param headless: Render frames into a dummy device without a display, for benchmarks
+        :param sensors: Sensors object used instead of starting the sensor processes, for simulations
+        :param now: Function returning the current local time, datetime.now by default
+        :param sleeper: Function of waiting for a number of seconds, time.sleep by default
+        """
+        self._now = now or datetime.now
+        self._sleep = sleeper or sleep
+        self._last_scroll_time = self._now()
+        if headless:
+            self._devel = os.name == 'nt'
+            self._device = dummy(width=32, height=32, mode="1")
+        elif os.name == 'nt':
             self._devel = True
             self._device = max7219emu(32, 32, 0, "1", "led_matrix", 2, 30)
         else:
             self._devel = False
             self._serial = spi(port=0, device=0, gpio=noop())
             self._device = max7219(self._serial, width=32, height=32, block_orientation=-90, rotate=0)
+        # The logo is shown before the sensors and fonts are loaded
         self._logo = Image.open(os.path.join(SCRIPT_PATH, 'pclock.png'))
-        self._sensors = Sensors()
+        with canvas(self._device) as self._draw:
+            self.drawLogo(0, 6)
+        self._logo_show_time = self._now()
+        self.first_frame_time = monotonic()
+        self._fonts_thread = threading.Thread(target=self.loadFonts, daemon=True)
+        self._fonts_thread.start()
+
+        if sensors is None:
+            from pilot_sensors import PilotSensors as Sensors
+            sensors = Sensors(devel=headless or None)
+        self._sensors = sensors
+        # Headline restored from the cache is shown again without the news alarm
+        self._cached_text = self._sensors.getLastFeed()
+        self._cached_shows_num = self._sensors.getFeedShown()
+        self._metrics = self._sensors.getMetrics()
+        self._frame_draw = self._metrics.histogram('frame_draw_seconds', 'Time of drawing a frame')
+        self._frame_display = self._metrics.histogram('frame_display_seconds',
+                                                      'Time of writing a frame and the contrast to the display')
+        self._frame_overruns = self._metrics.counter('frame_overruns_total', 'Scroll frames longer than the frame period')
+        # SIGUSR1 profiles and SIGUSR2 dumps the allocations of this process and of the sensor processes
+        from pilot_profiler import PilotProfiler
+        self._profiler = PilotProfiler('main')
+        if threading.current_thread() is threading.main_thread():
+            self._profiler.install(self._sensors.signalWorkers)
+
+    def loadFonts(self):
+        """
+        Method of building all bitmap fonts in advance
+        :return:
+        """
+        for name in BITMAP_FONTS:
+            bitmapFont(name)
+        self.fonts_loaded_time = monotonic()
+
+    def startProfile(self, seconds=None):
+        """
+        Method of profiling the render loop and the sensor processes, the same as SIGUSR1.
+        The sensor processes are profiled for the default time
+        :param seconds: Length of the profile of the main process
+        :return:
+        """
+        import signal
+        if hasattr(signal, 'SIGUSR1'):
+            self._sensors.signalWorkers(signal.SIGUSR1)
+        self._profiler.start(seconds)
+
+    def dumpAllocations(self):
+        """
+        Method of dumping the top memory allocations of all processes, the same as SIGUSR2.
+        The first call starts the tracing
+        :return:
+        """
+        import signal
+        if hasattr(signal, 'SIGUSR2'):
+            self._sensors.signalWorkers(signal.SIGUSR2)
+        self._profiler.dumpAllocations()
 
     def __del__(self):
         self.stop()
@@ -122,17 +212,51 @@ class PilotClock(object):
         """
         silent = silent if self._config_accept_alarm and not self._mute else True
         try:
-            mtime = datetime.fromtimestamp(os.path.getmtime(CONFIG_PATH))
+            mtime = datetime.fromtimestamp(os.path.getmtime(self._config_path))
             if self._config_mtime != mtime:
                 print('Config changed at {time:%d.%m.%Y %H:%M:%S}'.format(time=mtime))
                 self._config_mtime = mtime
-                with open(CONFIG_PATH, mode='r', encoding='utf-8') as conf:
-                    cfg = json.loads(conf.read(), encoding='utf-8')
+                with open(self._config_path, mode='r', encoding='utf-8') as conf:
+                    cfg = json.loads(conf.read())
+                    failed = False
                     self._starting_song = self._starting_song if 'starting_song' not in cfg else cfg['starting_song']
                     self._news_alarm = self._news_alarm if 'news_alarm' not in cfg else cfg['news_alarm']
                     self._config_accept_alarm = self._config_accept_alarm if 'config_accept_alarm' not in cfg else cfg['config_accept_alarm']
                     if 'rss_src' in cfg:
-                        self._sensors.setRSSFeedSource(cfg['rss_src'])
+                        try:
+                            if type(cfg['rss_src']) is list:
+                                # List of feeds in format {"url": "...", "weight": 1.0} or plain URLs
+                                self._sensors.setRSSFeeds([(f.get('url'), f.get('weight', 1.0)) if type(f) is dict else (f, 1.0)
+                                                           for f in cfg['rss_src']])
+                            else:
+                                self._sensors.setRSSFeedSource(cfg['rss_src'])
+                        except ValueError as e:
+                            print("Error in RSS feeds configuration: {0}".format(e))
+                            failed = True
+                    if 'polling' in cfg:
+                        polling = cfg['polling']
+                        try:
+                            self._sensors.setPollingLimits(
+                                light=(polling['light_min'], polling['light_max']) if 'light_min' in polling and 'light_max' in polling else None,
+                                therm_max=polling['therm_max'] if 'therm_max' in polling else None)
+                        except (ValueError, TypeError) as e:
+                            print("Error in polling configuration: {0}".format(e))
+                            failed = True
+                    if 'analog_sensors' in cfg:
+                        try:
+                            self._sensors.setAnalogSensors(
+                                [AnalogSensor(a['name'], a['channel'], a.get('scale', 1.0), a.get('offset', 0.0),
+                                              a.get('filter', 1)) for a in cfg['analog_sensors']])
+                        except (KeyError, ValueError, TypeError):
+                            print("Error in analog sensors configuration")
+                            failed = True
+                    if 'therm_sensors' in cfg:
+                        try:
+                            self._sensors.setThermResolutions({t['id']: t['resolution'] for t in cfg['therm_sensors']
+                                                              if 'id' in t and 'resolution' in t})
+                        except (ValueError, TypeError) as e:
+                            print("Error in thermal sensors configuration: {0}".format(e))
+                            failed = True
                     if 'alarm_time' in cfg:
                         alarm_time = []
                         for t in cfg['alarm_time']:
@@ -144,18 +268,37 @@ class PilotClock(object):
                                     alarm_time.append((datetime.strptime(t['start'], '%H:%M:%S'),
                                                        datetime.strptime(t['end'], '%H:%M:%S')))
                                 self._alarm_time = alarm_time
+                    if 'ringtones' in cfg and type(cfg['ringtones']) is dict:
+                        self._sensors.setRingtones({name: os.path.join(SCRIPT_PATH, path)
+                                                    for name, path in cfg['ringtones'].items()})
                     if 'alarm_clock' in cfg:
                         alarm_clock = []
                         for t in cfg['alarm_clock']:
                             if 'time' in t and 'ringtone' in t:
+                                # Ringtone is the number of a built-in melody or the name of an imported one
+                                ringtone = 'alarm' + str(t['ringtone']) if str(t['ringtone']).isdigit() else str(t['ringtone'])
                                 if 'days_of_week' in t and type(t['days_of_week']) == list:
                                     alarm_clock.append(
-                                        (datetime.strptime(t['time'], '%H:%M'), int(t['ringtone']), t['days_of_week']))
+                                        (datetime.strptime(t['time'], '%H:%M'), ringtone, t['days_of_week']))
                                 else:
-                                    alarm_clock.append((datetime.strptime(t['time'], '%H:%M'), int(t['ringtone'])))
+                                    alarm_clock.append((datetime.strptime(t['time'], '%H:%M'), ringtone))
                                 self._alarm_clock = alarm_clock
+                    if 'metrics' in cfg and type(cfg['metrics']) is dict and self._metrics_exporter is None:
+                        # The exporter is started once, changes of its settings are applied after restart
+                        from pilot_metrics import MetricsExporter
+                        metrics = cfg['metrics']
+                        try:
+                            self._metrics_exporter = MetricsExporter(self._metrics, metrics.get('port'),
+                                                                     metrics.get('address', '127.0.0.1'),
+                                                                     metrics.get('textfile'),
+                                                                     metrics.get('textfile_interval', 15))
+                        except ValueError as e:
+                            print("Error in metrics configuration: {0}".format(e))
+                            failed = True
+                        else:
+                            self._metrics_exporter.start()
                     if not silent:
-                        self._sensors.alarm('config_accept')
+                        self._sensors.alarm('config_fail' if failed else 'config_accept')
         except IOError:
             print("Error reading configuration file")
             if not silent:
@@ -165,13 +308,14 @@ class PilotClock(object):
             if not silent:
                 self._sensors.alarm('config_fail')
 
-    def timeInRange(self, intime=datetime.now(), ranges_list=[]):
+    def timeInRange(self, intime=None, ranges_list=[]):
         """
         The method checks whether the date is included in the list of specified time ranges
-        :param intime: Checking date
+        :param intime: Checking date, the current time if not specified
         :param ranges_list: List of time ranges
         :return: Return True if date included in any time range
         """
+        intime = intime or self._now()
         if type(ranges_list) == list and len(ranges_list) > 0:
             for at in ranges_list:
                 atlen = len(at)
@@ -182,13 +326,14 @@ class PilotClock(object):
                         return True
         return False
 
-    def isAlarmTime(self, intime=datetime.now(), times_list=[]):
+    def isAlarmTime(self, intime=None, times_list=[]):
         """
         Method checks if the time matches any of the alarms
-        :param intime: Checking date
+        :param intime: Checking date, the current time if not specified
         :param times_list: Clock alarms list
         :return: Return True if input time equal any time in alarms list
         """
+        intime = intime or self._now()
         intime = intime.replace(second=0, microsecond=0)
         if type(times_list) is list and len(times_list) > 0:
             for ct in times_list:
@@ -205,57 +350,56 @@ class PilotClock(object):
         Main program loop
         :return:
         """
-        last_conf_read = datetime.now()
+        last_conf_read = self._now()
         self.readConfig(silent=True)
-        self._mute = False if self.timeInRange(datetime.now(), self._alarm_time) else True
+        self._mute = False if self.timeInRange(self._now(), self._alarm_time) else True
         print('Sound:', 'ON' if not self._mute else 'OFF')
 
         show_logo = True
         logo_time = 5
-        logo_show_time = datetime.now()
+        logo_show_time = self._logo_show_time
         last_alarm_clock = None
         term_pos_y = 2
         if self._starting_song:
             if not self._mute:
                 self._sensors.alarm('alarm1')
         while self._loop:
-            self._mute = False if self.timeInRange(datetime.now(), self._alarm_time) else True
-            alarm_clock = self.isAlarmTime(datetime.now(), self._alarm_clock)
+            self._mute = False if self.timeInRange(self._now(), self._alarm_time) else True
+            alarm_clock = self.isAlarmTime(self._now(), self._alarm_clock)
             if alarm_clock is not None and last_alarm_clock != alarm_clock:
                 last_alarm_clock = alarm_clock
-                self._sensors.alarm('alarm'+str(alarm_clock[1]))
+                self._sensors.alarm(alarm_clock[1])
 
-            start_time = datetime.now()
+            start_time = self._now()
             if start_time - last_conf_read > timedelta(seconds=60):
-                last_conf_read = datetime.now()
+                last_conf_read = self._now()
                 self.readConfig()
+            frame_start = perf_counter()
             self._device.contrast(self._sensors.getLight())
+            draw_start = perf_counter()
             with canvas(self._device) as self._draw:
-                if show_logo:
-                    self.drawLogo(0, 6)
-                    if start_time - logo_show_time >= timedelta(seconds=logo_time):
-                        show_logo = False
-                else:
+                if not show_logo:
                     if not self._do_scroll:
                         term_pos_y = term_pos_y + 2 if term_pos_y < 2 else 2
                     else:
                         term_pos_y = term_pos_y - 2 if term_pos_y > -10 else -10
-                    if term_pos_y > -10:
-                        self.drawTherm(1, term_pos_y, 0, 'left')
-                        self.drawTherm(32, term_pos_y, 1, 'right')
-                    self.drawDate(1, 11)
-                    self.drawDayOfWeek(32, 11)
-                    self.drawClock(0, 21)
-                    self.drawSecondsLine(1, 18, 30)
-                    self.drawScrollText(0, 1, self._sensors.getLastFeed())
-            end_time = (datetime.now() - start_time).total_seconds()
+                self.drawFrame(show_logo, term_pos_y)
+                if show_logo and start_time - logo_show_time >= timedelta(seconds=logo_time):
+                    show_logo = False
+                draw_end = perf_counter()
+            frame_end = perf_counter()
+            self._frame_draw.observe(draw_end - draw_start)
+            self._frame_display.observe(draw_start - frame_start + frame_end - draw_end)
+            end_time = (self._now() - start_time).total_seconds()
 
             if self._do_scroll or term_pos_y < 2:
                 if end_time < 1/self._fps:
-                    sleep(1 / self._fps - end_time)
+                    self._sleep(1 / self._fps - end_time)
+                else:
+                    self._frame_overruns.inc()
             else:
                 if end_time < 0.5:
-                    sleep(0.5 - end_time)
+                    self._sleep(0.5 - end_time)
 
     def stop(self):
         """
@@ -263,8 +407,30 @@ class PilotClock(object):
         :return:
         """
         self._loop = False
+        if self._metrics_exporter is not None:
+            self._metrics_exporter.stop()
+            self._metrics_exporter = None
         self._sensors.stopSensors()
 
+    def drawFrame(self, show_logo=False, term_pos_y=2):
+        """
+        Method of rendering a whole frame on the current canvas
+        :param show_logo: Render the logo instead of the clock face
+        :param term_pos_y: Y display coordinate of the temperatures, they are hidden at -10 and above while scrolling
+        :return:
+        """
+        if show_logo:
+            self.drawLogo(0, 6)
+            return
+        if term_pos_y > -10:
+            self.drawTherm(1, term_pos_y, 0, 'left')
+            self.drawTherm(32, term_pos_y, 1, 'right')
+        self.drawDate(1, 11)
+        self.drawDayOfWeek(32, 11)
+        self.drawClock(0, 21)
+        self.drawSecondsLine(1, 18, 30)
+        self.drawScrollText(0, 1, self._sensors.getLastFeed())
+
     def drawTherm(self, x, y, sensor_num=0, align='left'):
         """
         Method of rendering the temperature from thermal sensor
@@ -274,7 +440,7 @@ class PilotClock(object):
         :param align: Text align
         :return:
         """
-        font = THERM_DIGITS_FONT_B
+        font = bitmapFont('therm_digits')
         therms = self._sensors.getTherms()
         drawBText(self._draw, (x, y), str(int(ceil(therms[sensor_num])))+'~', fill='white', font=font, align=align)
 
@@ -285,8 +451,8 @@ class PilotClock(object):
         :param y: Y display coordinate
         :return:
         """
-        font = DIGITS_FONT_SLIM_B
-        now = datetime.now()
+        font = bitmapFont('digits_slim')
+        now = self._now()
         even = floor(now.microsecond / 500000 % 2)
         hh = str(now.hour).zfill(2)
         mm = str(now.minute).zfill(2)
@@ -304,8 +470,8 @@ class PilotClock(object):
         :param align: text align
         :return:
         """
-        font = DATE_OUT_FONT_B
-        now = datetime.now()
+        font = bitmapFont('date_out')
+        now = self._now()
         date = '{0:02d}.{1:02d}'.format(now.day, now.month)
         if self._draw is not None:
             drawBText(self._draw, (x, y), date, fill="white", font=font, align=align)
@@ -318,8 +484,8 @@ class PilotClock(object):
         :param align: text align
         :return:
         """
-        font = DATE_OUT_FONT_B
-        now = datetime.now()
+        font = bitmapFont('date_out')
+        now = self._now()
         days = ['ПН', 'ВТ', 'СР', 'ЧТ', 'ПТ', 'СБ', 'ВС']
         date = '{0}'.format(days[now.weekday()])
         if self._draw is not None:
@@ -333,7 +499,7 @@ class PilotClock(object):
         :param length: sets length of seconds line
         :return:
         """
-        now = datetime.now()
+        now = self._now()
         sofs = int(length/30 * now.second) - length
         sofs = sofs if sofs >= 0 else 0
         eofs = int(length/30 * now.second)
@@ -341,7 +507,7 @@ class PilotClock(object):
         if self._draw is not None and sofs != eofs:
             self._draw.line([(x + sofs, y), (x + eofs - 1, y)], fill="white")
 
-    def drawScrollText(self, x, y, text, offset=45):
+    def drawScrollText(self, x, y, text, offset=RUN_LINE_MARGIN):
         """
         Method of rendering the scrolling line text
         :param x: X display coordinate
@@ -350,17 +516,30 @@ class PilotClock(object):
         :param offset: Starting text offset from left in line
         :return:
         """
-        font = RUN_LINE_FONT_B
+        font = bitmapFont('run_line')
         if text != self._scroll_text:
-            self._scroll_alarm_played = False
-            self._scroll_text_shows_num = 0
+            if text != '' and text == self._cached_text:
+                self._scroll_alarm_played = True
+                self._scroll_text_shows_num = self._cached_shows_num
+            else:
+                self._scroll_alarm_played = False
+                self._scroll_text_shows_num = 0
+                self._sensors.setFeedShown(0)
+            self._cached_text = None
             self._do_scroll = True
             self._scroll_text = text
-            self._scroll_text_size = getBTextSize(self._scroll_text, font=font)
-            self._scroll_text_img = Image.new("1", (self._scroll_text_size[0] + offset * 2, self._scroll_text_size[0]), 0)
-            draw = ImageDraw.Draw(self._scroll_text_img)
-            drawBText(draw, (offset, 0), self._scroll_text, fill="white", font=font)
-            del draw
+            headline = self._sensors.getLastFeedInfo()
+            raster = headline.get('raster')
+            if headline.get('title') == text and raster is not None and raster['margin'] == offset and 'data' in headline:
+                # The image was rendered in advance by the RSS feed reader process
+                self._scroll_text_size = (raster['text_width'], raster['height'])
+                self._scroll_text_img = Image.frombytes("1", (raster['width'], raster['height']), headline['data'])
+            else:
+                self._scroll_text_size = getBTextSize(self._scroll_text, font=font)
+                self._scroll_text_img = Image.new("1", (self._scroll_text_size[0] + offset * 2, self._scroll_text_size[0]), 0)
+                draw = ImageDraw.Draw(self._scroll_text_img)
+                drawBText(draw, (offset, 0), self._scroll_text, fill="white", font=font)
+                del draw
             self._scroll_text_pos_x = offset
         if self._do_scroll:
             if not self._scroll_alarm_played and self._news_alarm:
@@ -373,17 +552,22 @@ class PilotClock(object):
                 self._draw.bitmap((x, y), image.crop((self._scroll_text_pos_x - offset, 0, self._scroll_text_pos_x, 9)), fill="white")
                 self._scroll_text_pos_x += 1
                 if self._scroll_text_pos_x > x + self._scroll_text_size[0] + offset * 2:
-                    self._last_scroll_time = datetime.now()
+                    self._last_scroll_time = self._now()
                     self._do_scroll = False
                     self._scroll_text_pos_x = offset
             else:
                 self._do_scroll = False
                 self._scroll_text_pos_x = offset
         else:
-            self._no_scroll_time = datetime.now() - self._last_scroll_time
-            if self._scroll_text_shows_num < self._scroll_text_show_count and self._no_scroll_time.seconds > self._scroll_repeat_time and self._scroll_text != '':
+            self._no_scroll_time = self._now() - self._last_scroll_time
+            if self._no_scroll_time.seconds > self._scroll_repeat_time and self._sensors.pendingFeeds() > 0:
+                # New headlines are waiting, so the next one is shown instead of repeating the current
+                self._last_scroll_time = self._now()
+                self._sensors.nextFeed()
+            elif self._scroll_text_shows_num < self._scroll_text_show_count and self._no_scroll_time.seconds > self._scroll_repeat_time and self._scroll_text != '':
                 self._do_scroll = True
                 self._scroll_text_shows_num += 1
+                self._sensors.setFeedShown(self._scroll_text_shows_num)
 
     def drawLogo(self, x, y):
         if self._draw is not None:
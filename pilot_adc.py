@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# PCF8591 AD/DA converter library of pilotClock project
+# (c) Hansom 2018
+
+PCF8591_ADDR = 0x48
+ANALOG_OUTPUT_ENABLE = 0b1000000  # 0x40
+AUTO_INCREMENT = 0b0000100        # 0x04
+CHANNELS_NUM = 4
+
+
+class MovingAverage(object):
+    """
+    Mean value of the last N samples
+    """
+
+    def __init__(self, length=1):
+        self._length = max(1, int(length))
+        self._values = []
+        self._sum = 0
+
+    def setLength(self, length):
+        self._length = max(1, int(length))
+        while len(self._values) > self._length:
+            self._sum -= self._values.pop(0)
+
+    def add(self, value):
+        self._values.append(value)
+        self._sum += value
+        if len(self._values) > self._length:
+            self._sum -= self._values.pop(0)
+        return self._sum / len(self._values)
+
+
+class PilotADC(object):
+    """
+    Reader of all four PCF8591 inputs in a single I2C transaction. The control byte with the
+    auto-increment flag is written and five bytes are read back in one combined transfer:
+    the result of the previous conversion followed by AIN0..AIN3
+    """
+
+    def __init__(self, bus, address=PCF8591_ADDR):
+        """
+        :param bus: SMBus object, None in the emulation mode
+        :param address: I2C address of the converter
+        """
+        self._bus = bus
+        self._address = address
+        self._filters = [MovingAverage() for _ in range(CHANNELS_NUM)]
+        self._transactions = 0
+
+    def setFilter(self, channel, length):
+        self._filters[channel].setLength(length)
+
+    def transactions(self):
+        return self._transactions
+
+    def readRaw(self):
+        """
+        Method of reading all input channels
+        :return: List of raw values of AIN0..AIN3 in range from 0 to 255
+        """
+        if self._bus is None:
+            return [0] * CHANNELS_NUM
+        data = self._bus.read_i2c_block_data(self._address, ANALOG_OUTPUT_ENABLE | AUTO_INCREMENT, CHANNELS_NUM + 1)
+        self._transactions += 1
+        return data[1:CHANNELS_NUM + 1]
+
+    def read(self):
+        """
+        Method of reading all input channels with filtering
+        :return: Tuple of lists (raw values, filtered values) of AIN0..AIN3
+        """
+        raw = self.readRaw()
+        return raw, [f.add(v) for f, v in zip(self._filters, raw)]
+
+
+class AnalogSensor(object):
+    """
+    Description of a generic sensor connected to one of the converter inputs
+    """
+
+    def __init__(self, name, channel, scale=1.0, offset=0.0, filter_length=1):
+        """
+        :param name: Sensor name
+        :param channel: Input channel number from 0 to 3
+        :param scale: Multiplier of the raw value
+        :param offset: Value added after scaling
+        :param filter_length: Number of samples of the moving average filter
+        """
+        if not 0 <= int(channel) < CHANNELS_NUM:
+            raise ValueError('Wrong analog channel: {0}'.format(channel))
+        self.name = name
+        self.channel = int(channel)
+        self.scale = float(scale)
+        self.offset = float(offset)
+        self.filter_length = max(1, int(filter_length))
+
+    def value(self, raw):
+        return raw * self.scale + self.offset
@@ -4,8 +4,6 @@
 # Font library of pilotClock project
 # (c) Hansom 2018
 
-from PIL import Image, ImageDraw
-
 
 def font2bitmapFont(font=[], font_height=8):
     """
@@ -15,6 +13,8 @@ def font2bitmapFont(font=[], font_height=8):
     :param font_height: Font height
     :return: List of letter images
     """
+    # PIL is imported here, so the processes rendering text with rasterizeText do not load it
+    from PIL import Image, ImageDraw
     bitmap_font = []
     for letter in font:
         bmp = Image.new("1", (len(letter), font_height), 0)
@@ -30,6 +30,35 @@ def font2bitmapFont(font=[], font_height=8):
     return bitmap_font
 
 
+def rasterizeText(txt, font=None, font_height=9, margin=0):
+    """
+    Method for rendering text directly from Luma font bit patterns, without PIL,
+    into packed bits of a 1-bit image as accepted by Image.frombytes('1', ...)
+
+    :param txt: Text
+    :param font: Luma font bit pattern, RUN_LINE_FONT by default
+    :param font_height: Font height
+    :param margin: Empty space in pixels added on the left and right of the text
+    :return: Tuple (text width, image width, image height, bytes of rows packed MSB first)
+    """
+    font = font or RUN_LINE_FONT
+    columns = []
+    for ch in txt.encode('iso8859-5', errors='replace'):
+        columns.extend(font[ch])
+    text_width = len(columns)
+    width = text_width + margin * 2
+    row_size = (width + 7) // 8
+    rows = []
+    for y in range(font_height):
+        row = bytearray(row_size)
+        mask = 1 << y
+        for x, byte in enumerate(columns, margin):
+            if byte & mask:
+                row[x >> 3] |= 0x80 >> (x & 7)
+        rows.append(bytes(row))
+    return text_width, width, font_height, b''.join(rows)
+
+
 #: Bit patterns for the pilotClock Digits, font height = 10
 DIGITS_FONT = [
     [0x0000, 0x0000, 0x0000, 0x0000, 0x0000, 0x0000, 0x0000, 0x0000],  # 0x00
@@ -1070,6 +1099,10 @@ DATE_OUT_FONT = [
     [0x00, 0x00, 0x00, 0x00],                    # 0xFF 'џ'
 ]
 
+#: Height of the Run Line font and the empty space around the scrolling text
+RUN_LINE_HEIGHT = 9
+RUN_LINE_MARGIN = 45
+
 #: Bit patterns for the pilotClock Run Line, ISO/IEC 8859-5 encoding, font height = 9
 RUN_LINE_FONT = [
     [0x0000, 0x0000, 0x0000, 0x0000, 0x0000],                    # 0x00
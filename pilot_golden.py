@@ -0,0 +1,292 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Golden frames library of pilotClock project
+# (c) Hansom 2018
+#
+# Regression check of what the display shows. Known states (times, dates, temperatures, headlines and
+# scroll positions, with the run line drawn by the clock and rendered in advance by the RSS process) are
+# rendered through the headless clock and compared with the stored golden frames
+# in the packed form of the 32x32 display, 128 bytes per frame. The digest of all rendered frames is
+# compared first, the frames are compared one by one only when it differs
+#
+# Usage: pilot_golden.py [check|record|show NAME]
+
+import os
+import sys
+import gzip
+import json
+import hashlib
+from time import perf_counter
+from datetime import datetime
+from PIL import Image, ImageDraw
+
+GOLDEN_VERSION = 1
+GOLDEN_PATH = os.path.join(os.path.abspath(os.path.dirname(__file__)), 'golden-frames.json.gz')
+FRAME_SIZE = (32, 32)
+
+GOLDEN_HEADLINES = [
+    'Синоптики обещают тёплые выходные: до +25 °C',
+    'Pi 3 Model B+ & 802.11ac: 1.4 GHz, 5 GHz Wi-Fi!',
+    '0123456789 «Цитата» — №1, 50% (x/y) [a-z] {ok}?',
+]
+
+
+def goldenCases():
+    """
+    Method of listing the rendered states
+    :return: List of tuples (case name, dictionary of GoldenRenderer.render parameters)
+    """
+    cases = [('logo', {'logo': True})]
+    base = datetime(2018, 1, 1)
+    # Every minute and hour digits, with and without the blinking colon
+    for minute in range(60):
+        hour = minute % 24
+        for microsecond in (0, 500000):
+            now = base.replace(hour=hour, minute=minute, microsecond=microsecond)
+            cases.append(('clock/{0:%H:%M}.{1}'.format(now, microsecond // 500000), {'now': now}))
+    # Every length of the seconds line
+    for second in range(60):
+        now = base.replace(hour=12, second=second)
+        cases.append(('seconds/{0:02d}'.format(second), {'now': now}))
+    # Every day and month digits and every day of week, including the leap day
+    for day in range(1, 32):
+        now = datetime(2018, 1, day, 12)
+        cases.append(('date/{0:%Y-%m-%d}'.format(now), {'now': now}))
+    for month in range(2, 13):
+        now = datetime(2018, month, 15, 12)
+        cases.append(('date/{0:%Y-%m-%d}'.format(now), {'now': now}))
+    cases.append(('date/2020-02-29', {'now': datetime(2020, 2, 29, 12)}))
+    # Temperatures of both sensors, rounded up to integers
+    for temp in range(-40, 51):
+        therms = (float(temp), float(-temp) - 0.5)
+        cases.append(('therm/{0:+d}'.format(temp), {'now': base, 'therms': therms}))
+    # Temperatures sliding out when the run line starts
+    for term_pos_y in range(2, -12, -2):
+        cases.append(('therm-slide/{0:+d}'.format(term_pos_y),
+                      {'now': base, 'headline': GOLDEN_HEADLINES[0], 'scroll_pos': 0, 'term_pos_y': term_pos_y}))
+    # Every position of the run line, drawn by the clock and rendered in advance by the RSS process
+    for num, headline in enumerate(GOLDEN_HEADLINES):
+        for pos in range(GoldenRenderer.scrollLength(headline)):
+            cases.append(('scroll/{0}/{1:03d}'.format(num, pos),
+                          {'now': base, 'headline': headline, 'scroll_pos': pos, 'term_pos_y': -10}))
+    for num, headline in enumerate(GOLDEN_HEADLINES):
+        for pos in range(GoldenRenderer.scrollLength(headline)):
+            cases.append(('scroll-raster/{0}/{1:03d}'.format(num, pos),
+                          {'now': base, 'headline': headline, 'scroll_pos': pos, 'term_pos_y': -10, 'raster': True}))
+    return cases
+
+
+class GoldenRenderer(object):
+    """
+    Rendering of the clock states into packed frames. The frames are drawn by PilotClock.drawFrame,
+    the same method the main loop uses, into a fresh image the way luma canvas does
+    """
+
+    def __init__(self):
+        from pilot import PilotClock
+        from pilot_sim import VirtualClock, ScriptedSensors
+
+        self._clock = VirtualClock(datetime(2018, 1, 1))
+        self._events = []
+        self._sensors = ScriptedSensors(self._clock, self._events)
+        self._pilot = PilotClock(headless=True, sensors=self._sensors, now=self._clock.now, sleeper=self._clock.sleep)
+        self._pilot._fonts_thread.join()
+        self._pilot._mute = True
+        self._channel = None
+        self._headline_key = None
+
+    @staticmethod
+    def scrollLength(headline):
+        """
+        Method of obtaining the number of scroll positions of a headline
+        :param headline: Headline text
+        :return: Number of frames of one pass of the run line
+        """
+        from pilot import getBTextSize
+        from pilot_fonts import RUN_LINE_MARGIN
+        return getBTextSize(headline)[0] + RUN_LINE_MARGIN + 1
+
+    def _receiveHeadline(self, headline):
+        """
+        Method of passing a headline the way the RSS process publishes it, with its run line image
+        :param headline: Headline text
+        :return: Headline dictionary received from the channel
+        """
+        from pilot_state import MessageChannel
+        from pilot_workers import headlineCapacity, publishHeadline
+        if self._channel is None:
+            self._channel = MessageChannel(headlineCapacity(len(max(GOLDEN_HEADLINES, key=len))))
+        publishHeadline(self._channel, {'title': headline})
+        received = self._channel.receive()
+        if 'data' not in received:
+            raise ValueError('Headline was published without the run line image: {0}'.format(headline))
+        return received
+
+    def _setHeadline(self, headline, scroll_pos, raster=False):
+        pilot = self._pilot
+        if not headline:
+            self._sensors._headline = {}
+        elif (headline, raster) != self._headline_key:
+            self._sensors._headline = self._receiveHeadline(headline) if raster else {'title': headline}
+            # Without a canvas only the run line image is prepared
+            draw, pilot._draw = pilot._draw, None
+            pilot._scroll_text = None
+            pilot.drawScrollText(0, 1, headline)
+            pilot._draw = draw
+        self._headline_key = (headline, raster) if headline else None
+        pilot._scroll_text = headline
+        pilot._cached_text = None
+        pilot._scroll_alarm_played = True
+        pilot._scroll_text_shows_num = pilot._scroll_text_show_count
+        pilot._last_scroll_time = self._clock.now()
+        if scroll_pos is None:
+            pilot._do_scroll = False
+        else:
+            from pilot_fonts import RUN_LINE_MARGIN
+            pilot._do_scroll = True
+            pilot._scroll_text_pos_x = RUN_LINE_MARGIN + scroll_pos
+
+    def render(self, now=None, therms=(20.0, -5.0), headline='', scroll_pos=None, term_pos_y=2, logo=False,
+               raster=False):
+        """
+        Method of rendering a state of the clock
+        :param now: Local time
+        :param therms: Temperatures of the sensors
+        :param headline: Headline of the run line
+        :param scroll_pos: Scroll position of the headline, None if it is not scrolling
+        :param term_pos_y: Y display coordinate of the temperatures
+        :param logo: Render the logo
+        :param raster: The run line image is rendered in advance and passed through the headlines channel
+        :return: Packed frame, 128 bytes
+        """
+        self._clock.set(now or datetime(2018, 1, 1))
+        self._sensors._therms = tuple(therms)
+        self._setHeadline(headline, scroll_pos, raster)
+        image = Image.new('1', FRAME_SIZE)
+        self._pilot._draw = ImageDraw.Draw(image)
+        self._pilot.drawFrame(logo, term_pos_y)
+        self._pilot._draw = None
+        return image.tobytes()
+
+    def renderAll(self, cases):
+        """
+        Method of rendering a list of cases
+        :param cases: List of tuples (case name, render parameters)
+        :return: List of packed frames
+        """
+        del self._events[:]
+        return [self.render(**params) for _, params in cases]
+
+
+def framesDigest(frames):
+    digest = hashlib.sha1()
+    for frame in frames:
+        digest.update(frame)
+    return digest.hexdigest()
+
+
+def loadGolden(path=GOLDEN_PATH):
+    """
+    Method of reading the golden frames
+    :param path: Path of the file
+    :return: Tuple (digest, list of case names, dictionary {case name: packed frame}),
+             None if there is no file of this version
+    """
+    try:
+        with gzip.open(path, mode='rt', encoding='utf-8') as f:
+            golden = json.loads(f.read())
+    except (IOError, OSError, ValueError):
+        return None
+    if golden.get('version') != GOLDEN_VERSION:
+        return None
+    names = [name for name, _ in golden['frames']]
+    frames = [bytes.fromhex(frame) for _, frame in golden['frames']]
+    digest = framesDigest(frames)
+    if digest != golden.get('digest'):
+        print('Digest of the golden frames does not match their content, the file was edited')
+    return digest, names, dict(zip(names, frames))
+
+
+def saveGolden(names, frames, path=GOLDEN_PATH):
+    """
+    Method of writing the golden frames, the file is the same for the same frames
+    :param names: Case names
+    :param frames: Packed frames
+    :param path: Path of the file
+    :return:
+    """
+    text = json.dumps({'version': GOLDEN_VERSION, 'digest': framesDigest(frames),
+                       'frames': [[name, frame.hex()] for name, frame in zip(names, frames)]}, indent=0)
+    with open(path, mode='wb') as f:
+        with gzip.GzipFile(fileobj=f, mode='wb', mtime=0) as gz:
+            gz.write(text.encode('utf-8'))
+
+
+def frameText(frame):
+    """
+    Method of showing a packed frame as text, one line per display row
+    :param frame: Packed frame
+    :return: List of lines
+    """
+    width = FRAME_SIZE[0] // 8
+    return [''.join('#' if frame[row * width + col // 8] & (0x80 >> col % 8) else '.' for col in range(FRAME_SIZE[0]))
+            for row in range(FRAME_SIZE[1])]
+
+
+def checkGolden(path=GOLDEN_PATH, renderer=None, show=3):
+    """
+    Method of checking the rendered frames against the golden ones
+    :param path: Path of the golden frames
+    :param renderer: GoldenRenderer, a new one if not specified
+    :param show: Number of the mismatched frames printed
+    :return: List of names of the mismatched cases, None if there are no golden frames
+    """
+    golden = loadGolden(path)
+    if golden is None:
+        print('No golden frames of version {0} in {1}'.format(GOLDEN_VERSION, path))
+        return None
+    digest, golden_names, golden_frames = golden
+    renderer = renderer or GoldenRenderer()
+    cases = goldenCases()
+    bench = perf_counter()
+    frames = renderer.renderAll(cases)
+    matched = framesDigest(frames) == digest and [name for name, _ in cases] == golden_names
+    render_time = perf_counter() - bench
+    print('{0} frames rendered in {1:.3f} s, {2:.0f} frames per second'.format(
+        len(frames), render_time, len(frames) / render_time))
+    if matched:
+        return []
+    failed = [name for (name, _), frame in zip(cases, frames) if golden_frames.get(name) != frame]
+    names = set(name for name, _ in cases)
+    failed += [name for name in golden_names if name not in names]
+    rendered = dict((name, frame) for (name, _), frame in zip(cases, frames))
+    for name in failed[:show]:
+        print('Mismatch: {0}'.format(name))
+        expected = frameText(golden_frames[name]) if name in golden_frames else ['(missing)'] * FRAME_SIZE[1]
+        actual = frameText(rendered[name]) if name in rendered else ['(missing)'] * FRAME_SIZE[1]
+        print('  {0:32s}  {1}'.format('golden', 'rendered'))
+        for left, right in zip(expected, actual):
+            print('  {0:32s}  {1}'.format(left, right))
+    return failed
+
+
+if __name__ == "__main__":
+    command = sys.argv[1] if len(sys.argv) > 1 else 'check'
+    if command == 'record':
+        cases = goldenCases()
+        frames = GoldenRenderer().renderAll(cases)
+        saveGolden([name for name, _ in cases], frames)
+        print('{0} golden frames recorded to {1}'.format(len(frames), GOLDEN_PATH))
+    elif command == 'show' and len(sys.argv) > 2:
+        params = dict(goldenCases()).get(sys.argv[2])
+        if params is None:
+            print('Unknown case {0}'.format(sys.argv[2]))
+            sys.exit(2)
+        print('\n'.join(frameText(GoldenRenderer().render(**params))))
+    else:
+        failed = checkGolden()
+        if failed is None:
+            sys.exit(2)
+        print('{0} mismatched frames'.format(len(failed)) if failed else 'All frames match the golden ones')
+        sys.exit(1 if failed else 0)
@@ -0,0 +1,355 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Sensors history library of pilotClock project
+# (c) Hansom 2018
+
+import os
+import time
+import mmap
+import struct
+from math import inf
+from multiprocessing.sharedctypes import RawArray, RawValue
+from ctypes import c_double, c_long, c_ulong
+
+# Aggregation levels: (name, bucket length in seconds, number of buckets)
+AGGREGATE_LEVELS = (('1m', 60, 24 * 60),   # minutes of the last day
+                    ('1h', 3600, 24 * 7),  # hours of the last week
+                    ('1d', 86400, 31))     # days of the last month
+
+
+class SensorSeries(object):
+    """
+    Fixed-size ring buffer of (timestamp, value) samples with min/max/mean aggregates.
+    All buffers are allocated in shared memory before the sensor processes are started,
+    so only one process may write to the series while any other process reads it without locks.
+    A reader never sees a torn record: the writer publishes a sample by advancing the head
+    after the record is stored, and every aggregate bucket has a sequence counter, odd while
+    the bucket is updated, so a reader retries the bucket if the counter was odd or changed
+    """
+    _read_retries = 100
+
+    def __init__(self, size=3600, levels=AGGREGATE_LEVELS):
+        """
+        :param size: Number of raw samples kept
+        :param levels: Aggregation levels in format (name, bucket length in seconds, number of buckets)
+        """
+        self._size = size
+        self._ts = RawArray(c_double, size)
+        self._val = RawArray(c_double, size)
+        self._head = RawValue(c_ulong, 0)  # Total number of samples ever written
+        self._levels = {}
+        for name, period, count in levels:
+            self._levels[name] = (period, count,
+                                  RawArray(c_ulong, count),   # bucket sequence, odd while bucket is updated
+                                  RawArray(c_long, count),    # bucket start
+                                  RawArray(c_double, count),  # min
+                                  RawArray(c_double, count),  # max
+                                  RawArray(c_double, count),  # sum
+                                  RawArray(c_ulong, count))   # samples count
+
+    def append(self, value, ts=None):
+        """
+        Method of adding a new sample, must be called from the single writer process
+        :param value: Sample value
+        :param ts: Sample timestamp, current time if not specified
+        :return:
+        """
+        ts = time.time() if ts is None else ts
+        head = self._head.value
+        pos = head % self._size
+        self._ts[pos] = ts
+        self._val[pos] = value
+        self._head.value = head + 1
+        for period, count, seqs, starts, mins, maxs, sums, nums in self._levels.values():
+            start = int(ts // period) * period
+            i = (start // period) % count
+            seqs[i] += 1
+            if starts[i] != start:
+                starts[i] = start
+                mins[i] = value
+                maxs[i] = value
+                sums[i] = value
+                nums[i] = 1
+            else:
+                mins[i] = min(mins[i], value)
+                maxs[i] = max(maxs[i], value)
+                sums[i] += value
+                nums[i] += 1
+            seqs[i] += 1
+
+    def __len__(self):
+        return min(self._head.value, self._size)
+
+    def latest(self):
+        """
+        Method of obtaining the last sample
+        :return: Tuple (timestamp, value) or None if the series is empty
+        """
+        head = self._head.value
+        if head == 0:
+            return None
+        pos = (head - 1) % self._size
+        return self._ts[pos], self._val[pos]
+
+    def samples(self, since=None):
+        """
+        Generator of raw samples from the oldest to the newest
+        :param since: Skip samples older than this timestamp
+        :return: Tuples (timestamp, value)
+        """
+        head = self._head.value
+        # The oldest quarter of the buffer may be overwritten by the writer while iterating
+        first = max(0, head - self._size + self._size // 4)
+        for n in range(first, head):
+            pos = n % self._size
+            ts = self._ts[pos]
+            if since is None or ts >= since:
+                yield ts, self._val[pos]
+
+    def aggregates(self, level='1m', count=None, now=None):
+        """
+        Method of obtaining downsampled values
+        :param level: Aggregation level name ('1m', '1h' or '1d')
+        :param count: Number of last buckets, all buckets of the level if not specified
+        :param now: Current timestamp
+        :return: List of tuples (bucket start, min, max, mean) from the oldest to the newest, empty buckets skipped
+        """
+        period, size, seqs, starts, mins, maxs, sums, nums = self._levels[level]
+        now = time.time() if now is None else now
+        count = size if count is None else min(count, size)
+        last = int(now // period) * period
+        result = []
+        for start in range(last - (count - 1) * period, last + period, period):
+            i = (start // period) % size
+            for _ in range(self._read_retries):
+                seq = seqs[i]
+                if seq & 1:
+                    continue
+                rec = (starts[i], mins[i], maxs[i], sums[i], nums[i])
+                if seqs[i] == seq:
+                    if rec[0] == start:
+                        result.append((start, rec[1], rec[2], rec[3] / rec[4] if rec[4] else 0.0))
+                    break
+        return result
+
+    def extremes(self, seconds, level='1m', now=None):
+        """
+        Method of obtaining the min and max value for a time interval
+        :param seconds: Length of the interval before now
+        :param level: Aggregation level used for calculation
+        :param now: Current timestamp
+        :return: Tuple (min, max) or None if there is no data
+        """
+        period = self._levels[level][0]
+        aggr = self.aggregates(level, int(seconds // period) + 1, now)
+        if not aggr:
+            return None
+        low, high = inf, -inf
+        for _, amin, amax, _ in aggr:
+            low = min(low, amin)
+            high = max(high, amax)
+        return low, high
+
+    def trend(self, seconds=600, now=None):
+        """
+        Method of obtaining the change of value for a time interval, used for trend arrows
+        :param seconds: Length of the interval before now
+        :param now: Current timestamp
+        :return: Difference between the newest and the first sample of the interval, 0 if there is no data
+        """
+        now = time.time() if now is None else now
+        first = None
+        for ts, val in self.samples(now - seconds):
+            first = val
+            break
+        last = self.latest()
+        return last[1] - first if first is not None and last is not None else 0.0
+
+
+class PilotHistory(object):
+    """
+    Named set of sensor series shared between the sensor processes and the render process
+    """
+
+    def __init__(self, names, size=3600, levels=AGGREGATE_LEVELS):
+        self._series = {name: SensorSeries(size, levels) for name in names}
+
+    def __getitem__(self, name):
+        return self._series[name]
+
+    def __contains__(self, name):
+        return name in self._series
+
+    def names(self):
+        return list(self._series.keys())
+
+    def append(self, name, value, ts=None):
+        if name in self._series:
+            self._series[name].append(value, ts)
+
+
+class SensorLog(object):
+    """
+    Persistent log of one sensor in fixed-size binary records (int32 timestamp, int16 value * 100).
+    Records are buffered and appended in batches to spare the SD card, the file is rotated by size
+    keeping one previous part. Queries read the files through mmap, so they never load the log into memory
+    """
+    RECORD = struct.Struct('<ih')
+    SCALE = 100
+
+    def __init__(self, path, max_size=1024 * 1024, batch_size=64, flush_interval=600):
+        """
+        :param path: Path of the log file
+        :param max_size: Size of the log file in bytes at which it is rotated
+        :param batch_size: Number of buffered records that forces writing to the disk
+        :param flush_interval: Max time in seconds the records stay buffered
+        """
+        self._path = path
+        self._max_size = max_size
+        self._batch_size = batch_size
+        self._flush_interval = flush_interval
+        self._buffer = []
+        self._last_flush = time.monotonic()
+
+    def append(self, value, ts=None):
+        """
+        Method of adding a record, must be called from the single writer process
+        :param value: Sensor value
+        :param ts: Record timestamp, current time if not specified
+        :return:
+        """
+        ts = time.time() if ts is None else ts
+        value = max(-32768, min(32767, int(round(value * self.SCALE))))
+        self._buffer.append(self.RECORD.pack(int(ts), value))
+        if len(self._buffer) >= self._batch_size or time.monotonic() - self._last_flush >= self._flush_interval:
+            self.flush()
+
+    def flush(self):
+        """
+        Method of writing the buffered records to the disk
+        :return:
+        """
+        self._last_flush = time.monotonic()
+        if not self._buffer:
+            return
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(self._path)), exist_ok=True)
+            with open(self._path, 'ab') as f:
+                size = f.tell()
+                if size % self.RECORD.size:
+                    # Drop the tail of a record torn by power loss
+                    f.truncate(size - size % self.RECORD.size)
+                f.write(b''.join(self._buffer))
+                size = f.tell()
+            self._buffer = []
+            if size >= self._max_size:
+                os.replace(self._path, self._path + '.1')
+        except (IOError, OSError):
+            print('Error writing sensor log', self._path)
+
+    def _parts(self):
+        return [self._path + '.1', self._path]
+
+    def _search(self, mm, count, ts):
+        # Records are appended in time order, so the first record not older than ts is found by bisection
+        lo, hi = 0, count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.RECORD.unpack_from(mm, mid * self.RECORD.size)[0] < ts:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def records(self, since=0, until=None):
+        """
+        Generator of the logged records in a time range
+        :param since: Start timestamp
+        :param until: End timestamp, current time if not specified
+        :return: Tuples (timestamp, value)
+        """
+        until = time.time() if until is None else until
+        for part in self._parts():
+            try:
+                with open(part, 'rb') as f:
+                    count = os.fstat(f.fileno()).st_size // self.RECORD.size
+                    if count == 0:
+                        continue
+                    mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                    try:
+                        for n in range(self._search(mm, count, since), count):
+                            ts, value = self.RECORD.unpack_from(mm, n * self.RECORD.size)
+                            if ts > until:
+                                break
+                            yield ts, value / self.SCALE
+                    finally:
+                        mm.close()
+            except (IOError, OSError, ValueError):
+                continue
+
+    def downsample(self, since, until=None, period=3600):
+        """
+        Method of obtaining min/max/mean values of the logged records
+        :param since: Start timestamp
+        :param until: End timestamp, current time if not specified
+        :param period: Bucket length in seconds
+        :return: List of tuples (bucket start, min, max, mean)
+        """
+        result = []
+        bucket = None
+        for ts, value in self.records(since, until):
+            start = int(ts // period) * period
+            if bucket is None or bucket[0] != start:
+                if bucket is not None:
+                    result.append((bucket[0], bucket[1], bucket[2], bucket[3] / bucket[4]))
+                bucket = [start, value, value, 0.0, 0]
+            bucket[1] = min(bucket[1], value)
+            bucket[2] = max(bucket[2], value)
+            bucket[3] += value
+            bucket[4] += 1
+        if bucket is not None:
+            result.append((bucket[0], bucket[1], bucket[2], bucket[3] / bucket[4]))
+        return result
+
+    def extremes(self, seconds, now=None):
+        """
+        Method of obtaining the min and max logged value for a time interval
+        :param seconds: Length of the interval before now
+        :param now: Current timestamp
+        :return: Tuple (min, max) or None if there is no data
+        """
+        now = time.time() if now is None else now
+        low, high = inf, -inf
+        for _, value in self.records(now - seconds, now):
+            low = min(low, value)
+            high = max(high, value)
+        return (low, high) if low <= high else None
+
+
+if __name__ == "__main__":
+    series = SensorSeries(600)
+    start = time.time() - 86400 * 2
+    bench = time.monotonic()
+    for n in range(86400 * 2 // 10):
+        series.append(20 + (n % 360) / 36, start + n * 10)
+    print('Appending {0} samples: {1:.3f} s'.format(86400 * 2 // 10, time.monotonic() - bench))
+    bench = time.monotonic()
+    print('Last 24 h extremes:', series.extremes(86400, '1h'))
+    print('Last 5 min:', series.aggregates('1m', 5))
+    print('Trend 10 min: {0:+.2f}'.format(series.trend(600)))
+    print('Queries: {0:.4f} s'.format(time.monotonic() - bench))
+
+    import tempfile
+    with tempfile.TemporaryDirectory() as tmp:
+        log = SensorLog(os.path.join(tmp, 'therm1.log'), max_size=64 * 1024)
+        bench = time.monotonic()
+        for n in range(86400 * 2 // 10):
+            log.append(-5 + (n % 360) / 36, start + n * 10)
+        log.flush()
+        print('Logging {0} records: {1:.3f} s, files: {2}'.format(86400 * 2 // 10, time.monotonic() - bench,
+                                                                 sorted(os.listdir(tmp))))
+        bench = time.monotonic()
+        print('Logged last 24 h extremes:', log.extremes(86400, start + 86400 * 2))
+        print('Logged 6 h buckets:', len(log.downsample(start, period=6 * 3600)))
+        print('Queries: {0:.4f} s'.format(time.monotonic() - bench))
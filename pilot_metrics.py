@@ -0,0 +1,286 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Metrics library of pilotClock project
+# (c) Hansom 2018
+#
+# Counters, gauges and histograms kept in shared memory, so the sensor processes update them directly
+# and the main process exposes all of them in Prometheus text format. Every metric has a single writer
+# process, updates take no locks
+
+import os
+import time
+import threading
+from bisect import bisect_left
+from ctypes import c_double
+from multiprocessing.sharedctypes import RawArray
+
+# Bucket bounds in seconds
+FAST_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+SLOW_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _formatValue(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class Counter(object):
+    kind = 'counter'
+
+    def __init__(self, name, doc):
+        self.name = name
+        self.doc = doc
+        self._value = RawArray(c_double, 1)
+
+    def inc(self, amount=1):
+        self._value[0] += amount
+
+    def value(self):
+        return self._value[0]
+
+    def samples(self):
+        return [(self.name, self._value[0])]
+
+
+class Gauge(Counter):
+    kind = 'gauge'
+
+    def set(self, value):
+        self._value[0] = value
+
+
+class Histogram(object):
+    """
+    Histogram of observed values, the buckets are stored non-cumulative and summed on exposition
+    """
+    kind = 'histogram'
+
+    def __init__(self, name, doc, buckets=FAST_BUCKETS):
+        self.name = name
+        self.doc = doc
+        self._bounds = tuple(buckets)
+        # Buckets, the last one is +Inf, then sum and count
+        self._data = RawArray(c_double, len(self._bounds) + 3)
+
+    def observe(self, value):
+        data = self._data
+        data[bisect_left(self._bounds, value)] += 1
+        data[-2] += value
+        data[-1] += 1
+
+    def time(self):
+        """
+        Method of measuring a code block: with histogram.time(): ...
+        """
+        return _Timer(self)
+
+    def count(self):
+        return self._data[-1]
+
+    def sum(self):
+        return self._data[-2]
+
+    def samples(self):
+        data = self._data[:]
+        samples = []
+        total = 0
+        for bound, hits in zip(self._bounds + (float('inf'),), data):
+            total += hits
+            samples.append(('{0}_bucket{{le="{1}"}}'.format(self.name, _formatValue(bound)), total))
+        samples.append((self.name + '_sum', data[-2]))
+        samples.append((self.name + '_count', data[-1]))
+        return samples
+
+
+class _Timer(object):
+    __slots__ = ('_histogram', '_start')
+
+    def __init__(self, histogram):
+        self._histogram = histogram
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        self._histogram.observe(time.perf_counter() - self._start)
+
+
+class PilotMetrics(object):
+    """
+    Registry of the metrics. Metrics must be created before the processes updating them are started,
+    values computed at scrape time are added as collectors
+    """
+
+    def __init__(self, prefix='pilot_clock_'):
+        self._prefix = prefix
+        self._metrics = []
+        self._names = {}
+        self._collectors = []
+
+    def __getstate__(self):
+        # Collectors are functions of the main process, the worker processes need only the metrics
+        return {'_prefix': self._prefix, '_metrics': self._metrics, '_names': self._names, '_collectors': []}
+
+    def _add(self, metric):
+        if metric.name in self._names:
+            return self._names[metric.name]
+        self._metrics.append(metric)
+        self._names[metric.name] = metric
+        return metric
+
+    def __getitem__(self, name):
+        return self._names[self._prefix + name]
+
+    def counter(self, name, doc):
+        return self._add(Counter(self._prefix + name, doc))
+
+    def gauge(self, name, doc):
+        return self._add(Gauge(self._prefix + name, doc))
+
+    def histogram(self, name, doc, buckets=FAST_BUCKETS):
+        return self._add(Histogram(self._prefix + name, doc, buckets))
+
+    def addCollector(self, name, kind, doc, collect):
+        """
+        Method of adding a metric computed at scrape time
+        :param name: Metric name without the prefix
+        :param kind: Prometheus metric type: counter or gauge
+        :param doc: Metric description
+        :param collect: Function returning a list of (labels dictionary, value)
+        :return:
+        """
+        self._collectors.append((self._prefix + name, kind, doc, collect))
+
+    def exposition(self):
+        """
+        Method of rendering all metrics in Prometheus text format
+        :return: Text of the exposition
+        """
+        lines = []
+        for metric in self._metrics:
+            lines.append('# HELP {0} {1}'.format(metric.name, metric.doc))
+            lines.append('# TYPE {0} {1}'.format(metric.name, metric.kind))
+            lines += ['{0} {1}'.format(name, _formatValue(value)) for name, value in metric.samples()]
+        for name, kind, doc, collect in self._collectors:
+            try:
+                samples = collect()
+            except Exception as e:
+                print('Error collecting metric {0}: {1}'.format(name, e))
+                continue
+            lines.append('# HELP {0} {1}'.format(name, doc))
+            lines.append('# TYPE {0} {1}'.format(name, kind))
+            for labels, value in samples:
+                if value is None:
+                    continue
+                label_text = ','.join('{0}="{1}"'.format(k, v) for k, v in sorted(labels.items()))
+                lines.append('{0}{1} {2}'.format(name, '{' + label_text + '}' if label_text else '', _formatValue(value)))
+        return '\n'.join(lines) + '\n'
+
+
+class MetricsExporter(object):
+    """
+    Exposition of the metrics on a local HTTP port and/or in a file for the textfile collector of node_exporter
+    """
+
+    def __init__(self, metrics, port=None, address='127.0.0.1', textfile=None, textfile_interval=15):
+        """
+        :param metrics: PilotMetrics registry
+        :param port: HTTP port, the server is not started if not specified
+        :param address: Address the HTTP server listens on
+        :param textfile: Path of the .prom file, it is not written if not specified
+        :param textfile_interval: Interval of the file updates in seconds
+        :raises ValueError: The port or the interval is invalid
+        """
+        try:
+            port = int(port) if port else None
+            textfile_interval = float(textfile_interval)
+        except (ValueError, TypeError):
+            raise ValueError('Invalid metrics port {0} or textfile interval {1}'.format(port, textfile_interval))
+        if port is not None and not 0 < port < 65536 or textfile_interval <= 0:
+            raise ValueError('Invalid metrics port {0} or textfile interval {1}'.format(port, textfile_interval))
+        self._metrics = metrics
+        self._port = port
+        self._address = address
+        self._textfile = textfile
+        self._textfile_interval = textfile_interval
+        self._server = None
+        self._stop = threading.Event()
+
+    def start(self):
+        if self._port:
+            from http.server import HTTPServer, BaseHTTPRequestHandler
+            metrics = self._metrics
+
+            class Handler(BaseHTTPRequestHandler):
+                def do_GET(self):
+                    body = metrics.exposition().encode('utf-8')
+                    self.send_response(200)
+                    self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                    self.send_header('Content-Length', str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+
+                def log_message(self, *args):
+                    pass
+
+            try:
+                self._server = HTTPServer((self._address, self._port), Handler)
+            except (OSError, TypeError) as e:
+                print('Error starting metrics server: {0}'.format(e))
+            else:
+                threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        if self._textfile:
+            threading.Thread(target=self._writeLoop, daemon=True).start()
+
+    def writeTextfile(self):
+        tmp_path = self._textfile + '.tmp'
+        try:
+            with open(tmp_path, mode='w', encoding='utf-8') as f:
+                f.write(self._metrics.exposition())
+            os.replace(tmp_path, self._textfile)
+        except (IOError, OSError):
+            print('Error writing metrics file')
+
+    def _writeLoop(self):
+        while not self._stop.wait(self._textfile_interval):
+            self.writeTextfile()
+
+    def stop(self):
+        self._stop.set()
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+
+def frameOverhead(n=100000):
+    """
+    Method of measuring the cost of the instrumentation of one frame: four clock readings,
+    two histogram observations and a counter increment
+    :param n: Number of the measured frames
+    :return: Time in seconds per frame
+    """
+    metrics = PilotMetrics()
+    draw = metrics.histogram('frame_draw_seconds', 'Frame drawing time')
+    display = metrics.histogram('frame_display_seconds', 'Frame writing time')
+    overruns = metrics.counter('frame_overruns_total', 'Frame overruns')
+    perf_counter = time.perf_counter
+    bench = perf_counter()
+    for _ in range(n):
+        frame_start = perf_counter()
+        draw_start = perf_counter()
+        draw_end = perf_counter()
+        frame_end = perf_counter()
+        draw.observe(draw_end - draw_start)
+        display.observe(draw_start - frame_start + frame_end - draw_end)
+        overruns.inc()
+    return (perf_counter() - bench) / n
+
+
+if __name__ == "__main__":
+    per_frame = frameOverhead()
+    print('Instrumentation per frame: {0:.2f} us, {1:.3f}% of the 30 fps frame period'.format(
+        per_frame * 1e6, per_frame * 30 * 100))
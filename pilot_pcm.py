@@ -0,0 +1,256 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Offline PCM sound rendering library of pilotClock project
+# (c) Hansom 2018
+
+import wave
+import struct
+from pilot_sound import PilotSound, SoundScheduler, SOUNDS, compileMelody
+from pilot_ringtones import RingtoneError, parseRTTTL, parseMIDI
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+PCM_RATE = 44100
+PCM_AMPLITUDE = 16000
+
+
+class PCMSound(PilotSound):
+    """
+    Sound backend synthesizing melodies into a 16 bit mono PCM buffer instead of playing them.
+    The buzzer signal is rendered as it comes from the PWM: a square wave with the same duty cycle
+    and the same gap at the end of every note, so the result can be checked without audio hardware
+    """
+
+    def __init__(self, rate=PCM_RATE, amplitude=PCM_AMPLITUDE):
+        """
+        :param rate: Sample rate in Hz
+        :param amplitude: Level of the high state of the signal
+        """
+        if np is None:
+            raise ImportError('NumPy is required for PCM rendering')
+        # The GPIO is not touched, so the parent constructor is not called
+        self._timing = []
+        self._rate = rate
+        self._amplitude = amplitude
+        self._chunks = []
+
+    def close(self):
+        pass
+
+    def render(self, tones):
+        """
+        Method of synthesizing a compiled melody
+        :param tones: Sequence of tuples (frequency in Hz, duration in ms), frequency is 0 for a pause
+        :return: NumPy array of int16 samples
+        """
+        tones = np.asarray(tones, dtype=np.float64).reshape(-1, 2)
+        freqs, durations = tones[:, 0], tones[:, 1]
+        # Note edges are rounded from the start of the melody, so rounding errors do not accumulate
+        edges = np.rint(np.concatenate(([0.0], np.cumsum(durations))) * self._rate / 1000).astype(np.int64)
+        counts = np.diff(edges)
+        sounding = np.rint((durations - np.minimum(self._note_gap, durations / 2)) * self._rate / 1000)
+        note = np.repeat(np.arange(len(freqs)), counts)
+        local = np.arange(edges[-1]) - edges[:-1][note]
+        phase = local * freqs[note] / self._rate
+        high = (phase % 1.0) < self._duty_cycle / 100
+        high &= (local < sounding[note]) & (freqs[note] > 0)
+        return np.where(high, self._amplitude, 0).astype(np.int16)
+
+    def play(self, tones, interrupted=None):
+        # The interruption is checked before every note like in the buzzer playback,
+        # the notes before it are rendered
+        tones = tuple(tones)
+        for n in range(len(tones) if interrupted is not None else 0):
+            if interrupted():
+                self._chunks.append(self.render(tones[:n]))
+                return False
+        self._chunks.append(self.render(tones))
+        return True
+
+    def samples(self):
+        """
+        Method of obtaining everything played since the creation or the last clear
+        :return: NumPy array of int16 samples
+        """
+        return np.concatenate(self._chunks) if self._chunks else np.zeros(0, dtype=np.int16)
+
+    def clear(self):
+        self._chunks = []
+
+    def writeWAV(self, path):
+        """
+        Method of saving the played sound to a WAV file
+        :param path: Path or file object
+        :return:
+        """
+        with wave.open(path, 'wb') as f:
+            f.setnchannels(1)
+            f.setsampwidth(2)
+            f.setframerate(self._rate)
+            f.writeframes(self.samples().astype('<i2').tobytes())
+
+
+def analyzeTones(samples, rate=PCM_RATE, gap_periods=1.5):
+    """
+    Method of recovering the notes from a rendered square wave by its rising edges. A note ends where
+    the distance to the next edge exceeds its own period, measured on the neighbouring edges, by the gap
+    factor, so low notes with periods longer than a short pause are recovered as well
+    :param samples: Array of samples
+    :param rate: Sample rate in Hz
+    :param gap_periods: Distance between edges separating two notes, in periods of the shorter neighbouring period
+    :return: List of tuples (start in ms, frequency in Hz, duration in ms) of the sounding notes
+    """
+    samples = np.asarray(samples)
+    rising = np.flatnonzero((samples[1:] > 0) & (samples[:-1] <= 0)) + 1
+    if samples.size and samples[0] > 0:
+        rising = np.concatenate(([0], rising))
+    if rising.size == 0:
+        return []
+    gaps = np.diff(rising)
+    if gaps.size:
+        # Period around every gap: the shorter of the previous and the next distance between edges
+        local = np.minimum(np.concatenate(([np.inf], gaps[:-1])), np.concatenate((gaps[1:], [np.inf])))
+        breaks = np.flatnonzero(gaps > gap_periods * local)
+    else:
+        breaks = gaps
+    notes = []
+    for group in np.split(rising, breaks + 1):
+        if group.size < 2:
+            continue
+        period = (group[-1] - group[0]) / (group.size - 1)
+        notes.append((float(group[0] * 1000 / rate), float(rate / period),
+                      float((group[-1] - group[0] + period) * 1000 / rate)))
+    return notes
+
+
+def _midiFile(tracks, fmt=0, division=96):
+    return b'MThd' + struct.pack('>IHHH', 6, fmt, len(tracks), division) + \
+        b''.join(b'MTrk' + struct.pack('>I', len(track)) + track for track in tracks)
+
+
+def checkTones(name, tones, samples, rate=PCM_RATE):
+    """
+    Method of comparing the notes recovered from the samples with the melody
+    :param name: Melody name for the descriptions
+    :param tones: Tuple of tuples (frequency in Hz, duration in ms)
+    :param samples: Rendered samples
+    :param rate: Sample rate in Hz
+    :return: List of descriptions of the wrong notes
+    """
+    expected = []
+    start = 0
+    for freq, duration in tones:
+        if freq > 0:
+            expected.append((start, freq, duration - min(PilotSound._note_gap, duration / 2)))
+        start += duration
+    notes = analyzeTones(samples, rate)
+    if len(notes) != len(expected):
+        return ['{0}: {1} notes recovered instead of {2}'.format(name, len(notes), len(expected))]
+    failed = []
+    for n, ((start, freq, duration), (expected_start, expected_freq, expected_duration)) in enumerate(zip(notes, expected)):
+        # The edges are rounded to samples in every played part and the duration is counted in whole periods
+        if abs(start - expected_start) > 2000 / rate or abs(freq - expected_freq) > expected_freq * 0.005 or \
+                abs(duration - expected_duration) > 1000 / expected_freq:
+            failed.append('{0}: note {1} is {2} instead of {3}'.format(
+                name, n, (start, freq, duration), (expected_start, expected_freq, expected_duration)))
+    return failed
+
+
+def checkSounds():
+    """
+    Method of checking the sounds without the buzzer: the notes of the rendered sounds and ringtones,
+    the errors of malformed ringtones and the preemption of sounds by the ones of a higher priority
+    :return: List of descriptions of the failed checks
+    """
+    failed = []
+    melodies = dict(SOUNDS)
+    melodies['rtttl'] = parseRTTTL('Beethoven:d=4,o=5,b=160:c,e,c,g,c,c6,8b,8a,8g,8a,8g,8f,8e,8f,8e,8d,c,p,c.6')[1]
+    melodies['rtttl_low'] = parseRTTTL('Low:d=16,o=3,b=200:c,c,c,p,c4,c')[1]
+    note_on, note_off, end = b'\x00\x90\x45\x40', b'\x60\x80\x45\x00', b'\x00\xff\x2f\x00'
+    melodies['midi'] = parseMIDI(_midiFile([b'\x00\xff\x51\x03\x0f\x42\x40' + end, note_on + note_off + end]))
+    if melodies['midi'] != ((440, 1000),):
+        failed.append('midi: compiled to {0}'.format(melodies['midi']))
+    for name, tones in melodies.items():
+        sound = PCMSound()
+        sound.play(tones)
+        failed += checkTones(name, tones, sound.samples())
+    # The buzzer gets the PWM duty cycle, 180 ms of the click sound
+    duty = np.count_nonzero(PCMSound().render(SOUNDS['click'])) / (PCM_RATE * 0.18)
+    if abs(duty - PilotSound._duty_cycle / 100) > 0.005:
+        failed.append('click: duty cycle {0:.1%}'.format(duty))
+
+    broken_rtttl = ['No sections', 'x:d=4,o=5,b=0:c', 'x:d=4,o=12,b=100:c', 'x:d=x:c', 'x:d=4:q', 'x:d=4:0c',
+                    'x:d=4:c12', 'x:d=4:8']
+    broken_midi = [b'', b'RIFF\x00\x00\x00\x00', _midiFile([end], division=0), _midiFile([end], division=0xE728),
+                   _midiFile([end], fmt=2), _midiFile([end])[:20], _midiFile([b'\x00\x45\x40']),
+                   _midiFile([b'\x00\x90\x45']), _midiFile([b'\x80'])]
+    for parse, sources in ((parseRTTTL, broken_rtttl), (parseMIDI, broken_midi)):
+        for source in sources:
+            try:
+                parse(source)
+                failed.append('{0}: {1!r} is accepted'.format(parse.__name__, source))
+            except RingtoneError:
+                pass
+            except Exception as e:
+                failed.append('{0}: {1!r} raised {2!r}'.format(parse.__name__, source, e))
+
+    # Loop of the sound worker: an alarm requested during a confirmation interrupts it at the next note,
+    # another alarm and a click wait for it and the repeated request of the playing sound is coalesced
+    scheduler = SoundScheduler()
+    sound = PCMSound()
+    checks = []
+
+    def receive():
+        checks.append(True)
+        if len(checks) == 2 and (not scheduler.push('click', 0) or not scheduler.push('alarm2', 0) or
+                                 scheduler.push('config_accept', 0)):
+            failed.append('scheduler: requests are not queued or coalesced')
+        if len(checks) == 3 and not scheduler.push('alarm1', 0):
+            failed.append('scheduler: an alarm is not queued')
+        return scheduler.preempts()
+
+    scheduler.push('config_accept', 0)
+    played = []
+    while scheduler:
+        name, _ = scheduler.pop(1)
+        played.append((name, sound.play(SOUNDS[name], receive)))
+        scheduler.finish()
+    if played != [('config_accept', False), ('alarm2', True), ('alarm1', True), ('click', True)]:
+        failed.append('scheduler: played {0}'.format(played))
+    failed += checkTones('preempted', SOUNDS['config_accept'][:1] + SOUNDS['alarm2'] + SOUNDS['alarm1'] + SOUNDS['click'],
+                         sound.samples())
+    scheduler.push('click', 0)
+    if scheduler.pop(3) is not None or scheduler.dropped != 1:
+        failed.append('scheduler: a click waiting too long is not dropped')
+    return failed
+
+
+if __name__ == "__main__":
+    import sys
+    import time
+    from pilot_sound import MERRY_CHRISTMAS
+
+    if len(sys.argv) > 1 and sys.argv[1] == 'check':
+        failed = checkSounds()
+        for description in failed:
+            print('FAILED', description)
+        print('{0} failed checks'.format(len(failed)) if failed else 'All sound checks passed')
+        sys.exit(1 if failed else 0)
+
+    melody = compileMelody(MERRY_CHRISTMAS)
+    sound = PCMSound()
+    bench = time.monotonic()
+    sound.play(melody)
+    render_time = time.monotonic() - bench
+    notes = analyzeTones(sound.samples())
+    played = [t for t in melody if t[0] > 0]
+    freq_error = max(abs(f - t[0]) / t[0] for (_, f, _), t in zip(notes, played))
+    print('MERRY_CHRISTMAS: {0:.1f} s of sound rendered in {1:.3f} s, {2} of {3} notes recovered, '
+          'max frequency error {4:.2%}'.format(sound.samples().size / PCM_RATE, render_time,
+                                               len(notes), len(played), freq_error))
+    if len(sys.argv) > 1:
+        sound.writeWAV(sys.argv[1])
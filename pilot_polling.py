@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Sensors polling policy library of pilotClock project
+# (c) Hansom 2018
+
+import time
+
+
+class AdaptivePoller(object):
+    """
+    Polling policy adapting the interval of a sensor to how fast its signal changes.
+    A significant change brings the interval down to the floor at once, a flat signal
+    lets it grow step by step up to the ceiling
+    """
+
+    def __init__(self, min_interval, max_interval, threshold, backoff=1.5, smoothing=0.3):
+        """
+        :param min_interval: Floor of the polling interval in seconds
+        :param max_interval: Ceiling of the polling interval in seconds
+        :param threshold: Change of the value that should be noticed within one polling interval
+        :param backoff: Max growth factor of the interval per poll
+        :param smoothing: Weight of the last poll in the estimated change rate
+        """
+        self._min = min_interval
+        self._max = max(min_interval, max_interval)
+        self._threshold = threshold
+        self._backoff = backoff
+        self._smoothing = smoothing
+        self._interval = min_interval
+        self._rate = 0.0
+        self._last = None
+        self._started = None
+        self._polls = 0
+
+    def setLimits(self, min_interval=None, max_interval=None):
+        self._min = self._min if min_interval is None else min_interval
+        self._max = max(self._min, self._max if max_interval is None else max_interval)
+        self._interval = min(max(self._interval, self._min), self._max)
+
+    def interval(self):
+        return self._interval
+
+    def update(self, value, now=None):
+        """
+        Method registers a polled value and calculates the next polling interval
+        :param value: Polled value
+        :param now: Time of polling (monotonic), current time if not specified
+        :return: Interval in seconds until the next poll
+        """
+        now = time.monotonic() if now is None else now
+        self._polls += 1
+        if self._started is None:
+            self._started = now
+        if self._last is not None:
+            last_time, last_value = self._last
+            change = abs(value - last_value)
+            rate = change / max(now - last_time, 1e-3)
+            self._rate = self._smoothing * rate + (1 - self._smoothing) * self._rate
+            if change >= self._threshold:
+                self._interval = self._min
+            else:
+                target = self._threshold / self._rate if self._rate > 0 else self._max
+                self._interval = min(target, self._interval * self._backoff)
+            self._interval = min(max(self._interval, self._min), self._max)
+        self._last = (now, value)
+        return self._interval
+
+    def stats(self, now=None):
+        """
+        Method of obtaining the polling counters
+        :param now: Current time (monotonic)
+        :return: Tuple (polls done, polls saved per hour compared with polling at the floor interval)
+        """
+        now = time.monotonic() if now is None else now
+        if self._started is None or now <= self._started:
+            return self._polls, 0.0
+        hours = (now - self._started) / 3600
+        baseline = (now - self._started) / self._min + 1
+        return self._polls, max(0.0, baseline - self._polls) / hours
+
+
+if __name__ == "__main__":
+    # Simulated day of the photoresistor: darkness, dusk, lights switched on and off
+    poller = AdaptivePoller(0.1, 2.0, 2)
+    t = 0.0
+    while t < 86400:
+        hour = t / 3600
+        if hour < 6:
+            value = 250
+        elif hour < 7:
+            value = 250 - (hour - 6) * 200
+        elif 19 <= hour < 23:
+            value = 120
+        else:
+            value = 50
+        t += poller.update(int(value), t)
+    polls, saved = poller.stats(t)
+    print('Light polls per day: {0} instead of {1}, saved per hour: {2:.0f}'.format(polls, int(86400 / 0.1), saved))
@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Profiling library of pilotClock project
+# (c) Hansom 2018
+#
+# Sampling profiler for a clock in the field. SIGUSR1 samples the stacks of all threads of a process
+# for some seconds and writes them in collapsed format (one "frame;frame;frame count" line per stack),
+# which is turned into a flame graph by flamegraph.pl or speedscope. SIGUSR2 starts tracemalloc on the
+# first signal and dumps the top allocations and their growth since the previous dump on the next ones
+
+import os
+import sys
+import signal
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+
+
+class StackSampler(object):
+    """
+    Sampler of the stacks of all threads except its own. Only the frames are walked on a sample,
+    the stacks are formatted when the profile is written
+    """
+
+    def __init__(self, interval=0.01):
+        """
+        :param interval: Sampling interval in seconds
+        """
+        self._interval = interval
+        self._stacks = Counter()
+        self._names = {}
+        self._codes = {}
+        self.samples = 0
+
+    def sample(self):
+        own = threading.get_ident()
+        names = self._names
+        for ident, frame in sys._current_frames().items():
+            if ident == own:
+                continue
+            if ident not in names:
+                names.update((thread.ident, thread.name) for thread in threading.enumerate())
+            # Stacks are counted by the ids of the code objects, which are kept alive in _codes
+            stack = [ident]
+            while frame is not None:
+                code = frame.f_code
+                stack.append(id(code))
+                if id(code) not in self._codes:
+                    self._codes[id(code)] = code
+                frame = frame.f_back
+            self._stacks[tuple(stack)] += 1
+        self.samples += 1
+
+    def run(self, seconds):
+        """
+        Method of sampling for a time interval, the samples are taken on absolute deadlines
+        :param seconds: Length of the interval
+        :return:
+        """
+        deadline = time.monotonic()
+        end = deadline + seconds
+        while deadline < end:
+            self.sample()
+            deadline += self._interval
+            delay = deadline - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+
+    def collapsed(self):
+        """
+        Method of obtaining the profile in collapsed stack format
+        :return: List of lines "thread;outer frame;...;inner frame count"
+        """
+        lines = []
+        for stack, count in self._stacks.most_common():
+            frames = [self._names.get(stack[0], 'thread-{0}'.format(stack[0]))]
+            for code in reversed([self._codes[code_id] for code_id in stack[1:]]):
+                frames.append('{0} ({1}:{2})'.format(code.co_name, os.path.basename(code.co_filename), code.co_firstlineno))
+            lines.append('{0} {1}'.format(';'.join(frames), count))
+        return lines
+
+
+class PilotProfiler(object):
+    """
+    Profiling of a process on demand: sampling of the stacks and snapshots of the memory allocations
+    """
+    _dir = 'profiles'
+    _seconds = 30  # Default length of a profile
+    _interval = 0.01  # Sampling interval in seconds
+    _top = 30  # Number of the allocation sites in a dump
+    _tracemalloc_frames = 10  # Depth of the allocation tracebacks
+
+    def __init__(self, name, directory=None, seconds=None, interval=None):
+        """
+        :param name: Process name used in the file names
+        :param directory: Directory of the profiles
+        :param seconds: Default length of a profile in seconds
+        :param interval: Sampling interval in seconds
+        """
+        self._name = name
+        self._dir = directory or self._dir
+        self._seconds = seconds or self._seconds
+        self._interval = interval or self._interval
+        self._thread = None
+        self._snapshot = None
+        self._lock = threading.RLock()
+
+    def _path(self, kind, extension):
+        os.makedirs(self._dir, exist_ok=True)
+        return os.path.join(self._dir, '{0}-{1}-{2:%Y%m%d-%H%M%S}.{3}'.format(
+            kind, self._name, datetime.now(), extension))
+
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, seconds=None):
+        """
+        Method of starting the sampling in background, it is ignored while a profile is being taken
+        :param seconds: Length of the profile, the default one if not specified
+        :return: True if the profiling has been started
+        """
+        with self._lock:
+            if self.running():
+                return False
+            self._thread = threading.Thread(target=self._profile, args=(seconds or self._seconds,),
+                                            name='profiler', daemon=True)
+            self._thread.start()
+        return True
+
+    def _profile(self, seconds):
+        sampler = StackSampler(self._interval)
+        # CPU time of the sampling thread itself, where it can be measured
+        thread_time = getattr(time, 'thread_time', time.process_time)
+        started = time.monotonic()
+        cpu = thread_time()
+        sampler.run(seconds)
+        cpu = thread_time() - cpu
+        path = self._path('profile', 'folded')
+        try:
+            with open(path, mode='w', encoding='utf-8') as f:
+                f.write('\n'.join(sampler.collapsed()) + '\n')
+        except (IOError, OSError):
+            print('Error writing profile')
+            return
+        print('Profile of {0} written to {1}: {2} samples in {3:.1f} s, sampling CPU {4:.2f}%'.format(
+            self._name, path, sampler.samples, time.monotonic() - started,
+            cpu / max(time.monotonic() - started, 1e-9) * 100))
+
+    def dumpAllocations(self):
+        """
+        Method of snapshotting the memory allocations. The first call starts tracemalloc if it is not
+        running yet (it is also started by PYTHONTRACEMALLOC), the next calls write the top allocation
+        sites and their growth since the previous dump
+        :return: Path of the dump, None if tracemalloc has just been started
+        """
+        import tracemalloc
+
+        with self._lock:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start(self._tracemalloc_frames)
+                print('Allocations tracing of {0} started'.format(self._name))
+                return None
+            snapshot = tracemalloc.take_snapshot().filter_traces((
+                tracemalloc.Filter(False, tracemalloc.__file__),
+                tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+            ))
+            previous, self._snapshot = self._snapshot, snapshot
+        current, peak = tracemalloc.get_traced_memory()
+        lines = ['Traced memory: {0} kB, peak {1} kB'.format(current // 1024, peak // 1024), '',
+                 'Top {0} allocation sites:'.format(self._top)]
+        lines += [str(stat) for stat in snapshot.statistics('lineno')[:self._top]]
+        if previous is not None:
+            lines += ['', 'Top {0} growing sites since the previous dump:'.format(self._top)]
+            lines += [str(stat) for stat in snapshot.compare_to(previous, 'lineno')[:self._top] if stat.size_diff > 0]
+        path = self._path('allocations', 'txt')
+        try:
+            with open(path, mode='w', encoding='utf-8') as f:
+                f.write('\n'.join(lines) + '\n')
+        except (IOError, OSError):
+            print('Error writing allocations dump')
+            return None
+        print('Allocations of {0} written to {1}'.format(self._name, path))
+        return path
+
+    def install(self, forward=None):
+        """
+        Method of handling SIGUSR1 (profile) and SIGUSR2 (allocations dump) in this process.
+        It must be called from the main thread, the signals are not available on Windows
+        :param forward: Function called with the signal number, for passing the signal to other processes
+        :return:
+        """
+        if not hasattr(signal, 'SIGUSR1'):
+            return
+
+        def handler(signum, frame):
+            if forward is not None:
+                forward(signum)
+            if signum == signal.SIGUSR1:
+                self.start()
+            else:
+                # A snapshot takes a while, the interrupted code continues meanwhile
+                threading.Thread(target=self.dumpAllocations, name='allocations', daemon=True).start()
+
+        signal.signal(signal.SIGUSR1, handler)
+        signal.signal(signal.SIGUSR2, handler)
+
+
+if __name__ == "__main__":
+    # Cost of a sample of a process with the render loop and a few helper threads
+    import queue
+
+    commands = queue.Queue()
+    helpers = [threading.Thread(target=commands.get, daemon=True) for _ in range(3)]
+    for thread in helpers:
+        thread.start()
+    sampler = StackSampler()
+    n = 10000
+    bench = time.perf_counter()
+    for _ in range(n):
+        sampler.sample()
+    per_sample = (time.perf_counter() - bench) / n
+    print('Sample of {0} threads: {1:.1f} us, {2:.3f}% of CPU at {3:.0f} samples per second'.format(
+        len(helpers), per_sample * 1e6, per_sample / PilotProfiler._interval * 100, 1 / PilotProfiler._interval))
@@ -0,0 +1,272 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Ringtones import library of pilotClock project
+# (c) Hansom 2018
+
+import os
+import json
+import struct
+import hashlib
+
+# Version of the compiled format, cached melodies of other versions are compiled again
+COMPILER_VERSION = 1
+
+RTTTL_NOTES = {'c': 0, 'd': 2, 'e': 4, 'f': 5, 'g': 7, 'a': 9, 'b': 11, 'h': 11}
+RTTTL_OCTAVES = range(0, 10)  # Octaves of the MIDI key range
+
+
+class RingtoneError(Exception):
+    pass
+
+
+def midiFrequency(key):
+    """
+    Method of obtaining the frequency of a MIDI key, A4 (key 69) is 440 Hz
+    :param key: MIDI key number
+    :return: Frequency in Hz
+    """
+    return int(440 * 2 ** ((key - 69) / 12))
+
+
+def parseRTTTL(text):
+    """
+    Method of compiling a ring tone in RTTTL format, for example "name:d=4,o=5,b=120:8c,8e,g.,p,c6"
+    :param text: RTTTL string
+    :return: Tuple (ringtone name, tuple of tuples (frequency in Hz, duration in ms))
+    """
+    parts = text.strip().split(':')
+    if len(parts) != 3:
+        raise RingtoneError('RTTTL must consist of name, defaults and notes sections')
+    name, defaults, notes = parts
+    settings = {'d': 4, 'o': 6, 'b': 63}
+    for item in defaults.split(','):
+        if '=' in item:
+            key, value = item.split('=', 1)
+            try:
+                settings[key.strip().lower()] = int(value)
+            except ValueError:
+                raise RingtoneError('Wrong RTTTL default: {0}'.format(item))
+    if settings['b'] <= 0 or settings['d'] <= 0 or settings['o'] not in RTTTL_OCTAVES:
+        raise RingtoneError('Wrong RTTTL tempo, duration or octave')
+    whole = 4 * 60000 / settings['b']
+
+    tones = []
+    for note in notes.lower().split(','):
+        note = note.strip()
+        if not note:
+            continue
+        pos = 0
+        while pos < len(note) and note[pos].isdigit():
+            pos += 1
+        duration = int(note[:pos]) if pos else settings['d']
+        if pos >= len(note) or (note[pos] not in RTTTL_NOTES and note[pos] != 'p') or duration <= 0:
+            raise RingtoneError('Wrong RTTTL note: {0}'.format(note))
+        pitch = note[pos]
+        pos += 1
+        semitone = RTTTL_NOTES.get(pitch, 0)
+        if pos < len(note) and note[pos] == '#':
+            semitone += 1
+            pos += 1
+        rest = note[pos:]
+        dotted = '.' in rest
+        octave = rest.replace('.', '')
+        octave = int(octave) if octave.isdigit() else settings['o']
+        if octave not in RTTTL_OCTAVES:
+            raise RingtoneError('Wrong RTTTL octave: {0}'.format(note))
+        ms = whole / duration * (1.5 if dotted else 1)
+        freq = 0 if pitch == 'p' else midiFrequency(12 * (octave + 1) + semitone)
+        tones.append((freq, int(ms)))
+    return name.strip(), tuple(tones)
+
+
+def _readVarLen(data, pos):
+    value = 0
+    while True:
+        if pos >= len(data):
+            raise RingtoneError('Unexpected end of MIDI track')
+        byte = data[pos]
+        pos += 1
+        value = (value << 7) | (byte & 0x7F)
+        if not byte & 0x80:
+            return value, pos
+
+
+def _readTrack(data, order):
+    """
+    Method of extracting the note and tempo events of a MIDI track
+    :return: List of tuples (tick, order, event, value), event is 'on', 'off' or 'tempo'
+    """
+    events = []
+    pos = 0
+    tick = 0
+    status = 0
+    while pos < len(data):
+        delta, pos = _readVarLen(data, pos)
+        tick += delta
+        if data[pos] & 0x80:
+            status = data[pos]
+            pos += 1
+        elif not status:
+            raise RingtoneError('MIDI running status without a status byte')
+        if status == 0xFF:
+            meta = data[pos]
+            length, pos = _readVarLen(data, pos + 1)
+            if meta == 0x51 and length == 3:
+                events.append((tick, order, 'tempo', int.from_bytes(data[pos:pos + 3], 'big')))
+            elif meta == 0x2F:
+                break
+            pos += length
+            status = 0
+        elif status in (0xF0, 0xF7):
+            length, pos = _readVarLen(data, pos)
+            pos += length
+            status = 0
+        else:
+            kind = status & 0xF0
+            if kind in (0xC0, 0xD0):
+                pos += 1
+            elif kind == 0x90 and data[pos + 1] > 0:
+                events.append((tick, order, 'on', data[pos]))
+                pos += 2
+            elif kind in (0x80, 0x90):
+                events.append((tick, order, 'off', data[pos]))
+                pos += 2
+            else:
+                pos += 2
+        order += 1
+    return events
+
+
+def parseMIDI(data):
+    """
+    Method of compiling a standard MIDI file into a monophonic melody. Events of all tracks are merged,
+    so both single-track files and files with a separate tempo track are supported. When notes overlap
+    the last started one is played
+    :param data: Content of the MIDI file
+    :return: Tuple of tuples (frequency in Hz, duration in ms), frequency is 0 for a pause
+    """
+    if data[:4] != b'MThd' or len(data) < 14:
+        raise RingtoneError('Not a MIDI file')
+    header_length = struct.unpack('>I', data[4:8])[0]
+    fmt, tracks_num, division = struct.unpack('>HHH', data[8:14])
+    if division & 0x8000:
+        raise RingtoneError('SMPTE time division of MIDI files is not supported')
+    if division == 0:
+        raise RingtoneError('Wrong MIDI time division')
+    if fmt == 2:
+        raise RingtoneError('MIDI files with independent tracks are not supported')
+
+    events = []
+    pos = 8 + header_length
+    for _ in range(tracks_num):
+        if data[pos:pos + 4] != b'MTrk' or len(data) < pos + 8:
+            raise RingtoneError('Wrong MIDI track header')
+        length = struct.unpack('>I', data[pos + 4:pos + 8])[0]
+        try:
+            events += _readTrack(data[pos + 8:pos + 8 + length], len(events))
+        except IndexError:
+            raise RingtoneError('Unexpected end of MIDI track')
+        pos += 8 + length
+    events.sort()
+
+    tones = []
+    tempo = 500000  # us per quarter note, 120 bpm by default
+    now = 0.0
+    last_tick = 0
+    key = None
+    start = 0.0
+    for tick, _, event, value in events:
+        now += (tick - last_tick) * tempo / division / 1000000
+        last_tick = tick
+        if event == 'tempo':
+            tempo = value
+        elif event == 'on' or (event == 'off' and value == key):
+            duration = int(round((now - start) * 1000))
+            if duration > 0 and (key is not None or tones):
+                tones.append((0 if key is None else midiFrequency(key), duration))
+            key = value if event == 'on' else None
+            start = now
+    return tuple(tones)
+
+
+class RingtoneLibrary(object):
+    """
+    Ringtones imported from RTTTL (.txt, .rtttl) and MIDI (.mid, .midi) files. The compiled melodies
+    are cached on the disk, keyed by the hash of the source file, so a file is parsed only once
+    """
+
+    def __init__(self, cache_dir='ringtones-cache'):
+        """
+        :param cache_dir: Directory of the compiled melodies
+        """
+        self._cache_dir = cache_dir
+        self._ringtones = {}
+
+    def names(self):
+        return list(self._ringtones.keys())
+
+    def get(self, name):
+        return self._ringtones.get(name)
+
+    def compileFile(self, path):
+        """
+        Method of obtaining the compiled melody of a ringtone file
+        :param path: Path of the RTTTL or MIDI file
+        :return: Tuple of tuples (frequency in Hz, duration in ms)
+        """
+        with open(path, mode='rb') as f:
+            data = f.read()
+        digest = hashlib.sha1(data).hexdigest()
+        cache_path = os.path.join(self._cache_dir, digest + '.json')
+        try:
+            with open(cache_path, mode='r', encoding='utf-8') as f:
+                cached = json.loads(f.read())
+            if cached.get('version') == COMPILER_VERSION:
+                return tuple((int(freq), int(duration)) for freq, duration in cached['tones'])
+        except (IOError, ValueError, KeyError, TypeError):
+            pass
+
+        if os.path.splitext(path)[1].lower() in ('.mid', '.midi'):
+            tones = parseMIDI(data)
+        else:
+            tones = parseRTTTL(data.decode('utf-8', errors='replace'))[1]
+        try:
+            os.makedirs(self._cache_dir, exist_ok=True)
+            tmp_path = cache_path + '.tmp'
+            with open(tmp_path, mode='w', encoding='utf-8') as f:
+                f.write(json.dumps({'version': COMPILER_VERSION, 'source': os.path.basename(path), 'tones': tones}))
+            os.replace(tmp_path, cache_path)
+        except (IOError, OSError):
+            print('Error writing ringtones cache')
+        return tones
+
+    def load(self, ringtones):
+        """
+        Method of importing ringtones, the previously loaded ones which are not in the list are forgotten
+        :param ringtones: Dictionary {ringtone name: path of the RTTTL or MIDI file}
+        :return: List of names of the loaded ringtones
+        """
+        loaded = {}
+        for name, path in ringtones.items():
+            try:
+                loaded[name] = self.compileFile(path)
+            except (IOError, RingtoneError) as e:
+                print('Error loading ringtone {0}: {1}'.format(name, e))
+        self._ringtones = loaded
+        return list(loaded.keys())
+
+
+if __name__ == "__main__":
+    import sys
+    import time
+
+    if len(sys.argv) > 1:
+        library = RingtoneLibrary()
+        for path in sys.argv[1:]:
+            bench = time.monotonic()
+            melody = library.compileFile(path)
+            print('{0}: {1} notes, {2:.1f} s, compiled in {3:.2f} ms'.format(
+                path, len(melody), sum(d for _, d in melody) / 1000, (time.monotonic() - bench) * 1000))
+    else:
+        print(parseRTTTL('Beethoven:d=4,o=5,b=160:c,e,c,g,c,c6,8b,8a,8g,8a,8g,8f,8e,8f,8e,8d,c,p,c.6'))
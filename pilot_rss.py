@@ -0,0 +1,842 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# RSS feeds library of pilotClock project
+# (c) Hansom 2018
+
+import os
+import zlib
+import gzip
+import json
+import time
+import heapq
+import hashlib
+import calendar
+import http.client
+from email.utils import parsedate_tz, mktime_tz
+from datetime import datetime
+from xml.etree.ElementTree import XMLPullParser, ParseError
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit, urljoin
+
+USER_AGENT = 'pilotClock/0.0.1b'
+
+
+class FetchError(Exception):
+    pass
+
+
+class FeedFetcher(object):
+    """
+    HTTP client for polling feeds. It keeps one persistent connection per host, sends conditional
+    requests with the validators of the previous response (ETag and Last-Modified), so an unchanged
+    feed costs only a 304 response, and applies connect/read timeouts and a deadline of the whole fetch
+    with exponential backoff on failures
+    """
+    _max_redirects = 5
+    _read_size = 65536  # Size of the body reads, the deadline is checked between them
+    _rates_window = 60  # Min time in seconds of counting before the hourly rates are reported
+
+    def __init__(self, connect_timeout=5, read_timeout=15, backoff_base=30, backoff_max=3600, fetch_timeout=60):
+        """
+        :param connect_timeout: Connection timeout in seconds
+        :param read_timeout: Timeout of waiting for the response data in seconds
+        :param backoff_base: Delay in seconds before the retry after the first failure
+        :param backoff_max: Max delay in seconds before the retry
+        :param fetch_timeout: Max time in seconds of a fetch with all its retries and redirects,
+                              it must be shorter than the heartbeat timeout of the RSS process
+        """
+        self._connect_timeout = connect_timeout
+        self._read_timeout = read_timeout
+        self._fetch_timeout = fetch_timeout
+        self._backoff_base = backoff_base
+        self._backoff_max = backoff_max
+        self._connections = {}
+        self._validators = {}  # url: (etag, last modified)
+        self._failures = 0
+        self._started = time.monotonic()
+        self._stats = {'requests': 0, 'not_modified': 0, 'failures': 0, 'bytes': 0, 'parse_cpu': 0.0}
+
+    @staticmethod
+    def _remaining(deadline):
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise FetchError('Fetch deadline exceeded')
+        return remaining
+
+    def _connection(self, scheme, netloc, deadline):
+        key = (scheme, netloc)
+        conn = self._connections.get(key)
+        if conn is None:
+            if scheme == 'https':
+                conn = http.client.HTTPSConnection(netloc, timeout=self._connect_timeout)
+            else:
+                conn = http.client.HTTPConnection(netloc, timeout=self._connect_timeout)
+            self._connections[key] = conn
+        if conn.sock is None:
+            conn.timeout = min(self._connect_timeout, self._remaining(deadline))
+            conn.connect()
+        conn.sock.settimeout(min(self._read_timeout, self._remaining(deadline)))
+        return conn
+
+    def _readBody(self, conn, resp, deadline):
+        """
+        Method of reading the response body in parts, so a server sending it slowly can not hold the fetch
+        past its deadline
+        :return: Body bytes
+        """
+        parts = []
+        while True:
+            conn.sock.settimeout(min(self._read_timeout, self._remaining(deadline)))
+            part = resp.read1(self._read_size)
+            if not part:
+                # The final read releases the connection for the next request
+                parts.append(resp.read())
+                return b''.join(parts)
+            parts.append(part)
+
+    def _drop(self, scheme, netloc):
+        conn = self._connections.pop((scheme, netloc), None)
+        if conn is not None:
+            conn.close()
+
+    def close(self):
+        for conn in self._connections.values():
+            conn.close()
+        self._connections = {}
+
+    def _request(self, url, headers, deadline):
+        parts = urlsplit(url)
+        path = parts.path or '/'
+        if parts.query:
+            path += '?' + parts.query
+        # A kept-alive connection may have been closed by the server meanwhile, such a request is retried once
+        for attempt in range(2):
+            try:
+                conn = self._connection(parts.scheme, parts.netloc, deadline)
+                conn.request('GET', path, headers=headers)
+                resp = conn.getresponse()
+                body = self._readBody(conn, resp, deadline)
+            except (http.client.RemoteDisconnected, BrokenPipeError, ConnectionResetError):
+                self._drop(parts.scheme, parts.netloc)
+                if attempt:
+                    raise
+                continue
+            except Exception:
+                self._drop(parts.scheme, parts.netloc)
+                raise
+            if resp.getheader('Connection', '').lower() == 'close':
+                self._drop(parts.scheme, parts.netloc)
+            self._stats['bytes'] += len(body) + sum(len(k) + len(v) + 4 for k, v in resp.getheaders())
+            return resp, body
+
+    def fetch(self, url):
+        """
+        Method of downloading a feed
+        :param url: Feed URL
+        :return: Feed document bytes or None if the feed was not modified since the last fetch
+        """
+        headers = {'User-Agent': USER_AGENT, 'Accept-Encoding': 'gzip'}
+        etag, modified = self._validators.get(url, (None, None))
+        if etag:
+            headers['If-None-Match'] = etag
+        if modified:
+            headers['If-Modified-Since'] = modified
+        self._stats['requests'] += 1
+        location = url
+        deadline = time.monotonic() + self._fetch_timeout
+        try:
+            for _ in range(self._max_redirects + 1):
+                resp, body = self._request(location, headers, deadline)
+                if resp.status in (301, 302, 303, 307, 308) and resp.getheader('Location'):
+                    location = urljoin(location, resp.getheader('Location'))
+                    continue
+                break
+            if resp.status == 304:
+                self._failures = 0
+                self._stats['not_modified'] += 1
+                return None
+            if resp.status != 200:
+                raise FetchError('HTTP status {0} for {1}'.format(resp.status, url))
+            if resp.getheader('Content-Encoding', '').lower() == 'gzip':
+                body = gzip.decompress(body)
+        except (OSError, EOFError, zlib.error, http.client.HTTPException, FetchError) as e:
+            # Truncated or corrupt gzip bodies are failures of the fetch as well
+            self._failures += 1
+            self._stats['failures'] += 1
+            raise FetchError(str(e))
+        self._failures = 0
+        self._validators[url] = (resp.getheader('ETag'), resp.getheader('Last-Modified'))
+        return body
+
+    def parseFailed(self):
+        """
+        Method of counting a feed document which could not be parsed as a failure. The validators
+        are kept, the same document is not downloaded again until the feed changes
+        :return:
+        """
+        self._failures += 1
+        self._stats['failures'] += 1
+
+    def forget(self, url):
+        """
+        Method drops the validators of a feed, so the next fetch downloads it in full
+        :param url: Feed URL
+        :return:
+        """
+        self._validators.pop(url, None)
+
+    def validators(self, url):
+        return self._validators.get(url, (None, None))
+
+    def setValidators(self, url, etag, modified):
+        self._validators[url] = (etag, modified)
+
+    def retryDelay(self):
+        """
+        Method of obtaining the delay before the next attempt after failures
+        :return: Delay in seconds, 0 if the last fetch was successful
+        """
+        if self._failures == 0:
+            return 0
+        return min(self._backoff_base * 2 ** (self._failures - 1), self._backoff_max)
+
+    def addParseTime(self, cpu_seconds):
+        self._stats['parse_cpu'] += cpu_seconds
+
+    def stats(self, now=None):
+        """
+        Method of obtaining the fetch counters
+        :param now: Current time (monotonic)
+        :return: Dictionary of counters and hourly rates of transferred bytes and parse CPU time,
+                 the rates are 0 until they have been counted for the rates window
+        """
+        now = time.monotonic() if now is None else now
+        hours = (now - self._started) / 3600
+        result = dict(self._stats)
+        if now - self._started < self._rates_window:
+            result['bytes_per_hour'] = result['parse_cpu_per_hour'] = 0.0
+        else:
+            result['bytes_per_hour'] = self._stats['bytes'] / hours
+            result['parse_cpu_per_hour'] = self._stats['parse_cpu'] / hours
+        return result
+
+
+_ITEM_TAGS = ('item', 'entry')
+# Namespaces of the item elements of RSS 2.0, RSS 1.0 and Atom, titles and links in the other ones
+# (media:title, dc:title, itunes:title) are not the ones of the item
+_FEED_NAMESPACES = ('', 'http://purl.org/rss/1.0/', 'http://www.w3.org/2005/Atom')
+_CHUNK_SIZE = 16384
+
+
+def _localName(tag):
+    return tag.rsplit('}', 1)[-1]
+
+
+def _namespace(tag):
+    return tag[1:].split('}', 1)[0] if tag.startswith('{') else ''
+
+
+def _parseDate(text):
+    """
+    Method of parsing the date of a feed entry (RFC 822 of RSS or ISO 8601 of Atom)
+    :param text: Date text
+    :return: time.struct_time in UTC or None
+    """
+    if not text:
+        return None
+    text = text.strip()
+    try:
+        parsed = parsedate_tz(text)
+        if parsed is not None:
+            return time.gmtime(mktime_tz(parsed))
+        text = text.replace('Z', '+00:00')
+        if len(text) > 6 and text[-3] == ':' and text[-6] in '+-':
+            text = text[:-3] + text[-2:]
+        fmt = '%Y-%m-%dT%H:%M:%S.%f%z' if '.' in text else '%Y-%m-%dT%H:%M:%S%z'
+        return time.gmtime(datetime.strptime(text, fmt).timestamp())
+    except (ValueError, OverflowError, OSError):
+        # Dates out of the range of the platform time functions
+        return None
+
+
+def parseHeadlines(source, max_items=10, fallback=None):
+    """
+    Method of incremental parsing of a RSS/Atom feed. Only title, guid, link and date of the items
+    are extracted, the items are dropped from the tree as soon as they are read and the parsing stops
+    after max_items, so neither the whole document tree nor the rest of the document are processed
+    :param source: Feed document bytes or a local file path
+    :param max_items: Max number of items to read
+    :param fallback: Parsing function for malformed feeds, for example feedparser.parse
+    :return: Dictionary in format of feedparser result: {'entries': [{'title', 'id', 'link', 'published_parsed'}]}
+    """
+    parser = XMLPullParser(events=('start', 'end'))
+    entries = []
+    try:
+        if isinstance(source, str):
+            with open(source, 'rb') as f:
+                _pullEntries(parser, iter(lambda: f.read(_CHUNK_SIZE), b''), max_items, entries)
+        else:
+            view = memoryview(source)
+            _pullEntries(parser, (view[n:n + _CHUNK_SIZE] for n in range(0, len(view), _CHUNK_SIZE)), max_items, entries)
+    except (ParseError, OSError, UnicodeDecodeError):
+        if fallback is not None:
+            return fallback(source)
+    return {'entries': entries}
+
+
+def _pullEntries(parser, chunks, max_items, entries):
+    # Only the direct children of an item are read, so the titles and links of nested elements
+    # (media:title, the source of an Atom entry) do not replace the ones of the item
+    entry = None
+    depth = 0
+    for chunk in chunks:
+        parser.feed(chunk)
+        for event, elem in parser.read_events():
+            name = _localName(elem.tag)
+            if event == 'start':
+                if entry is not None:
+                    depth += 1
+                elif name in _ITEM_TAGS:
+                    entry = {}
+                    depth = 0
+                    alternate = False
+                continue
+            if entry is None:
+                continue
+            if depth == 0:
+                entries.append(entry)
+                entry = None
+                elem.clear()
+                if len(entries) >= max_items:
+                    return
+                continue
+            if depth == 1 and _namespace(elem.tag) in _FEED_NAMESPACES:
+                if name == 'title':
+                    if 'title' not in entry:
+                        entry['title'] = (elem.text or '').strip()
+                elif name in ('guid', 'id'):
+                    entry['id'] = (elem.text or '').strip()
+                elif name == 'link':
+                    # Atom entries may have several links, the alternate one is the page of the entry
+                    rel = elem.get('rel', 'alternate')
+                    if 'link' not in entry or rel == 'alternate' and not alternate:
+                        entry['link'] = (elem.text or elem.get('href') or '').strip()
+                        alternate = rel == 'alternate'
+                elif name in ('pubDate', 'published', 'updated'):
+                    if 'published_parsed' not in entry or name != 'updated':
+                        entry['published_parsed'] = _parseDate(elem.text)
+            elif depth == 1 and name == 'date':
+                # dc:date of RSS 1.0 and some RSS 2.0 feeds
+                entry['published_parsed'] = _parseDate(elem.text)
+            depth -= 1
+    parser.close()
+
+
+def entryKey(entry):
+    """
+    Method of obtaining the identity of a feed entry for deduplication
+    :param entry: Feed entry dictionary
+    :return: Integer hash of the entry guid, link or title
+    """
+    ident = entry.get('id') or entry.get('guid') or entry.get('link') or entry.get('title') or ''
+    return int.from_bytes(hashlib.sha1(str(ident).encode('utf-8')).digest()[:8], 'little')
+
+
+def parseFeeds(text):
+    """
+    Method of parsing the list of feeds in format of lines "weight url"
+    :param text: Feeds list text, a single URL is accepted as well
+    :return: List of tuples (url, weight)
+    """
+    feeds = []
+    for line in text.splitlines():
+        parts = line.split()
+        if len(parts) == 1:
+            feeds.append((parts[0], 1.0))
+        elif len(parts) >= 2:
+            try:
+                feeds.append((parts[1], float(parts[0])))
+            except ValueError:
+                pass
+    return feeds
+
+
+def formatFeeds(feeds):
+    return '\n'.join('{0} {1}'.format(float(weight), url) for url, weight in feeds)
+
+
+class FeedAggregator(object):
+    """
+    Reader of several feeds. The feeds are fetched concurrently, entries are deduplicated
+    by their guid/link/title hash and the unseen headlines wait in a bounded priority queue
+    ordered by the publish time, shifted by the weight of their feed
+    """
+    _weight_seconds = 3600  # Weight 1.0 makes a headline as important as one published an hour later
+
+    def __init__(self, parse, interval=300, queue_size=20, seen_size=2000, initial_items=1):
+        """
+        :param parse: Feed parsing function accepting the document bytes or a local file path
+        :param interval: Polling interval of every feed in seconds
+        :param queue_size: Max number of headlines waiting for display
+        :param seen_size: Max number of remembered entries
+        :param initial_items: Number of the newest entries of a feed queued on its first fetch
+        """
+        self._parse = parse
+        self._interval = interval
+        self._queue_size = queue_size
+        self._seen_size = seen_size
+        self._initial_items = initial_items
+        self._feeds = []
+        self._fetchers = {}
+        self._next_fetch = {}
+        self._fetched = set()
+        self._seen = OrderedDict()
+        self._queue = []
+        self._counter = 0
+        self._executor = None
+        self._failed = False
+
+    def setFeeds(self, feeds):
+        """
+        Method to set the list of feeds
+        :param feeds: List of tuples (url, weight), a feed listed several times is fetched once with its max weight
+        :return:
+        """
+        weights = OrderedDict()
+        for url, weight in feeds:
+            weights[url] = max(weight, weights.get(url, weight))
+        feeds = list(weights.items())
+        if feeds == self._feeds:
+            return
+        self._feeds = feeds
+        urls = [url for url, _ in self._feeds]
+        for url in list(self._fetchers):
+            if url not in urls:
+                self._fetchers.pop(url).close()
+                self._next_fetch.pop(url, None)
+        for url in urls:
+            if url not in self._fetchers:
+                self._fetchers[url] = FeedFetcher()
+                self._next_fetch[url] = 0
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+    def _fetch(self, url, weight, now):
+        fetcher = self._fetchers[url]
+        try:
+            data = fetcher.fetch(url) if urlsplit(url).scheme in ('http', 'https') else url
+        except FetchError as e:
+            print('RSS fetch error:', e)
+            return url, None, now + fetcher.retryDelay(), True
+        if data is None:
+            return url, None, now + self._interval, False
+        cpu = time.process_time()
+        try:
+            feed = self._parse(data)
+        except Exception as e:
+            # A broken document of one feed must not stop the others
+            print('RSS parse error of {0}: {1}'.format(url, e))
+            fetcher.parseFailed()
+            return url, None, now + fetcher.retryDelay(), True
+        finally:
+            fetcher.addParseTime(time.process_time() - cpu)
+        return url, feed, now + self._interval, False
+
+    def poll(self, now=None):
+        """
+        Method of fetching the feeds whose polling time has come
+        :param now: Current time (monotonic)
+        :return: Number of new headlines queued
+        """
+        now = time.monotonic() if now is None else now
+        due = [(url, weight) for url, weight in self._feeds if now >= self._next_fetch.get(url, 0)]
+        if not due:
+            return 0
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=max(1, len(self._feeds)))
+        results = list(self._executor.map(lambda f: self._fetch(f[0], f[1], now), due))
+        weights = dict(self._feeds)
+        added = 0
+        failed = True
+        for url, feed, next_fetch, error in results:
+            self._next_fetch[url] = next_fetch
+            failed = failed and (error or (feed is not None and not feed['entries']))
+            if feed is not None:
+                added += self._addEntries(url, feed['entries'], weights.get(url, 1.0), now)
+        self._failed = failed and not self._queue
+        return added
+
+    def _addEntries(self, url, entries, weight, now):
+        first_fetch = url not in self._fetched
+        self._fetched.add(url)
+        added = 0
+        for n, entry in enumerate(entries):
+            key = entryKey(entry)
+            if key in self._seen:
+                self._seen.move_to_end(key)
+                continue
+            self._seen[key] = True
+            if len(self._seen) > self._seen_size:
+                self._seen.popitem(last=False)
+            if first_fetch and n >= self._initial_items:
+                continue
+            published = entry.get('published_parsed') or entry.get('updated_parsed')
+            published = calendar.timegm(published) if published else time.time()
+            priority = published + weight * self._weight_seconds
+            self._counter += 1
+            headline = {'title': str(entry.get('title', '')), 'link': str(entry.get('link', '')),
+                        'feed': url, 'published': published}
+            heapq.heappush(self._queue, (priority, self._counter, headline))
+            if len(self._queue) > self._queue_size:
+                heapq.heappop(self._queue)  # The least important headline is dropped
+            added += 1
+        return added
+
+    def pending(self):
+        return len(self._queue)
+
+    def getState(self):
+        """
+        Method of obtaining the state of the aggregator for saving between restarts
+        :return: Dictionary with the waiting headlines, feed validators, seen entries and fetched feeds
+        """
+        feeds = {}
+        for url, fetcher in self._fetchers.items():
+            etag, modified = fetcher.validators(url)
+            if etag or modified:
+                feeds[url] = {'etag': etag, 'modified': modified}
+        return {'queue': [[priority, headline] for priority, _, headline in sorted(self._queue, key=lambda q: q[:2])],
+                'feeds': feeds,
+                'seen': list(self._seen.keys()),
+                'fetched': sorted(self._fetched)}
+
+    def setState(self, state):
+        """
+        Method of restoring the state saved by getState(). The feeds must be set before
+        :param state: State dictionary
+        :return:
+        """
+        for priority, headline in state.get('queue', [])[-self._queue_size:]:
+            headline = headline if type(headline) is dict else {'title': str(headline)}
+            self._counter += 1
+            heapq.heappush(self._queue, (priority, self._counter, headline))
+        for url, validators in state.get('feeds', {}).items():
+            if url in self._fetchers:
+                self._fetchers[url].setValidators(url, validators.get('etag'), validators.get('modified'))
+        for key in state.get('seen', [])[-self._seen_size:]:
+            self._seen[key] = True
+        self._fetched.update(url for url in state.get('fetched', []) if url in self._fetchers)
+
+    def failed(self):
+        """
+        Method checks whether the last polling got nothing from any feed and no headlines are waiting
+        :return: True if all feeds failed or were empty
+        """
+        return self._failed
+
+    def pop(self):
+        """
+        Method of taking the most important unseen headline
+        :return: Headline dictionary with title, link, feed URL and publish timestamp or None if the queue is empty
+        """
+        if not self._queue:
+            return None
+        best = max(self._queue)
+        self._queue.remove(best)
+        heapq.heapify(self._queue)
+        return best[2]
+
+    def stats(self, now=None):
+        """
+        Method of obtaining the fetch counters summed over all feeds
+        :param now: Current time (monotonic)
+        :return: Dictionary of counters in format of FeedFetcher.stats()
+        """
+        total = {}
+        for fetcher in self._fetchers.values():
+            for key, value in fetcher.stats(now).items():
+                total[key] = total.get(key, 0) + value
+        return total
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+        for fetcher in self._fetchers.values():
+            fetcher.close()
+
+
+class HeadlineCache(object):
+    """
+    On-disk cache of the feed reader state. The file is replaced atomically and written
+    not more often than once per interval, so the SD card is not worn by every fetch
+    """
+
+    def __init__(self, path, min_interval=600):
+        """
+        :param path: Path of the cache file
+        :param min_interval: Min time in seconds between writes
+        """
+        self._path = path
+        self._min_interval = min_interval
+        self._state = None
+        self._dirty = False
+        self._last_write = 0
+
+    def load(self):
+        """
+        Method of reading the cache
+        :return: State dictionary, empty if there is no valid cache
+        """
+        try:
+            with open(self._path, mode='r', encoding='utf-8') as f:
+                state = json.loads(f.read())
+                self._state = state if type(state) is dict else {}
+        except (IOError, ValueError):
+            self._state = {}
+        return self._state
+
+    def update(self, state, now=None):
+        """
+        Method of changing the cached state, it is written to the disk if the write interval has passed
+        :param state: State dictionary
+        :param now: Current time (monotonic)
+        :return:
+        """
+        if state != self._state:
+            self._state = state
+            self._dirty = True
+        self.flushDue(now)
+
+    def flushDue(self, now=None):
+        """
+        Method of writing the changed state to the disk if the write interval has passed, it is called
+        periodically, so a change made inside the interval is not kept only in memory until the next one
+        :param now: Current time (monotonic)
+        :return:
+        """
+        now = time.monotonic() if now is None else now
+        if self._dirty and now - self._last_write >= self._min_interval:
+            self.flush(now)
+
+    def flush(self, now=None):
+        """
+        Method of writing the changed state to the disk
+        :param now: Current time (monotonic)
+        :return:
+        """
+        if not self._dirty:
+            return
+        self._last_write = time.monotonic() if now is None else now
+        tmp_path = self._path + '.tmp'
+        try:
+            with open(tmp_path, mode='w', encoding='utf-8') as f:
+                f.write(json.dumps(self._state, ensure_ascii=False))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self._path)
+            self._dirty = False
+        except (IOError, OSError):
+            print('Error writing headlines cache')
+
+
+_CHECK_FEED = ('<?xml version="1.0" encoding="utf-8"?><rss version="2.0"><channel><title>Test</title>' +
+               ''.join('<item><title>Headline {0}</title><guid>{0}</guid>'
+                       '<pubDate>Mon, 15 Oct 2018 10:{0:02d}:00 +0000</pubDate></item>'.format(n)
+                       for n in range(49, -1, -1)) + '</channel></rss>').encode('utf-8')
+
+_CHECK_NESTED = ('<?xml version="1.0" encoding="utf-8"?>'
+                 '<feed xmlns="http://www.w3.org/2005/Atom" xmlns:media="http://search.yahoo.com/mrss/">'
+                 '<entry><id>a1</id><source><title>Source title</title><link href="https://example.com/source"/>'
+                 '</source><media:title>Media title</media:title><title>Entry title</title>'
+                 '<link rel="enclosure" href="https://example.com/a1.mp3"/>'
+                 '<link rel="alternate" href="https://example.com/a1"/>'
+                 '<link rel="related" href="https://example.com/other"/>'
+                 '<updated>2018-10-15T10:00:00Z</updated><published>2018-10-15T09:00:00Z</published></entry>'
+                 '<entry><id>a2</id><title>Bad date</title><published>2018-99-99T99:00:00Z</published></entry>'
+                 '</feed>').encode('utf-8')
+
+
+def _feedServer():
+    """
+    Method starts a local stand-in of a feed server with ETag support. /feed is the test feed, every
+    other path is a broken document. The request headers and client ports are recorded by path
+    :return: Tuple (server, base URL, dictionary {path: list of tuples (client port, If-None-Match)})
+    """
+    import threading
+    from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+    requests = {}
+
+    class FeedHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def do_GET(self):
+            requests.setdefault(self.path, []).append((self.client_address[1], self.headers.get('If-None-Match')))
+            if self.headers.get('If-None-Match') == '"v1"':
+                self.send_response(304)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            feed = _CHECK_FEED if self.path == '/feed' else b'<rss><channel><item><title>'
+            body = gzip.compress(feed) if 'gzip' in self.headers.get('Accept-Encoding', '') else feed
+            self.send_response(200)
+            self.send_header('ETag', '"v1"')
+            if body is not feed:
+                self.send_header('Content-Encoding', 'gzip')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    # Every feed of the aggregator keeps its own connection, so they are served in threads
+    server = ThreadingHTTPServer(('127.0.0.1', 0), FeedHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, 'http://127.0.0.1:{0}'.format(server.server_port), requests
+
+
+def checkFeedReader(base_dir):
+    """
+    Method of checking the feed reader against a local stand-in server: conditional requests
+    and connection reuse, deduplication of feeds and entries, parsing of the item's own elements,
+    broken documents and persistence of the state in the headline cache
+    :param base_dir: Empty directory for the cache file
+    :return: List of descriptions of the failed checks
+    """
+    def reject(data):
+        raise ValueError('Malformed feed')
+
+    # Broken documents are rejected by the fallback parser like feedparser does with the worst ones
+    parse = lambda data: parseHeadlines(data, 10, reject)
+    failed = []
+    server, base_url, requests = _feedServer()
+    feed_url = base_url + '/feed'
+    try:
+        fetcher = FeedFetcher()
+        first = fetcher.fetch(feed_url)
+        second = fetcher.fetch(feed_url)
+        stats = fetcher.stats()
+        fetcher.close()
+        if first != _CHECK_FEED or second is not None:
+            failed.append('fetch: the document and then not modified are expected')
+        if [etag for _, etag in requests['/feed']] != [None, '"v1"']:
+            failed.append('fetch: sent validators {0}'.format(requests['/feed']))
+        if requests['/feed'][0][0] != requests['/feed'][1][0]:
+            failed.append('fetch: the connection is not reused')
+        if (stats['requests'], stats['not_modified'], stats['failures']) != (2, 1, 0):
+            failed.append('fetch: stats {0}'.format(stats))
+
+        requests.clear()
+        broken_url = base_url + '/broken'
+        aggregator = FeedAggregator(parse, initial_items=3)
+        aggregator.setFeeds([(feed_url, 2.0), (broken_url, 1.0), (feed_url, 1.0)])
+        if aggregator._feeds != [(feed_url, 2.0), (broken_url, 1.0)]:
+            failed.append('dedup: feeds {0}'.format(aggregator._feeds))
+        added = aggregator.poll(now=0)
+        if len(requests.get('/feed', [])) != 1 or len(requests.get('/broken', [])) != 1:
+            failed.append('dedup: requests {0}'.format(requests))
+        if added != 3 or aggregator.failed():
+            failed.append('poll: {0} headlines added, failed {1}'.format(added, aggregator.failed()))
+        if aggregator._fetchers[broken_url].stats()['failures'] != 1 or aggregator._next_fetch[broken_url] != 30:
+            failed.append('poll: the broken document is not counted as a failure with backoff')
+        if aggregator.pop()['title'] != 'Headline 49':
+            failed.append('poll: the newest headline is not the first')
+        if aggregator.poll(now=0) != 0:
+            failed.append('poll: feeds fetched again before their time')
+        if aggregator.poll(now=300) != 0 or [r[-1][1] for r in requests.values()] != ['"v1"', '"v1"']:
+            failed.append('poll: seen entries queued again or no conditional requests')
+
+        path = os.path.join(base_dir, 'headlines.json')
+        cache = HeadlineCache(path, min_interval=600)
+        cache.load()
+        cache.update(aggregator.getState(), now=1000)
+        saved = aggregator.getState()
+        aggregator.pop()
+        cache.update(aggregator.getState(), now=1100)
+        cache.flushDue(now=1500)
+        if HeadlineCache(path).load() != saved:
+            failed.append('cache: the first state is not written or the second one is written too early')
+        cache.flushDue(now=1600)
+        os.rename(path, path + '.old')
+        cache.update(aggregator.getState(), now=2200)
+        if os.path.exists(path):
+            failed.append('cache: an unchanged state is written again')
+        os.rename(path + '.old', path)
+        restored = FeedAggregator(parse, initial_items=3)
+        restored.setFeeds([(feed_url, 2.0)])
+        restored.setState(HeadlineCache(path).load())
+        if restored.pending() != aggregator.pending() or restored.pop() != aggregator.pop():
+            failed.append('cache: the waiting headlines are not restored')
+        requests.clear()
+        if restored.poll(now=0) != 0 or requests['/feed'] != [(requests['/feed'][0][0], '"v1"')]:
+            failed.append('cache: the validators or seen entries are not restored')
+        aggregator.close()
+        restored.close()
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    entries = parseHeadlines(_CHECK_NESTED)['entries']
+    expected = [{'id': 'a1', 'title': 'Entry title', 'link': 'https://example.com/a1',
+                 'published_parsed': _parseDate('2018-10-15T09:00:00Z')},
+                {'id': 'a2', 'title': 'Bad date', 'published_parsed': None}]
+    if entries != expected:
+        failed.append('parse: {0}'.format(entries))
+    return failed
+
+
+if __name__ == "__main__":
+    import sys
+    import tempfile
+
+    command = sys.argv[1] if len(sys.argv) > 1 else 'check'
+    if command != 'bench':
+        with tempfile.TemporaryDirectory() as tmp:
+            failed = checkFeedReader(tmp)
+        for description in failed:
+            print('FAILED', description)
+        print('{0} failed checks'.format(len(failed)) if failed else 'All feed reader checks passed')
+        sys.exit(1 if failed else 0)
+
+    server, base_url, _ = _feedServer()
+    fetcher = FeedFetcher()
+    for n in range(3):
+        start = time.monotonic()
+        data = fetcher.fetch(base_url + '/feed')
+        print('Fetch {0}: {1} in {2:.4f} s'.format(n, 'not modified' if data is None else '{0} bytes'.format(len(data)),
+                                                  time.monotonic() - start))
+    print(fetcher.stats())
+    fetcher.close()
+    server.shutdown()
+
+    # Parsing of a 2 MB feed: streaming parser for the first 10 items against feedparser for the whole document
+    import tracemalloc
+    item = ('<item><title>Headline {0} with some long text to make the feed larger</title>'
+            '<guid>https://example.com/news/{0}</guid><link>https://example.com/news/{0}</link>'
+            '<pubDate>Mon, 15 Oct 2018 10:{1:02d}:00 +0300</pubDate>'
+            '<description>' + 'Lorem ipsum dolor sit amet. ' * 40 + '</description></item>')
+    big = ['<?xml version="1.0" encoding="utf-8"?><rss version="2.0"><channel><title>Big</title>']
+    n = 0
+    while sum(len(p) for p in big) < 2 * 1024 * 1024:
+        big.append(item.format(n, n % 60))
+        n += 1
+    big = (''.join(big) + '</channel></rss>').encode('utf-8')
+    parsers = [('streaming', lambda d: parseHeadlines(d, 10))]
+    try:
+        import feedparser
+        parsers.append(('feedparser', feedparser.parse))
+    except ImportError:
+        print('feedparser is not installed, comparison skipped')
+    for name, parse in parsers:
+        tracemalloc.start()
+        start = time.process_time()
+        result = parse(big)
+        elapsed = time.process_time() - start
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        print('{0}: {1} bytes, {2} entries, {3:.3f} s CPU, peak memory {4:.1f} MB'.format(
+            name, len(big), len(result['entries']), elapsed, peak / 1024 / 1024))
@@ -7,66 +7,214 @@
 
 import os
 import time
-import feedparser
-from multiprocessing import Process, Value, Array as MpArray
-from ctypes import *
-from pilot_sound import PilotAlarms
-
-if os.name is not 'nt':
-    from smbus2 import SMBus
+from pilot_sound import soundWorker
+from pilot_state import PilotState, MessageChannel
+from pilot_therm import PilotThermometers, CONVERSION_TIMES
+from pilot_history import PilotHistory, SensorLog
+from pilot_adc import CHANNELS_NUM
+from pilot_rss import HeadlineCache, parseFeeds, formatFeeds
+from pilot_metrics import PilotMetrics, FAST_BUCKETS, SLOW_BUCKETS
+from pilot_workers import getContext, processMemory, headlineCapacity, publishHeadline, lightWorker, thermWorker, rssWorker, WorkerSupervisor, StopSignal
 
 
 class PilotSensors(object):
     # _rss_feed_src = './habrahabr.xml'
     # _rss_refrash_int = 60 # in seconds
     _rss_refrash_int = 300  # in seconds
-    _alarms = PilotAlarms()
-    _alarm_proc = None
-    _alarm_in_reproduction = Value(c_bool, False)
+    _rss_queue_size = 20  # Max number of headlines waiting for display
+    _rss_seen_size = 2000  # Max number of remembered feed entries
+    _rss_max_items = 10  # Number of the first feed items parsed, the rest of the feed is skipped
+    _rss_cache_path = 'rss-cache.json'
+    _rss_cache_interval = 600  # Min interval of the cache writes in seconds
+    _rss_title_max_length = 1000  # Longest title published with its run line image, longer ones go without it
+    _sound_pin = 12
+    _stop_timeout = 3  # Max time of waiting for the processes on stop in seconds
+    _worker_timeout = 30  # Max time without heartbeats of a process in seconds
+    _rss_worker_timeout = 120  # in seconds
+    _ringtones_cache_dir = 'ringtones-cache'
 
-    _photores_approx_arr = []
     _photores_DEV_ADDR = 0x48
-    _adc_channels = {
-        'AIN0': 0b1000000,  # 0x40 (photo-resistor)
-        'AIN1': 0b1000001,  # 0x41 (not connected)
-        'AIN2': 0b1000010,  # 0x42 (not connected)
-        'AIN3': 0b1000011,  # 0x43 (not connected)
-    }
-    _dac_channel = 0b1000000  # 0x40
+    _photores_channel = 0  # AIN0 (photo-resistor), AIN1-AIN3 are available for the analog sensors
+    _analog_sensors = {}
 
     _therm_sensors_base_dir = '/sys/devices/w1_bus_master1'
+    # Preferred order of sensors, other DS18B20 found on the bus are appended after them
     _therm_sensor_ids = ['000001ac0d2d',  # Indoor sensor ID
                          '000001ac5f3a']  # Outdoor sensor ID
+    _therm_bus_duty = 0.0125  # Share of time the bus spends converting, 12 bit sensors are polled once a minute
+
+    _sensor_log_dir = 'sensors-log'
+    _light_log_interval = 60  # in seconds
+
+    # Adaptive polling limits in seconds, the thermometers floor is derived from the conversion time
+    _light_poll_limits = (0.1, 2.0)
+    _light_poll_threshold = 2  # ADC units
+    _therm_poll_max = 600
+    _therm_poll_threshold = 0.5  # Celsius degrees
+
+    def __init__(self, devel=None, start_method=None):
+        """
+        :param devel: Emulate the sensors and the buzzer, by default only on Windows
+        :param start_method: Start method of the sensor processes, forkserver or spawn by default
+        """
+        self._devel = os.name == 'nt' or bool(devel)
+        # The processes are started from a slim entry module, not forked from the main process
+        ctx = getContext(start_method)
+
+        # Shared history of sensors values, must be created before the sensor processes are started
+        self._therms = PilotThermometers(self._therm_sensors_base_dir, self._therm_sensor_ids)
+        self._therm_names = ['therm' + str(i) for i in range(max(len(self._therms.sensorIds()), len(self._therm_sensor_ids)))]
+        self._history = PilotHistory(['light'] + self._therm_names)
+        # Persistent logs, each one is written only by the process of its sensor
+        self._logs = {name: SensorLog(os.path.join(self._sensor_log_dir, name + '.log')) for name in self._history.names()}
 
-    def __init__(self):
-        if os.name == 'nt':
-            self._devel = True
-        else:
-            self._devel = False
-            self._bus = SMBus(1)  # 1 for RPi model B rev.2
+        # Shared state of all processes. Every section has a single writer:
+        # control - main process, light/therm/rss - their sensor processes, sound - the sound process,
+        # <name>_health - the process of the same name
+        self._state = PilotState([
+            ('control', [('light_enable', '?'), ('rss_enable', '?'), ('therm_enable', '?'), ('rss_src', '1024s'), ('rss_next', 'I'), ('rss_shown', 'i'),
+                         ('light_poll_min', 'd'), ('light_poll_max', 'd'), ('therm_poll_max', 'd')] +
+                        [('ain{0}_filter'.format(n), 'i') for n in range(CHANNELS_NUM)] +
+                        [(name + '_res', 'i') for name in self._therm_names]),  # Requested resolutions, 0 - keep current
+            ('light', [('value', 'i')]),
+            ('analog', [('ain{0}'.format(n), 'd') for n in range(CHANNELS_NUM)]),
+            ('therm', [(name, 'd') for name in self._therm_names]),
+            ('rss', [('pending', 'i')]),
+            ('sound', [('in_reproduction', '?'), ('requests', 'I'), ('dropped', 'I'), ('queued', 'I'),
+                       ('latency_last', 'd'), ('latency_max', 'd')]),
+            ('light_poll', [('polls', 'Q'), ('saved_per_hour', 'd'), ('interval', 'd')]),
+            ('therm_poll', [('polls', 'Q'), ('saved_per_hour', 'd'), ('interval', 'd')]),
+            ('rss_stats', [('requests', 'Q'), ('not_modified', 'Q'), ('failures', 'Q'),
+                           ('bytes_per_hour', 'd'), ('parse_cpu_per_hour', 'd')]),
+        ] + [(name + '_health', [('heartbeat', 'd')]) for name in ('sound', 'light', 'rss', 'therm')])
+        self._control = self._state['control']
+        self._control.update(light_enable=True, rss_enable=True, therm_enable=True,
+                             rss_src='https://news.yandex.ru/index.rss'.encode('cp1251'),
+                             light_poll_min=self._light_poll_limits[0], light_poll_max=self._light_poll_limits[1],
+                             therm_poll_max=self._therm_poll_max,
+                             **{'ain{0}_filter'.format(n): 1 for n in range(CHANNELS_NUM)})
+        self._state['light'].value = 0xFF
+        # The last headline is restored from the cache, so it is available before the first frame
+        self._rss_cache_state = HeadlineCache(self._rss_cache_path, self._rss_cache_interval).load()
+        self._headlines = MessageChannel(headlineCapacity(self._rss_title_max_length))
+        if self._rss_cache_state.get('title'):
+            self.sendHeadline(self._rss_cache_state.get('headline') or {'title': self._rss_cache_state['title']})
+            self._control.update(rss_shown=int(self._rss_cache_state.get('shown', 0)))
+        self._state['therm'].write(*[float(-99) for _ in self._therm_names])
+
+        # Metrics updated by the processes, must be created before they are started
+        self._metrics = PilotMetrics()
+        metrics = self._metrics
+        metrics.histogram('light_read_seconds', 'Time of reading all ADC inputs')
+        metrics.histogram('therm_read_seconds', 'Time of reading all thermal sensors', SLOW_BUCKETS)
+        metrics.histogram('rss_poll_seconds', 'Time of the RSS polls which fetched feeds', SLOW_BUCKETS)
+        metrics.histogram('sound_latency_seconds', 'Time from a sound request to the start of its playback', SLOW_BUCKETS)
+        metrics.histogram('sound_note_error_seconds', 'Timing error of the note edges', FAST_BUCKETS)
+        self._addMetricsCollectors()
+
+        # All processes are watched by the supervisor, which restarts the crashed and hung ones
+        stop = StopSignal(ctx)
+        self._supervisor = WorkerSupervisor(ctx, stop)
+
+        # Starting sound process, it keeps the buzzer initialized and plays sounds on demand
+        self._ctx = ctx
+        self._ringtones = None
+        self._supervisor.add('sound', soundWorker, self._soundArgs(),
+                             health=self._state['sound_health'], timeout=self._worker_timeout,
+                             on_restart=self._restartSound)
 
         # Starting photoresistor process
-        self._photores_proc_enable = Value(c_bool, True)
-        self._photores_proc_val = Value(c_int, 0xFF)
-        self._photores_proc = Process(target=self.lightProc,
-                                      args=(self._photores_proc_enable, self._photores_proc_val, 20))
-        self._photores_proc.start()
-
-        # Starting RSS feed reader process
-        self._rss_proc_enable = Value(c_bool, True)
-        self._rss_proc_feed_src = MpArray(c_char, bytearray(255))
-        self._rss_proc_feed_src.value = 'https://news.yandex.ru/index.rss'.encode('cp1251')
-        self._rss_proc_val = MpArray(c_char, bytearray(255))
-        self._rss_proc = Process(target=self.rssProc,
-                                 args=(self._rss_proc_enable, self._rss_proc_feed_src, self._rss_proc_val, self._rss_refrash_int))
-        self._rss_proc.start()
+        self._supervisor.add('light', lightWorker, (self._state, stop, self._history, self._logs['light']),
+                             {'devel': self._devel, 'address': self._photores_DEV_ADDR,
+                              'channel': self._photores_channel, 'approx_length': 20,
+                              'poll_limits': self._light_poll_limits, 'poll_threshold': self._light_poll_threshold,
+                              'log_interval': self._light_log_interval, 'read_time': metrics['light_read_seconds']},
+                             health=self._state['light_health'], timeout=self._worker_timeout)
+
+        # Starting RSS feed reader process, a fetch may block it for the connect and read timeouts
+        self._supervisor.add('rss', rssWorker, (self._state, stop, self._headlines, self._rss_cache_path),
+                             {'cache_interval': self._rss_cache_interval, 'interval': self._rss_refrash_int,
+                              'queue_size': self._rss_queue_size, 'seen_size': self._rss_seen_size,
+                              'max_items': self._rss_max_items, 'poll_time': metrics['rss_poll_seconds']},
+                             health=self._state['rss_health'], timeout=self._rss_worker_timeout)
 
         # Starting DS18B20 thermosensors process
-        self._therm_proc_enable = Value(c_bool, True)
-        init_temps = [float(-99) for _ in range(len(self._therm_sensor_ids))]
-        self._therm_proc_val = MpArray(c_double, init_temps)
-        self._therm_proc = Process(target=self.thermProc, args=(self._therm_proc_enable, self._therm_proc_val, 60))
-        self._therm_proc.start()
+        self._supervisor.add('therm', thermWorker, (self._state, stop, self._history, self._logs, self._therms, self._therm_names),
+                             {'bus_duty': self._therm_bus_duty, 'poll_max': self._therm_poll_max,
+                              'poll_threshold': self._therm_poll_threshold, 'read_time': metrics['therm_read_seconds']},
+                             health=self._state['therm_health'], timeout=self._worker_timeout)
+        self._supervisor.start()
+
+    def _soundArgs(self):
+        """
+        Method of creating the commands queue of the sound process
+        :return: Positional arguments of the sound process
+        """
+        self._sound_queue = self._ctx.Queue()
+        if self._ringtones is not None:
+            self._sound_queue.put(('ringtones', self._ringtones))
+        return (self._sound_queue, self._state['sound'], self._sound_pin, self._ringtones_cache_dir,
+                self._devel and os.name != 'nt', self._state['sound_health'],
+                self._metrics['sound_latency_seconds'], self._metrics['sound_note_error_seconds'])
+
+    def _restartSound(self):
+        """
+        Method of preparing the restart of the sound process. The queue is replaced, because a process killed
+        while reading it may have left its lock taken, and the imported ringtones are sent to the new one
+        :return: Positional arguments of the sound process
+        """
+        # The old queue is not closed, a sound requested at the same moment is only lost
+        self._sound_queue.cancel_join_thread()
+        return self._soundArgs()
+
+    def _addMetricsCollectors(self):
+        """
+        Method of adding the metrics computed from the shared state at scrape time
+        :return:
+        """
+        metrics = self._metrics
+        workers = lambda key: [({'process': name}, stats[key]) for name, stats in self.getWorkersStats().items()]
+        metrics.addCollector('worker_restarts_total', 'counter', 'Restarts of the processes by the supervisor',
+                             lambda: workers('restarts'))
+        metrics.addCollector('worker_up', 'gauge', 'Process is alive', lambda: workers('alive'))
+        metrics.addCollector('worker_heartbeat_age_seconds', 'gauge', 'Time since the last heartbeat of the process',
+                             lambda: workers('heartbeat_age'))
+        metrics.addCollector('memory_rss_bytes', 'gauge', 'Resident memory of the process',
+                             lambda: [({'process': name}, memory[0] * 1024)
+                                      for name, memory in self.getMemoryStats().items() if memory is not None])
+        metrics.addCollector('memory_pss_bytes', 'gauge', 'Proportional set size of the process',
+                             lambda: [({'process': name}, memory[1] * 1024)
+                                      for name, memory in self.getMemoryStats().items()
+                                      if memory is not None and memory[1] is not None])
+        metrics.addCollector('sound_requests_total', 'counter', 'Sound requests',
+                             lambda: [({}, self.getSoundStats()['requests'])])
+        metrics.addCollector('sound_dropped_total', 'counter', 'Sounds dropped after waiting too long',
+                             lambda: [({}, self.getSoundStats()['dropped'])])
+        metrics.addCollector('sound_queued', 'gauge', 'Sounds waiting for playback',
+                             lambda: [({}, self.getSoundStats()['queued'])])
+        metrics.addCollector('rss_requests_total', 'counter', 'Feed requests by result',
+                             lambda: [({'result': key}, self._state['rss_stats'].get(key))
+                                      for key in ('requests', 'not_modified', 'failures')])
+        metrics.addCollector('rss_pending', 'gauge', 'Headlines waiting for display',
+                             lambda: [({}, self._state['rss'].get('pending'))])
+        metrics.addCollector('sensor_polls_total', 'counter', 'Polls of the sensors',
+                             lambda: [({'sensor': name}, self._state[name + '_poll'].get('polls'))
+                                      for name in ('light', 'therm')])
+
+    def signalWorkers(self, signum):
+        """
+        Method of passing a signal to the sensor and sound processes, used for the profiler signals
+        :param signum: Signal number
+        :return:
+        """
+        self._supervisor.sendSignal(signum)
+
+    def getMetrics(self):
+        """
+        Method of obtaining the metrics registry, metrics of the main process are added to it
+        :return: PilotMetrics object
+        """
+        return self._metrics
 
     def stopSensors(self):
         """
@@ -74,77 +222,130 @@ class PilotSensors(object):
         :return:
         """
         print('Stop sensors...')
-        if self._alarm_proc is not None and self._alarm_proc.pid is not None and self._alarm_proc.is_alive():
-            self._alarm_proc.terminate()
-        self._photores_proc_enable.value = False
-        self._photores_proc.join()
-        self._rss_proc.terminate()
-        self._therm_proc_enable.value = False
-        self._therm_proc.join()
+        self._sound_queue.put(('quit',))
+        self._control.update(light_enable=False, rss_enable=False, therm_enable=False)
+        self._supervisor.stop(self._stop_timeout)
+
+    def getWorkersStats(self):
+        """
+        Method of obtaining the state of the sensor and sound processes
+        :return: Dictionary of process name and dictionary with the alive flag, number of restarts,
+                 exit code of the last failure and the time in seconds since the last heartbeat
+        """
+        return self._supervisor.stats()
 
     def alarm(self, atype='click'):
         """
-        Method for starting process of sound reproduction
+        Method for requesting sound reproduction. A sound of a higher priority (alarm > config > click)
+        interrupts the current one at the note boundary, others wait in the queue of the sound process
         :param atype: Sets type of sound to play
         :return:
         """
+        # Names unknown to the sound process are played as the default ringtone there
         atype = atype.lower() if type(atype) == str else 'click'
-        if self._alarm_proc is not None and self._alarm_proc.pid is not None and self._alarm_proc.is_alive():
-            self._alarm_proc.terminate()
-        if atype == 'click':
-            self._alarm_proc = Process(target=self._alarms.click, args=(self._alarm_in_reproduction,))
-        elif atype == 'config_accept':
-            self._alarm_proc = Process(target=self._alarms.configAccept, args=(self._alarm_in_reproduction,))
-        elif atype == 'config_fail':
-            self._alarm_proc = Process(target=self._alarms.configFail, args=(self._alarm_in_reproduction,))
-        elif atype == 'alarm1':
-            self._alarm_proc = Process(target=self._alarms.clockAlarm, args=(self._alarm_in_reproduction, 1))
-        elif atype == 'alarm2':
-            self._alarm_proc = Process(target=self._alarms.clockAlarm, args=(self._alarm_in_reproduction, 2))
-        if self._alarm_proc.pid is None:
-            self._alarm_proc.start()
+        self._sound_queue.put(('play', atype, time.monotonic()))
+
+    def setRingtones(self, ringtones):
+        """
+        Method of importing ringtones played by name, they are compiled by the sound process in advance
+        :param ringtones: Dictionary {ringtone name: path of the RTTTL or MIDI file}
+        :return:
+        """
+        self._ringtones = {str(name).lower(): path for name, path in ringtones.items()}
+        self._sound_queue.put(('ringtones', self._ringtones))
+
+    def stopAlarm(self):
+        """
+        Method for interrupting the current sound and dropping the waiting ones
+        :return:
+        """
+        self._sound_queue.put(('stop',))
 
     def alarmInReproduction(self):
         """
         Method for get current state of sound reproduction flag
         :return: Current state of sound reproduction
         """
-        return self._alarm_in_reproduction.value
+        return self._state['sound'].value
+
+    def getSoundStats(self):
+        """
+        Method of obtaining the counters of the sound process
+        :return: Dictionary with the numbers of requests, dropped and queued sounds,
+                 the last and max time in seconds from a request to the start of its sound
+        """
+        return dict(zip(('requests', 'dropped', 'queued', 'latency_last', 'latency_max'),
+                        self._state['sound'].read()[1:]))
 
     def getLight(self):
         """
         Method of obtaining the current value of light intensity
         :return: Integer value in range from 0 to 255
         """
-        return self._photores_proc_val.value
+        return self._state['light'].value
 
-    def lightProc(self, proc_enable, proc_val, approx_length=20):
+    def setAnalogSensors(self, sensors):
         """
-        Code of the logic for reading the ADC data to determine the light intensity
-        :param proc_enable: Continued polling cycle flag
-        :param proc_val: The communication variable with the main process for returning the value read from the ADC
-        :param approx_length: Parameter specifying the number of values for obtaining the mean value of illumination in a time interval
+        Method to set the generic sensors connected to the free inputs of the converter
+        :param sensors: List of AnalogSensor objects
         :return:
         """
-        while proc_enable.value:
-            if self._devel:
-                proc_val.value = 255
-            else:
-                self._bus.write_byte(self._photores_DEV_ADDR, self._adc_channels['AIN0'])
-                self._photores_approx_arr.append(self._bus.read_byte(self._photores_DEV_ADDR))
-                alen = len(self._photores_approx_arr)
-                approx_val = sum(self._photores_approx_arr) / alen
-                if alen > approx_length:
-                    self._photores_approx_arr = self._photores_approx_arr[alen - approx_length:]
-                proc_val.value = 255 - int(approx_val)
-            time.sleep(0.1)
+        self._analog_sensors = {}
+        filters = {'ain{0}_filter'.format(n): 1 for n in range(CHANNELS_NUM)}
+        for sensor in sensors:
+            if sensor.channel == self._photores_channel:
+                print('Analog channel {0} is used by the photoresistor'.format(sensor.channel))
+                continue
+            self._analog_sensors[sensor.name] = sensor
+            filters['ain{0}_filter'.format(sensor.channel)] = sensor.filter_length
+        self._control.update(**filters)
+
+    def getAnalog(self, name):
+        """
+        Method of obtaining the value of a generic analog sensor
+        :param name: Sensor name
+        :return: Scaled filtered value or None if there is no sensor with this name
+        """
+        sensor = self._analog_sensors.get(name)
+        if sensor is None:
+            return None
+        return sensor.value(self._state['analog'].read()[sensor.channel])
+
+    def getMemoryStats(self):
+        """
+        Method of obtaining the memory usage of the main process and the processes of sensors
+        :return: Dictionary of process name and tuple (RSS, PSS) in kB, None if it is not available
+        """
+        stats = {'main': processMemory()}
+        for name in ('sound', 'light', 'rss', 'therm'):
+            proc = self._supervisor.process(name)
+            stats[name] = processMemory(proc.pid) if proc.is_alive() else None
+        return stats
+
+    def getHistory(self, name=None):
+        """
+        Method of obtaining the values history of sensors
+        :param name: Sensor name ('light', 'therm0', 'therm1'...)
+        :return: SensorSeries of the sensor or the whole PilotHistory if name is not specified
+        """
+        return self._history if name is None else self._history[name]
+
+    def getExtremes(self, name, seconds=86400):
+        """
+        Method of obtaining the min and max logged value of a sensor, the log survives restarts of the clock
+        :param name: Sensor name ('light', 'therm0', 'therm1'...)
+        :param seconds: Length of the time interval before now
+        :return: Tuple (min, max) or None if there is no data
+        """
+        return self._logs[name].extremes(seconds) if name in self._logs else None
 
     def getRSSFeedSource(self):
         """
         Method for get current value of RSS feed source variable
-        :return: RSS feed URL
+        :return: RSS feed URL, the first one if several feeds are set
         """
-        return self._rss_proc_feed_src.value.decode('cp1251')
+        feeds = self.getRSSFeeds()
+        return feeds[0][0] if feeds else ''
 
     def setRSSFeedSource(self, url):
         """
@@ -152,69 +353,176 @@ class PilotSensors(object):
         :param url: RSS feed URL
         :return:
         """
-        self._rss_proc_feed_src.value = url.encode('cp1251') if type(url) is str else self._rss_proc_feed_src.value
+        if type(url) is str:
+            self.setRSSFeeds([(url, 1.0)])
+
+    def getRSSFeeds(self):
+        """
+        Method for get the list of RSS feeds
+        :return: List of tuples (url, weight)
+        """
+        return parseFeeds(self._control.get('rss_src').rstrip(b'\0').decode('cp1251'))
+
+    def setRSSFeeds(self, feeds):
+        """
+        Method to set the list of RSS feeds read concurrently
+        :param feeds: List of tuples (url, weight), headlines of a feed with greater weight are shown earlier
+        :return:
+        :raises ValueError: Some feeds are invalid, they are ignored and the valid ones are set
+        """
+        valid = []
+        invalid = []
+        for url, weight in feeds:
+            try:
+                weight = float(weight)
+                url.encode('cp1251')
+            except (ValueError, TypeError, AttributeError, UnicodeEncodeError):
+                invalid.append(str(url))
+                continue
+            # URLs are stored as lines "weight url"
+            if not url or len(url.split()) != 1 or weight != weight or abs(weight) == float('inf'):
+                invalid.append(str(url))
+            else:
+                valid.append((url, weight))
+        text = formatFeeds(valid).encode('cp1251')
+        if len(text) > 1024:
+            raise ValueError('RSS feeds list is too long')
+        if valid:
+            self._control.update(rss_src=text)
+        if invalid:
+            raise ValueError('Invalid RSS feeds {0}'.format(', '.join(invalid)))
+
+    def pendingFeeds(self):
+        """
+        Method of obtaining the number of unseen headlines waiting for display
+        :return: Number of headlines
+        """
+        return self._state['rss'].get('pending')
+
+    def getFeedShown(self):
+        """
+        Method of obtaining the number of repeated shows of the current headline, it is kept between restarts
+        :return: Number of shows
+        """
+        return self._control.get('rss_shown')
+
+    def setFeedShown(self, count):
+        """
+        Method to set the number of repeated shows of the current headline
+        :param count: Number of shows
+        :return:
+        """
+        self._control.update(rss_shown=int(count))
+
+    def nextFeed(self):
+        """
+        Method asks the RSS feed reader process to publish the next unseen headline
+        :return:
+        """
+        self._control.update(rss_next=(self._control.get('rss_next') + 1) & 0xFFFFFFFF)
 
     def getLastFeed(self):
         """
         The method of obtaining the last title name of a record from RSS feed
-        :return: Last title name of a RSS feed
+        :return: Last title name of a RSS feed, the same object while the headline is unchanged
         """
-        return self._rss_proc_val.value.decode('iso8859-5')
+        return self._headlines.receive().get('title', '')
 
-    def rssProc(self, proc_enable, rss_proc_feed_src, proc_val, get_inerval=300):
+    def getLastFeedInfo(self):
         """
-        Code of the logic for reading data from RSS feed channel
-        :param proc_enable: Continued polling cycle flag
-        :param rss_proc_feed_src: The communication variable with the main process for get/set the value RSS-channel source URL
-        :param proc_val: The communication variable with the main process for returning the value read RSS-channel
-        :param get_inerval: Sets the polling time interval
-        :return:
+        The method of obtaining the last headline with its metadata
+        :return: Dictionary with title, link, feed URL and publish timestamp
         """
-        time.sleep(5)  # Starting delay for accepting configuration
-        interval = 0
-        replace_map = [('«', '"'), ('»', '"'), ('–', '-'), ('—', '-')]
-        while proc_enable.value:
-            if interval == 0:
-                feed = feedparser.parse(rss_proc_feed_src.value.decode('cp1251'))
-                feed_len = len(feed['entries'])
-                if feed_len > 0:
-                    last_rec_title = str(feed['entries'][0]['title']).replace('«', '"')
-                    for rep in replace_map:
-                        last_rec_title = last_rec_title.replace(rep[0], rep[1])
-                    proc_val.value = bytes(last_rec_title[:255], encoding='iso8859-5', errors='replace')
-                else:
-                    proc_val.value = bytes('А новостей на сегодня больше нет... или накрылся интернет :-(',
-                                           encoding='iso8859-5', errors='replace')
-            interval = interval + 1 if interval <= get_inerval else 0
-            time.sleep(1)
+        return self._headlines.receive()
+
+    def getFeedVersion(self):
+        """
+        Method of obtaining the version of the last headline, it changes every time a new headline is published
+        :return: Version number
+        """
+        return self._headlines.version()
+
+    def sendHeadline(self, headline):
+        """
+        Method of publishing a headline together with its run line image rendered in advance
+        :param headline: Headline dictionary
+        :return: True if the headline has been published
+        """
+        return publishHeadline(self._headlines, headline)
+
+    def getRSSStats(self):
+        """
+        Method of obtaining the counters of the RSS feed reader
+        :return: Dictionary with the numbers of requests, not modified responses and failures,
+                 transferred bytes and feed parsing CPU seconds per hour
+        """
+        return dict(zip(('requests', 'not_modified', 'failures', 'bytes_per_hour', 'parse_cpu_per_hour'),
+                        self._state['rss_stats'].read()))
 
     def getTherms(self):
         """
         The method of obtaining the list of values containing data from thermal sensors
-        :return: list of float values temperature
+        :return: tuple of float values temperature, the same object while the values are unchanged
+        """
+        return self._state['therm'].read()
+
+    def setPollingLimits(self, light=None, therm_max=None):
+        """
+        Method to set the limits of the adaptive sensors polling
+        :param light: Tuple (floor, ceiling) of the photoresistor polling interval in seconds
+        :param therm_max: Ceiling of the thermometers polling interval in seconds
+        :return:
+        :raises ValueError: Some limits are invalid, they are ignored and the valid ones are set
         """
-        return [t for t in self._therm_proc_val]
+        invalid = []
+        if light is not None:
+            try:
+                floor, ceiling = float(light[0]), float(light[1])
+            except (ValueError, TypeError, IndexError):
+                floor = ceiling = 0
+            if 0 < floor <= ceiling:
+                self._control.update(light_poll_min=floor, light_poll_max=ceiling)
+            else:
+                invalid.append('light')
+        if therm_max is not None:
+            try:
+                therm_max = float(therm_max)
+            except (ValueError, TypeError):
+                therm_max = 0
+            if therm_max > 0:
+                self._control.update(therm_poll_max=therm_max)
+            else:
+                invalid.append('therm_max')
+        if invalid:
+            raise ValueError('Invalid polling limits of {0}'.format(', '.join(invalid)))
+
+    def getPollingStats(self):
+        """
+        Method of obtaining the counters of the adaptive sensors polling
+        :return: Dictionary of sensor name and tuple (polls done, bus transactions saved per hour, current interval)
+        """
+        return {'light': self._state['light_poll'].read(), 'therm': self._state['therm_poll'].read()}
 
-    def thermProc(self, proc_enable, proc_val, get_interval=60):
+    def setThermResolutions(self, resolutions):
         """
-        Code of the logic for obtaining data from thermal sensors
-        :param proc_enable: Continued polling cycle flag
-        :param proc_val: The communication variable with the main process for returning the value obtained from thermal sensors
-        :param get_interval: Sets the polling time interval
+        Method to set the resolution of thermal sensors
+        :param resolutions: Dictionary of sensor ID and resolution in bits (9, 10, 11 or 12)
         :return:
+        :raises ValueError: Some resolutions are invalid, they are ignored and the valid ones are set
         """
-        interval = 0
-        s_paths = [self._therm_sensors_base_dir + '/28-' + sid + '/w1_slave' for sid in self._therm_sensor_ids]
-        while proc_enable.value:
-            if interval == 0:
-                for i, sensor in enumerate(s_paths):
-                    if os.path.exists(sensor):
-                        try:
-                            with open(sensor, "r") as t_file:
-                                tdata = t_file.readlines()
-                                if tdata[0].strip()[-4:].strip() == "YES":
-                                    proc_val[i] = float(tdata[1].split('=')[1]) / 1000
-                        except IOError:
-                            pass
-            interval = interval + 1 if interval <= get_interval else 0
-            time.sleep(1)
+        fields = {}
+        invalid = []
+        for name, sid in zip(self._therm_names, self._therms.sensorIds()):
+            if sid in resolutions:
+                try:
+                    bits = int(resolutions[sid])
+                except (ValueError, TypeError):
+                    bits = None
+                if bits in CONVERSION_TIMES:
+                    fields[name + '_res'] = bits
+                else:
+                    invalid.append(sid)
+        if fields:
+            self._control.update(**fields)
+        if invalid:
+            raise ValueError('Invalid resolution of sensors {0}'.format(', '.join(invalid)))
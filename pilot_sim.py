@@ -0,0 +1,394 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Simulation library of pilotClock project
+# (c) Hansom 2018
+#
+# Runs the main loop of the clock in virtual time with the headless display and scripted sensors,
+# so alarm windows, midnight, DST and the run line repeats are checked without waiting for them.
+# The loop sleeps through the injected sleeper, which advances the virtual clock. Frames while
+# nothing moves on the display are stretched up to the next minute or the next scripted event
+
+import os
+import json
+import tempfile
+from time import perf_counter
+from datetime import datetime, timedelta, timezone
+from pilot_metrics import PilotMetrics
+from pilot_sound import SOUNDS
+
+
+class VirtualClock(object):
+    """
+    Clock advanced only by its sleep method. The time is kept in UTC, so with a time zone the local
+    time jumps on the DST transitions exactly as datetime.now() does
+    """
+
+    def __init__(self, start, tz=None):
+        """
+        :param start: Local start time (naive datetime)
+        :param tz: tzinfo of the local time, for example zoneinfo.ZoneInfo('Europe/Moscow'), no DST if not specified
+        """
+        self._tz = tz
+        self._time = start if tz is None else start.replace(tzinfo=tz).astimezone(timezone.utc)
+        self.elapsed = 0.0
+
+    def now(self):
+        if self._tz is None:
+            return self._time
+        return self._time.astimezone(self._tz).replace(tzinfo=None)
+
+    def sleep(self, seconds):
+        self._time += timedelta(seconds=seconds)
+        self.elapsed += seconds
+
+    def set(self, time):
+        """
+        Method of moving the clock to a local time, the elapsed time is not changed
+        :param time: Local time (naive datetime)
+        :return:
+        """
+        self._time = time if self._tz is None else time.replace(tzinfo=self._tz).astimezone(timezone.utc)
+
+
+class ScriptedSensors(object):
+    """
+    Replacement of PilotSensors without processes: the values and headlines are set by the script
+    of the simulation and the sounds are only logged
+    """
+
+    def __init__(self, clock, events, light=255, therms=(20.0, -5.0)):
+        """
+        :param clock: VirtualClock
+        :param events: List the events are appended to
+        :param light: Initial light value
+        :param therms: Initial temperatures
+        """
+        self._clock = clock
+        self._events = events
+        self._light = light
+        self._therms = tuple(therms)
+        self._headline = {}
+        self._queue = []
+        self._shown = 0
+        self._sound_end = None
+        self._metrics = PilotMetrics()
+
+    def _log(self, kind, value=None):
+        self._events.append((self._clock.now(), kind, value))
+
+    def apply(self, kind, value):
+        """
+        Method of applying a scripted input
+        :param kind: 'light', 'therm' (list of temperatures) or 'headline' (title or headline dictionary)
+        :param value: Value of the input
+        :return:
+        """
+        if kind == 'light':
+            self._light = int(value)
+        elif kind == 'therm':
+            self._therms = tuple(value)
+        elif kind == 'headline':
+            headline = value if type(value) is dict else {'title': value}
+            if self._headline.get('title'):
+                self._queue.append(headline)
+            else:
+                self._publish(headline)
+            return
+        else:
+            raise ValueError('Unknown scripted input {0}'.format(kind))
+        self._log(kind, value)
+
+    def _publish(self, headline):
+        self._headline = dict(headline)
+        self._log('headline', headline['title'])
+
+    def getMetrics(self):
+        return self._metrics
+
+    def signalWorkers(self, signum):
+        pass
+
+    def stopSensors(self):
+        pass
+
+    def alarm(self, atype='click'):
+        atype = atype.lower() if type(atype) == str else 'click'
+        self._log('sound', atype)
+        sound = SOUNDS.get(atype, SOUNDS['alarm1'])
+        self._sound_end = self._clock.now() + timedelta(milliseconds=sum(duration for _, duration in sound))
+
+    def stopAlarm(self):
+        self._sound_end = None
+
+    def alarmInReproduction(self):
+        return self._sound_end is not None and self._clock.now() < self._sound_end
+
+    def setRingtones(self, ringtones):
+        pass
+
+    def getLight(self):
+        return self._light
+
+    def getTherms(self):
+        return self._therms
+
+    def setAnalogSensors(self, sensors):
+        pass
+
+    def setRSSFeedSource(self, url):
+        pass
+
+    def setRSSFeeds(self, feeds):
+        pass
+
+    def setPollingLimits(self, light=None, therm_max=None):
+        pass
+
+    def setThermResolutions(self, resolutions):
+        pass
+
+    def pendingFeeds(self):
+        return len(self._queue)
+
+    def getFeedShown(self):
+        return self._shown
+
+    def setFeedShown(self, count):
+        self._shown = int(count)
+
+    def nextFeed(self):
+        self._log('next_feed')
+        if self._queue:
+            self._publish(self._queue.pop(0))
+
+    def getLastFeed(self):
+        return self._headline.get('title', '')
+
+    def getLastFeedInfo(self):
+        return self._headline
+
+
+class PilotSimulation(object):
+    """
+    Simulation of the clock. The result is the log of events (local time, kind, value) and the cost
+    of the frames in real time, for assertions in tests:
+
+        sim = PilotSimulation(datetime(2018, 3, 24, 22, 0), config={...}, script=[(datetime(...), 'headline', '...')])
+        events = sim.run(timedelta(days=7)).events
+    """
+    _idle_step = 60  # Max virtual length of a frame while nothing moves on the display, in seconds
+
+    def __init__(self, start, config=None, script=(), tz=None, idle_step=None, light=255, therms=(20.0, -5.0)):
+        """
+        :param start: Local start time (naive datetime)
+        :param config: Configuration dictionary in the format of the config file
+        :param script: List of tuples (local time, input kind, value) of the sensor inputs, see ScriptedSensors.apply
+        :param tz: tzinfo of the local time for DST transitions
+        :param idle_step: Max virtual length of an idle frame in seconds, 0.5 renders every frame of the real clock
+        :param light: Initial light value
+        :param therms: Initial temperatures
+        """
+        from pilot import PilotClock
+
+        self._idle_step = idle_step or self._idle_step
+        self.clock = VirtualClock(start, tz)
+        self.events = []
+        self.sensors = ScriptedSensors(self.clock, self.events, light, therms)
+        self._script = sorted(script, key=lambda item: item[0])
+        self._script_pos = 0
+        self._costs = {'scroll': [], 'idle': []}
+        self._config_dir = tempfile.TemporaryDirectory()
+        config_path = os.path.join(self._config_dir.name, 'pilot-clock.conf')
+        with open(config_path, mode='w', encoding='utf-8') as f:
+            f.write(json.dumps(config or {}))
+
+        self._applyScript()
+        self.pilot = PilotClock(headless=True, sensors=self.sensors, now=self.clock.now, sleeper=self._sleep)
+        self.pilot._config_path = config_path
+        self.pilot._fonts_thread.join()
+        self._state = None
+        self._duration = 0
+        self.real_time = 0.0
+
+    def _applyScript(self):
+        now = self.clock.now()
+        while self._script_pos < len(self._script) and self._script[self._script_pos][0] <= now:
+            _, kind, value = self._script[self._script_pos]
+            self.sensors.apply(kind, value)
+            self._script_pos += 1
+
+    def _observe(self):
+        """
+        Method of logging the changes of the clock state after a frame
+        :return:
+        """
+        pilot = self.pilot
+        state = (pilot._mute, pilot._do_scroll)
+        previous = self._state or (None, False)
+        self._state = state
+        now = self.clock.now()
+        if state[0] != previous[0]:
+            self.events.append((now, 'mute', state[0]))
+        if state[1] and not previous[1]:
+            self.events.append((now, 'scroll', (pilot._scroll_text, pilot._scroll_text_shows_num)))
+        elif previous[1] and not state[1]:
+            self.events.append((now, 'scroll_end', pilot._scroll_text))
+
+    def _nextWake(self):
+        """
+        Method of obtaining the time in seconds until something may change on the idle display:
+        the next minute, the next scripted input or the next repeat of the run line
+        :return: Seconds
+        """
+        pilot = self.pilot
+        now = self.clock.now()
+        wake = min(self._idle_step, 60 - now.second - now.microsecond / 1000000)
+        if self._script_pos < len(self._script):
+            wake = min(wake, (self._script[self._script_pos][0] - now).total_seconds())
+        if pilot._scroll_text and (pilot._scroll_text_shows_num < pilot._scroll_text_show_count or self.sensors.pendingFeeds()):
+            repeat = pilot._last_scroll_time + timedelta(seconds=pilot._scroll_repeat_time + 1)
+            wake = min(wake, (repeat - now).total_seconds())
+        return wake
+
+    def _sleep(self, seconds):
+        now = perf_counter()
+        pilot = self.pilot
+        idle = not pilot._do_scroll and seconds > 1 / pilot._fps
+        self._costs['idle' if idle else 'scroll'].append(now - self._frame_start)
+        self._observe()
+        if idle:
+            seconds = max(seconds, self._nextWake())
+        if self.clock.elapsed + seconds >= self._duration:
+            seconds = max(self._duration - self.clock.elapsed, 0)
+            pilot._loop = False
+        self.clock.sleep(seconds)
+        self._applyScript()
+        self._frame_start = perf_counter()
+
+    def run(self, duration):
+        """
+        Method of running the main loop of the clock
+        :param duration: Virtual time, timedelta or seconds
+        :return: The simulation itself
+        """
+        self._duration = duration.total_seconds() if isinstance(duration, timedelta) else duration
+        self.pilot._loop = True
+        bench = self._frame_start = perf_counter()
+        try:
+            self.pilot.run()
+        finally:
+            self.real_time = perf_counter() - bench
+            self._config_dir.cleanup()
+        return self
+
+    def eventsOf(self, kind):
+        """
+        Method of filtering the events log
+        :param kind: Event kind
+        :return: List of tuples (local time, value)
+        """
+        return [(time, value) for time, event, value in self.events if event == kind]
+
+    def frameStats(self):
+        """
+        Method of obtaining the real cost of the frames
+        :return: Dictionary {'scroll' or 'idle': {'frames', 'mean', 'p95', 'max'}} with the times in seconds
+        """
+        stats = {}
+        for kind, costs in self._costs.items():
+            costs = sorted(costs)
+            stats[kind] = {'frames': len(costs),
+                           'mean': sum(costs) / len(costs) if costs else 0.0,
+                           'p95': costs[int(len(costs) * 0.95)] if costs else 0.0,
+                           'max': costs[-1] if costs else 0.0}
+        return stats
+
+
+def checkSimulation():
+    """
+    Method of checking the event logs of simulated days: weekday alarms and the sound window of the sample
+    config, the repeats of the run line and the headlines waiting for it, alarms at midnight and on the DST
+    transitions when the time zone data is available
+    :return: List of descriptions of the failed checks
+    """
+    failed = []
+
+    def expect(description, actual, expected):
+        if actual != expected:
+            failed.append('{0}: {1} instead of {2}'.format(description, actual, expected))
+
+    start = datetime(2018, 3, 19, 0, 0)
+    config = {'alarm_time': [{'start': '06:10:00', 'end': '23:00:00'}],
+              'alarm_clock': [{'time': '06:15', 'ringtone': 2, 'days_of_week': [0, 1, 2, 3, 4]}]}
+    script = [(start + timedelta(hours=h, minutes=7), 'headline', 'Headline {0}'.format(h)) for h in range(0, 7 * 24, 3)]
+    script += [(start + timedelta(days=1, hours=13, seconds=n), 'headline', 'Queued {0}'.format(n)) for n in range(2)]
+    sim = PilotSimulation(start, config, script).run(timedelta(days=7))
+    pilot = sim.pilot
+    sounds = sim.eventsOf('sound')
+    expect('weekday alarms', [(time, value) for time, value in sounds if value != 'click'],
+           [(start + timedelta(days=day, hours=6, minutes=15), 'alarm2') for day in range(5)])
+    expect('sounds outside of the sound window',
+           [time for time, _ in sounds if not time.replace(hour=6, minute=10) <= time <= time.replace(hour=23)], [])
+    # The idle display is checked once a minute, the window ends within the minute after its end time
+    expect('sound window', [(time.date(), time.hour, time.minute // 2, value) for time, value in sim.eventsOf('mute')],
+           [(start.date(), 0, 0, True)] + [((start + timedelta(days=day)).date(), hour, minute, value)
+                                           for day in range(7) for hour, minute, value in ((6, 5, False), (23, 0, True))])
+    expect('headlines', [title for _, title in sim.eventsOf('headline')],
+           [value for _, _, value in sorted(script, key=lambda item: item[0])])
+    scrolls = {}
+    for time, (title, shows_num) in sim.eventsOf('scroll'):
+        scrolls.setdefault(title, []).append(shows_num)
+    expect('run line shows', set(tuple(shows) for title, shows in scrolls.items() if title != 'Queued 0'),
+           {tuple(range(pilot._scroll_text_show_count + 1))})
+    # A waiting headline replaces the run line instead of its repeats
+    expect('shows of a replaced headline', scrolls.get('Queued 0'), [0])
+    pauses = [(begin - end).total_seconds() for (end, _), (begin, _) in zip(sim.eventsOf('scroll_end'), sim.eventsOf('scroll')[1:])]
+    expect('run line repeats earlier than the repeat time', [pause for pause in pauses if pause <= pilot._scroll_repeat_time], [])
+
+    try:
+        from zoneinfo import ZoneInfo
+        tz = ZoneInfo('Europe/Berlin')
+    except (ImportError, LookupError):
+        print('Time zone data is not available, DST checks skipped')
+        return failed
+    config = {'starting_song': False, 'alarm_time': [{'start': '00:00:00', 'end': '23:59:59'}],
+              'alarm_clock': [{'time': '02:30', 'ringtone': 1, 'days_of_week': list(range(7))},
+                              {'time': '03:30', 'ringtone': 2, 'days_of_week': [6]},
+                              {'time': '00:00', 'ringtone': 2, 'days_of_week': [0]}]}
+    # 02:30 does not exist on the day the clocks go forward and happens twice on the day they go back
+    for start, expected in ((datetime(2018, 3, 24, 0, 1), [(24, 2, 30, 'alarm1'), (25, 3, 30, 'alarm2'),
+                                                           (26, 0, 0, 'alarm2'), (26, 2, 30, 'alarm1')]),
+                            (datetime(2018, 10, 27, 0, 1), [(27, 2, 30, 'alarm1'), (28, 2, 30, 'alarm1'),
+                                                            (28, 3, 30, 'alarm2'), (29, 0, 0, 'alarm2'),
+                                                            (29, 2, 30, 'alarm1')])):
+        sim = PilotSimulation(start, config, tz=tz).run(timedelta(days=3))
+        expect('alarms from {0:%Y-%m-%d}'.format(start),
+               [(time.day, time.hour, time.minute, value) for time, value in sim.eventsOf('sound')], expected)
+    return failed
+
+
+if __name__ == "__main__":
+    import sys
+
+    if len(sys.argv) > 1 and sys.argv[1] == 'check':
+        failed = checkSimulation()
+        for description in failed:
+            print('FAILED', description)
+        print('{0} failed checks'.format(len(failed)) if failed else 'All simulation checks passed')
+        sys.exit(1 if failed else 0)
+
+    # A week with a headline every three hours, weekday alarms and the sound window of the sample config
+    start = datetime(2018, 3, 19, 0, 0)
+    config = {'alarm_time': [{'start': '06:10:00', 'end': '23:00:00'}],
+              'alarm_clock': [{'time': '06:15', 'ringtone': 2, 'days_of_week': [0, 1, 2, 3, 4]}]}
+    script = [(start + timedelta(hours=h, minutes=7), 'headline', 'Новость номер {0}: в городе ясно, без осадков'.format(h))
+              for h in range(0, 7 * 24, 3)]
+    script += [(start + timedelta(hours=h), 'therm', (20.0 + h % 5, -5.0 + h % 7)) for h in range(0, 7 * 24)]
+    sim = PilotSimulation(start, config, script).run(timedelta(days=7))
+    print('Simulated {0} in {1:.1f} s'.format(timedelta(seconds=sim.clock.elapsed), sim.real_time))
+    for kind, stats in sorted(sim.frameStats().items()):
+        print('  {0:6s} frames {1:7d}, mean {2:.3f} ms, p95 {3:.3f} ms, max {4:.3f} ms'.format(
+            kind, stats['frames'], stats['mean'] * 1000, stats['p95'] * 1000, stats['max'] * 1000))
+    print('Sounds: {0}'.format(', '.join('{0:%a %H:%M} {1}'.format(t, v) for t, v in sim.eventsOf('sound')[:12])))
+    print('Scrolls: {0}'.format(len(sim.eventsOf('scroll'))))
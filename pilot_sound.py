@@ -6,12 +6,13 @@
 
 
 import os
-from time import sleep
+import queue
+import heapq
+from time import sleep, monotonic
+from pilot_ringtones import RingtoneLibrary
 
 if os.name == 'nt':
     import winsound
-else:
-    import RPi.GPIO as GPIO
 
 _devel = True if os.name == 'nt' else False
 
@@ -37,15 +38,178 @@ MERRY_CHRISTMAS = "G-1-4  C-2-4 C-2-8 D-2-8 C-2-8 H-1-8  A-1-4 A-1-4 A-1-4\
     C-2-4 A-1-4 G-1-8 G-1-8 A-1-4 D-2-4 H-1-4 C-2-2"
 
 
+# Semitone offsets of the note names from D of the same octave
+NOTE_OFFSETS = {'C': -2, 'C#': -1, 'D': 0, 'D#': 1, 'E': 2, 'F': 3, 'F#': 4,
+                'G': 5, 'G#': 6, 'A': 7, 'B': 8, 'H': 9}
+
+
+def compileNote(note, speed=1):
+    """
+    Method of converting a note description into frequency and duration
+    :param note: Note name in format N-O-D, where N - note name, O - number of octave, D - note duration
+                 For example: C-1-2 or C#.-1-4 describe note C in first octave and duration 1/4 sec + half of its duration
+    :param speed: Sets the playing speed multiplier
+    :return: Tuple (frequency in Hz, duration in ms), frequency is 0 for a pause
+    """
+    note = str(note).upper().split('-')
+    if note[0] == 'P':
+        octave = 0
+        duration = int(note[1]) if note[1].isalnum() else 1
+    else:
+        octave = int(note[1]) if note[1].isalnum() else 0
+        duration = int(note[2]) if note[2].isalnum() else 1
+    note = note[0]
+
+    if duration in (1, 2, 4, 8, 16, 32):
+        dur = int(1000 / duration / speed)
+    else:
+        dur = int(500 / speed)
+
+    octave = (octave - 1) * 12
+    freq = 440
+
+    if note[len(note) - 1] == '.':
+        note = note[:len(note) - 1]
+        dur = int(dur + dur / 2)
+
+    if note == 'P':
+        freq = 0
+    elif note in NOTE_OFFSETS:
+        freq = 440 * 2 ** ((octave + NOTE_OFFSETS[note]) / 12)
+    return int(freq), dur
+
+
+def compileMelody(melody, speed=1):
+    """
+    Method of converting a melody description into a sequence of tones
+    :param melody: Sting sequence of note descriptions
+    :param speed: Sets the playing speed multiplier
+    :return: Tuple of tuples (frequency in Hz, duration in ms)
+    """
+    return tuple(compileNote(note, speed) for note in melody.split())
+
+
+# Sounds compiled once at import, the sound worker plays them by name
+SOUNDS = {
+    'click': ((440, 200),),
+    'config_accept': compileMelody("G-2-8 G-2-8 E-2-8"),
+    'config_fail': compileMelody("E-1-8 C-1-2 C-1-8"),
+    'alarm1': compileMelody(FAIRY_TALE),
+    'alarm2': compileMelody(MERRY_CHRISTMAS),
+}
+
+
+class MockPWM(object):
+    """
+    Stand-in of the GPIO PWM recording the edges of the signal, used to measure the playback timing
+    without a buzzer
+    """
+
+    def __init__(self, pin=12, freq=440):
+        self.freq = freq
+        self.edges = []  # List of (monotonic time, frequency), frequency is 0 for the off edge
+
+    def ChangeFrequency(self, freq):
+        self.freq = freq
+
+    def start(self, duty):
+        self.edges.append((monotonic(), self.freq))
+
+    def stop(self):
+        self.edges.append((monotonic(), 0))
+
+
 class PilotSound(object):
     _pwm = None
+    _gpio = None
+    _spin_time = 0.002  # Last part of a wait spent in a busy loop, sleep wake-ups are late by up to a few ms
+    _note_gap = 20  # Silence at the end of every note in ms, so repeated notes are heard separately
+    _duty_cycle = 10  # PWM duty cycle of the buzzer in percent
 
-    def __init__(self, pin=12):
+    def __init__(self, pin=12, pwm=None):
+        """
+        :param pin: Buzzer pin number
+        :param pwm: PWM object to use instead of the GPIO one, for example MockPWM
+        """
         self._pin = pin
-        if not _devel:
+        self._timing = []
+        if pwm is not None:
+            self._pwm = pwm
+        elif not _devel:
+            # GPIO is imported only by the process playing sounds
+            import RPi.GPIO as GPIO
             GPIO.setmode(GPIO.BOARD)
             GPIO.setup(pin, GPIO.OUT)
             self._pwm = GPIO.PWM(12, 440)
+            self._gpio = GPIO
+
+    def close(self):
+        if self._pwm is not None:
+            self._pwm.stop()
+            self._pwm = None
+            if self._gpio is not None:
+                self._gpio.cleanup()
+                self._gpio = None
+
+    def __del__(self):
+        self.close()
+
+    def _waitUntil(self, deadline):
+        remaining = deadline - monotonic()
+        if remaining > self._spin_time:
+            sleep(remaining - self._spin_time)
+        while monotonic() < deadline:
+            pass
+
+    def play(self, tones, interrupted=None):
+        """
+        Method of reproducing a compiled melody. Note on and off edges are scheduled against absolute
+        monotonic deadlines counted from the start of the melody, so a late wake-up shortens the current
+        note instead of shifting the rest of the melody. A note whose off edge has already passed is skipped
+        :param tones: Sequence of tuples (frequency in Hz, duration in ms), frequency is 0 for a pause
+        :param interrupted: Function checked before every note, playback stops when it returns True
+        :return: False if the playback was interrupted, otherwise True
+        """
+        self._timing = []
+        deadline = monotonic()
+        for freq, duration in tones:
+            if interrupted is not None and interrupted():
+                return False
+            end = deadline + duration / 1000
+            off = end - min(self._note_gap, duration / 2) / 1000
+            self._waitUntil(deadline)
+            on_error = monotonic() - deadline
+            if freq > 0 and monotonic() < off:
+                if self._pwm is None:
+                    winsound.Beep(freq, int((off - monotonic()) * 1000) or 1)
+                else:
+                    self._pwm.ChangeFrequency(freq)
+                    self._pwm.start(self._duty_cycle)
+                    self._waitUntil(off)
+                    self._pwm.stop()
+                self._timing.append((on_error, monotonic() - off))
+            else:
+                self._timing.append((on_error, 0.0))
+            deadline = end
+        self._waitUntil(deadline)
+        return True
+
+    def timing(self):
+        """
+        Method of obtaining the timing errors of the last played melody
+        :return: List of tuples (note on error, note off error) in seconds, positive values are late edges
+        """
+        return list(self._timing)
+
+    def timingStats(self):
+        """
+        Method of obtaining the summary of timing errors of the last played melody
+        :return: Tuple (number of notes, mean absolute edge error in ms, max absolute edge error in ms)
+        """
+        errors = [abs(e) * 1000 for edges in self._timing for e in edges]
+        if not errors:
+            return 0, 0.0, 0.0
+        return len(self._timing), sum(errors) / len(errors), max(errors)
 
     def beep(self, freq, duration):
         """
@@ -54,18 +218,7 @@ class PilotSound(object):
         :param duration: Sets duration
         :return:
         """
-        if _devel:
-            winsound.Beep(freq, duration)
-        else:
-            self._pwm.ChangeFrequency(freq)
-            self._pwm.start(10)
-            sleep(duration / 1000)
-            self._pwm.stop()
-            sleep(0.02)
-
-    def __del__(self):
-        if not _devel:
-            GPIO.cleanup()
+        self.play(((freq, duration),))
 
     def note(self, note, speed=1):
         """
@@ -75,118 +228,228 @@ class PilotSound(object):
         :param speed: Sets the playing speed multiplier
         :return:
         """
-        note = str(note).upper().split('-')
-        if note[0] == 'P':
-            octave = 0
-            duration = int(note[1]) if note[1].isalnum() else 1
-        else:
-            octave = int(note[1]) if note[1].isalnum() else 0
-            duration = int(note[2]) if note[2].isalnum() else 1
-        note = note[0]
-
-        dur = int(500 / speed)
-        if duration == 1:
-            dur = int(1000 / speed)
-        elif duration == 2:
-            dur = int(1000 / 2 / speed)
-        elif duration == 4:
-            dur = int(1000 / 4 / speed)
-        elif duration == 8:
-            dur = int(1000 / 8 / speed)
-        elif duration == 16:
-            dur = int(1000 / 16 / speed)
-        elif duration == 32:
-            dur = int(1000 / 32 / speed)
-
-        octave = (octave - 1) * 12
-        freq = 440
-
-        if note[len(note) - 1] == '.':
-            note = note[:len(note) - 1]
-            dur = int(dur + dur / 2)
-
-        if note == 'P':
-            freq = 0
-        elif note == "C":
-            freq = 440 * 2 ** ((octave - 2) / 12)
-        elif note == "C#":
-            freq = 440 * 2 ** ((octave - 1) / 12)
-        elif note == "D":
-            freq = 440 * 2 ** (octave / 12)
-        elif note == "D#":
-            freq = 440 * 2 ** ((octave + 1) / 12)
-        elif note == "E":
-            freq = 440 * 2 ** ((octave + 2) / 12)
-        elif note == "F":
-            freq = 440 * 2 ** ((octave + 3) / 12)
-        elif note == "F#":
-            freq = 440 * 2 ** ((octave + 4) / 12)
-        elif note == "G":
-            freq = 440 * 2 ** ((octave + 5) / 12)
-        elif note == "G#":
-            freq = 440 * 2 ** ((octave + 6) / 12)
-        elif note == "A":
-            freq = 440 * 2 ** ((octave + 7) / 12)
-        elif note == "B":
-            freq = 440 * 2 ** ((octave + 8) / 12)
-        elif note == "H":
-            freq = 440 * 2 ** ((octave + 9) / 12)
-
-        if freq > 0:
-            self.beep(int(freq), dur)
-        else:
-            sleep(1000 / dur)
+        self.play((compileNote(note, speed),))
 
     def melody(self, melody, speed=1):
         """
         Method of reproducing a sequence of musical notes, also known as a melody
-        :param melody: Sting sequence of note descriptions
+        :param melody: Sting sequence of note descriptions or compiled melody
         :param speed: Sets the playing speed multiplier
         :return:
         """
-        for note in melody.split():
-            self.note(note, speed)
+        self.play(compileMelody(melody, speed) if type(melody) is str else melody)
+
 
+# Sound priority classes: (priority, max waiting time in seconds or None to wait forever).
+# Sounds not listed here, alarms and imported ringtones, have the alarm priority
+SOUND_PRIORITIES = {
+    'click': (0, 2),
+    'config_accept': (1, 60),
+    'config_fail': (1, 60),
+}
+ALARM_PRIORITY = (2, None)
 
-# Helper class for reproducing sounds in separated process
-class PilotAlarms(object):
 
-    def clockAlarm(self, reprod, num=1):
+class SoundScheduler(object):
+    """
+    Queue of requested sounds ordered by priority and request time. A sound of a higher priority preempts
+    the current one, lower and equal priority sounds wait until it is finished. A request of a sound that
+    is already playing or waiting is coalesced with it, requests waiting longer than allowed are dropped
+    """
+
+    def __init__(self, priorities=SOUND_PRIORITIES, default=ALARM_PRIORITY):
         """
-        Clock alarm method for playing melody
-        :param reprod: Variable for transmitting the current sound playback state
-        :param num: Melody number to play
-        :return:
+        :param priorities: Dictionary {sound name: (priority, max waiting time in seconds)}
+        :param default: Priority class of the sounds not listed in priorities
+        """
+        self._priorities = priorities
+        self._default = default
+        self._pending = []  # Heap of (-priority, request time, order, sound name)
+        self._order = 0
+        self._current = None
+        self.dropped = 0
+
+    def __len__(self):
+        return len(self._pending)
+
+    def priority(self, name):
+        return self._priorities.get(name, self._default)[0]
+
+    def current(self):
+        return self._current
+
+    def push(self, name, requested):
+        """
+        Method of requesting a sound
+        :param name: Sound name
+        :param requested: Time of the request (monotonic)
+        :return: False if the request was coalesced with the same sound, otherwise True
+        """
+        if name == self._current or any(pending[3] == name for pending in self._pending):
+            return False
+        self._order += 1
+        heapq.heappush(self._pending, (-self.priority(name), requested, self._order, name))
+        return True
+
+    def preempts(self):
         """
-        ps = PilotSound()
-        reprod.value = True
-        if num == 1:
-            ps.melody(FAIRY_TALE)
-        elif num == 2:
-            ps.melody(MERRY_CHRISTMAS)
-        reprod.value = False
-
-    def click(self, reprod):
-        ps = PilotSound()
-        reprod.value = True
-        ps.beep(440, 200)
-        reprod.value = False
-
-    def configAccept(self, reprod):
-        ps = PilotSound()
-        reprod.value = True
-        ps.melody("G-2-8 G-2-8 E-2-8")
-        reprod.value = False
-
-    def configFail(self, reprod):
-        ps = PilotSound()
-        reprod.value = True
-        ps.melody("E-1-8 C-1-2 C-1-8")
-        reprod.value = False
+        Method checks whether the current sound must be interrupted by a waiting one
+        :return: True if a sound of a higher priority is waiting
+        """
+        return bool(self._pending) and self._current is not None and \
+            -self._pending[0][0] > self.priority(self._current)
+
+    def pop(self, now):
+        """
+        Method of taking the next sound to play, it becomes the current sound
+        :param now: Current time (monotonic)
+        :return: Tuple (sound name, request time), None if there is nothing to play
+        """
+        self._current = None
+        while self._pending:
+            _, requested, _, name = heapq.heappop(self._pending)
+            max_wait = self._priorities.get(name, self._default)[1]
+            if max_wait is not None and now - requested > max_wait:
+                self.dropped += 1
+                continue
+            self._current = name
+            return name, requested
+        return None
+
+    def finish(self):
+        self._current = None
+
+    def clear(self):
+        self.dropped += len(self._pending)
+        self._pending = []
+
+
+def soundWorker(commands, state, pin=12, ringtones_cache='ringtones-cache', mock=False, health=None,
+                latency_time=None, note_error=None):
+    """
+    Code of the long-lived sound process. It owns the GPIO and PWM of the buzzer and plays sounds
+    by name from the commands queue in the order of their priorities. A sound of a higher priority
+    interrupts the current one at the note boundary
+    :param commands: Queue of commands: ('play', sound name, request time), ('ringtones', {name: file path}),
+                     ('stop',) or ('quit',)
+    :param state: Section of the shared state with fields in_reproduction, requests, dropped, queued,
+                  latency_last, latency_max, its only writer is this process
+    :param pin: Buzzer pin number
+    :param ringtones_cache: Directory of the compiled ringtones
+    :param mock: Play sounds with the mock PWM, for running without the buzzer
+    :param health: Section of the shared state for the heartbeat time of the process
+    :param latency_time: Histogram of the time from a request to the start of its sound
+    :param note_error: Histogram of the timing errors of the note edges
+    :return:
+    """
+    heartbeat_interval = 1  # Max time in seconds between heartbeats of the idle process
+    ps = PilotSound(pin, MockPWM() if mock else None)
+    library = RingtoneLibrary(ringtones_cache)
+    scheduler = SoundScheduler()
+    control = {'quit': False, 'stop': False}
+    stats = {'requests': 0, 'latency_last': 0.0, 'latency_max': 0.0}
+
+    def handle(command):
+        if command[0] == 'quit':
+            control['quit'] = True
+        elif command[0] == 'stop':
+            control['stop'] = True
+            scheduler.clear()
+        elif command[0] == 'ringtones':
+            # Ringtones are compiled when the config is read, never at the alarm time
+            library.load(command[1])
+        elif command[0] == 'play':
+            stats['requests'] += 1
+            scheduler.push(command[1], command[2] if len(command) > 2 else monotonic())
+
+    def beat():
+        if health is not None:
+            health.value = monotonic()
+
+    def receive():
+        beat()
+        received = False
+        while not commands.empty():
+            try:
+                handle(commands.get_nowait())
+                received = True
+            except queue.Empty:
+                break
+        if received and scheduler.current() is not None:
+            publish(True)
+        return control['quit'] or control['stop'] or scheduler.preempts()
+
+    def publish(playing):
+        state.update(in_reproduction=playing, requests=stats['requests'], dropped=scheduler.dropped,
+                     queued=len(scheduler), latency_last=stats['latency_last'], latency_max=stats['latency_max'])
+
+    try:
+        while not control['quit']:
+            if not scheduler:
+                beat()
+                try:
+                    handle(commands.get(timeout=heartbeat_interval))
+                except queue.Empty:
+                    continue
+            receive()
+            control['stop'] = False
+            if control['quit']:
+                break
+            next_sound = scheduler.pop(monotonic())
+            if next_sound is None:
+                publish(False)
+                continue
+            name, requested = next_sound
+            sound = SOUNDS.get(name) or library.get(name)
+            if sound is None:
+                print('Unknown ringtone {0}, playing the default one'.format(name))
+                sound = SOUNDS['alarm1']
+            stats['latency_last'] = monotonic() - requested
+            stats['latency_max'] = max(stats['latency_max'], stats['latency_last'])
+            if latency_time is not None:
+                latency_time.observe(stats['latency_last'])
+            publish(True)
+            ps.play(sound, receive)
+            if note_error is not None:
+                for edges in ps.timing():
+                    for error in edges:
+                        note_error.observe(abs(error))
+            scheduler.finish()
+            publish(bool(scheduler) and not control['quit'])
+    finally:
+        state.update(in_reproduction=False)
+        ps.close()
+
+
+def _busyLoop(seconds):
+    end = monotonic() + seconds
+    while monotonic() < end:
+        pass
 
 
 if __name__ == "__main__":
-    pst = PilotSound()
-    # pst.melody(MERRY_CHRISTMAS, 1)
-    # pst.melody("G-2-8 G-2-8 E-2-8")
-    pst.melody("E-1-8 C-1-2 C-1-8")
+    import sys
+
+    if len(sys.argv) > 1 and sys.argv[1] == 'bench':
+        # Playback accuracy with the mock PWM, optionally with N busy processes loading the CPU
+        from multiprocessing import Process
+
+        load = [Process(target=_busyLoop, args=(60,), daemon=True) for _ in range(int(sys.argv[2]) if len(sys.argv) > 2 else 0)]
+        for proc in load:
+            proc.start()
+        pwm = MockPWM()
+        pst = PilotSound(pwm=pwm)
+        melody = SOUNDS['alarm1']
+        start = monotonic()
+        pst.play(melody)
+        length = sum(duration for _, duration in melody) / 1000
+        notes, mean_error, max_error = pst.timingStats()
+        print('Notes: {0}, edges: {1}, mean error: {2:.3f} ms, max error: {3:.3f} ms, tempo drift: {4:.3f} ms'.format(
+            notes, len(pwm.edges), mean_error, max_error, (monotonic() - start - length) * 1000))
+        for proc in load:
+            proc.terminate()
+    else:
+        pst = PilotSound()
+        # pst.melody(MERRY_CHRISTMAS, 1)
+        # pst.melody("G-2-8 G-2-8 E-2-8")
+        pst.melody(SOUNDS['config_fail'])
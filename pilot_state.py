@@ -0,0 +1,236 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Shared state library of pilotClock project
+# (c) Hansom 2018
+
+import json
+import struct
+from multiprocessing.sharedctypes import RawArray
+from ctypes import c_ubyte, c_uint32
+
+_SEQ = struct.Struct('=I')
+
+
+class SeqlockSection(object):
+    """
+    Part of the shared state block with a fixed struct layout, protected by a sequence lock.
+    The section has a single writer process. The writer makes the sequence odd while it updates
+    the data and even again when it is done, so readers never take a lock: they retry if the
+    sequence was odd or changed during the read. The sequence also serves as a version counter,
+    a reader re-unpacks the data only when it has changed since its last read
+    """
+    _read_retries = 100
+
+    def __init__(self, buf, offset, fmt, names):
+        """
+        :param buf: Shared buffer of the state block
+        :param offset: Offset of the section in the buffer
+        :param fmt: Struct format of the section data
+        :param names: Field names in the order of the format
+        """
+        self._args = (buf, offset, fmt, names)
+        self._buf = memoryview(buf).cast('B')
+        self._seq = c_uint32.from_buffer(buf, offset)
+        self._offset = offset + _SEQ.size
+        self._struct = struct.Struct('=' + fmt)
+        self._names = tuple(names)
+        self._index = {name: i for i, name in enumerate(self._names)}
+        self._cache = self._struct.unpack_from(self._buf, self._offset)
+        self._cache_seq = -1
+
+    def __getstate__(self):
+        # Views of the buffer can not be pickled, they are mapped again in the child process
+        return self._args
+
+    def __setstate__(self, state):
+        self.__init__(*state)
+
+    @staticmethod
+    def size(fmt):
+        return _SEQ.size + struct.calcsize('=' + fmt)
+
+    def version(self):
+        return self._seq.value
+
+    def read(self):
+        """
+        Method of obtaining a consistent snapshot of the section data
+        :return: Tuple of field values, the same object is returned while the data is unchanged
+        """
+        for _ in range(self._read_retries):
+            seq = self._seq.value
+            if seq == self._cache_seq:
+                return self._cache
+            if seq & 1:
+                continue
+            data = self._struct.unpack_from(self._buf, self._offset)
+            if self._seq.value == seq:
+                self._cache = data
+                self._cache_seq = seq
+                return data
+        # The writer died in the middle of an update, keep the last consistent data
+        return self._cache
+
+    def get(self, name):
+        return self.read()[self._index[name]]
+
+    def write(self, *values):
+        """
+        Method of replacing all section data, must be called only from the writer process of the section
+        :param values: Field values in the order of the format
+        :return:
+        """
+        # Parity is forced, so a writer killed in the middle of an update does not break the next one
+        self._seq.value = (self._seq.value | 1) & 0xFFFFFFFF
+        self._struct.pack_into(self._buf, self._offset, *values)
+        self._seq.value = (self._seq.value + 1) & 0xFFFFFFFF
+
+    def update(self, **fields):
+        """
+        Method of changing several fields of the section, must be called only from the writer process of the section
+        :param fields: Field names and values
+        :return:
+        """
+        values = list(self._struct.unpack_from(self._buf, self._offset))
+        for name, value in fields.items():
+            values[self._index[name]] = value
+        self.write(*values)
+
+    @property
+    def value(self):
+        """
+        Value of the first field, for sections with a single value
+        """
+        return self.read()[0]
+
+    @value.setter
+    def value(self, value):
+        self.update(**{self._names[0]: value})
+
+
+class PilotState(object):
+    """
+    Single shared memory block with the state of all the clock processes, split into sections
+    """
+
+    def __init__(self, layout):
+        """
+        :param layout: List of sections in format (section name, [(field name, struct format), ...])
+        """
+        self._layout = [(name, list(fields)) for name, fields in layout]
+        # Every section starts on a 8 byte boundary, so the sequence counters are aligned
+        total = sum((SeqlockSection.size(''.join(f for _, f in fields)) + 7) & ~7 for _, fields in self._layout)
+        self._buf = RawArray(c_ubyte, total)
+        self._mapSections()
+
+    def _mapSections(self):
+        self._sections = {}
+        offset = 0
+        for name, fields in self._layout:
+            fmt = ''.join(f for _, f in fields)
+            self._sections[name] = SeqlockSection(self._buf, offset, fmt, [n for n, _ in fields])
+            offset += (SeqlockSection.size(fmt) + 7) & ~7
+
+    def __getitem__(self, name):
+        return self._sections[name]
+
+    def __getstate__(self):
+        # Views of the buffer can not be pickled, they are mapped again in the child process
+        return {'_layout': self._layout, '_buf': self._buf}
+
+    def __setstate__(self, state):
+        self._layout = state['_layout']
+        self._buf = state['_buf']
+        self._mapSections()
+
+
+class MessageChannel(object):
+    """
+    Shared memory channel of versioned variable-length records with a single writer.
+    The record is stored in one of two slots: the writer fills the inactive slot and then switches
+    the seqlock protected header to it, so the current record is never overwritten in place.
+    Readers copy and decode the record only when the version has changed.
+    A record is a JSON dictionary optionally followed by binary data, returned under the 'data' key
+    """
+    _LENGTH = struct.Struct('=I')
+
+    def __init__(self, capacity=8192):
+        """
+        :param capacity: Max size of an encoded record in bytes
+        """
+        self._capacity = capacity
+        self._data = RawArray(c_ubyte, capacity * 2)
+        self._header = PilotState([('header', [('slot', 'B'), ('length', 'I')])])
+        self._cache = {}
+        self._cache_version = 0
+
+    def __getstate__(self):
+        return {'_capacity': self._capacity, '_data': self._data, '_header': self._header}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._cache = {}
+        self._cache_version = 0
+
+    def version(self):
+        return self._header['header'].version()
+
+    def send(self, message, data=b''):
+        """
+        Method of publishing a new record, must be called only from the writer process
+        :param message: Dictionary serializable to JSON
+        :param data: Binary data of the record
+        :return: False if the record is longer than the capacity of the channel and was not published
+        """
+        text = json.dumps(message, ensure_ascii=False).encode('utf-8')
+        data = self._LENGTH.pack(len(text)) + text + data
+        if len(data) > self._capacity:
+            return False
+        header = self._header['header']
+        slot = 1 - header.get('slot') if header.version() else 0
+        offset = slot * self._capacity
+        memoryview(self._data).cast('B')[offset:offset + len(data)] = data
+        header.write(slot, len(data))
+        return True
+
+    def receive(self):
+        """
+        Method of obtaining the last record
+        :return: Dictionary of the record, the same object while the record is unchanged, empty if nothing was sent
+        """
+        header = self._header['header']
+        for _ in range(100):
+            version = header.version()
+            if version == self._cache_version:
+                return self._cache
+            if version & 1:
+                continue
+            slot, length = header.read()
+            offset = slot * self._capacity
+            data = bytes(memoryview(self._data).cast('B')[offset:offset + length])
+            if header.version() == version:
+                try:
+                    text_length = self._LENGTH.unpack_from(data)[0]
+                    self._cache = json.loads(data[self._LENGTH.size:self._LENGTH.size + text_length].decode('utf-8'))
+                    if length > self._LENGTH.size + text_length:
+                        self._cache['data'] = data[self._LENGTH.size + text_length:]
+                except (ValueError, struct.error):
+                    self._cache = {}
+                self._cache_version = version
+                return self._cache
+        return self._cache
+
+
+if __name__ == "__main__":
+    import time
+
+    state = PilotState([('therm', [('t0', 'd'), ('t1', 'd')]), ('light', [('value', 'i')])])
+    state['therm'].write(21.5, -3.25)
+    state['light'].value = 200
+    bench = time.monotonic()
+    for _ in range(100000):
+        state['therm'].read()
+        state['light'].value
+    print('100000 snapshots of unchanged state: {0:.3f} s'.format(time.monotonic() - bench))
+    print(state['therm'].read(), state['light'].value, state['therm'].version())
@@ -0,0 +1,302 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# DS18B20 thermometers library of pilotClock project
+# (c) Hansom 2018
+
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+W1_MASTER_DIR = '/sys/devices/w1_bus_master1'
+DS18B20_FAMILY = '28'
+# Max conversion time of DS18B20 in seconds for each resolution in bits
+CONVERSION_TIMES = {9: 0.09375, 10: 0.1875, 11: 0.375, 12: 0.75}
+DEFAULT_RESOLUTION = 12
+
+
+class PilotThermometers(object):
+    _bulk_poll_interval = 0.01
+
+    def __init__(self, base_dir=W1_MASTER_DIR, sensor_ids=None):
+        """
+        :param base_dir: Path of the w1 bus master in sysfs
+        :param sensor_ids: Preferred order of sensor IDs (without family prefix). Discovered sensors
+                           that are not listed here are appended after them
+        """
+        self._base_dir = base_dir
+        self._preferred_ids = list(sensor_ids or [])
+        self._sensor_ids = self.discover()
+        self._resolutions = {sid: self.readResolution(sid) for sid in self._sensor_ids}
+        self._executor = None
+
+    def discover(self):
+        """
+        Method of searching for all DS18B20 (family 28) devices on the bus
+        :return: List of sensor IDs, preferred ones first, in their configured order
+        """
+        found = []
+        try:
+            for name in sorted(os.listdir(self._base_dir)):
+                if name.startswith(DS18B20_FAMILY + '-'):
+                    found.append(name[len(DS18B20_FAMILY) + 1:])
+        except OSError:
+            pass
+        return self._preferred_ids + [sid for sid in found if sid not in self._preferred_ids]
+
+    def sensorIds(self):
+        return list(self._sensor_ids)
+
+    def sensorPath(self, sid, attr='w1_slave'):
+        return os.path.join(self._base_dir, DS18B20_FAMILY + '-' + sid, attr)
+
+    def readResolution(self, sid):
+        """
+        Method of reading the current resolution of the sensor from sysfs
+        :param sid: Sensor ID
+        :return: Resolution in bits, default resolution if the kernel does not report it
+        """
+        try:
+            with open(self.sensorPath(sid, 'resolution'), 'r') as f:
+                bits = int(f.read().strip())
+                return bits if bits in CONVERSION_TIMES else DEFAULT_RESOLUTION
+        except (IOError, OSError, ValueError):
+            return DEFAULT_RESOLUTION
+
+    def getResolution(self, sid):
+        return self._resolutions.get(sid, DEFAULT_RESOLUTION)
+
+    def setResolution(self, sid, bits):
+        """
+        Method sets the resolution of the sensor through the sysfs resolution attribute
+        :param sid: Sensor ID
+        :param bits: Resolution in bits from 9 to 12
+        :return: True if the sensor accepted the resolution
+        """
+        bits = int(bits)
+        if bits not in CONVERSION_TIMES or sid not in self._sensor_ids:
+            return False
+        if self._resolutions.get(sid) == bits:
+            return True
+        path = self.sensorPath(sid, 'resolution')
+        if not os.path.exists(path):
+            # Old kernels have no resolution attribute, the sensor stays at its EEPROM setting
+            return False
+        try:
+            with open(path, 'w') as f:
+                f.write('{0}\n'.format(bits))
+            with open(path, 'r') as f:
+                bits = int(f.read().strip())
+        except (IOError, OSError, ValueError):
+            return False
+        self._resolutions[sid] = bits
+        return bits in CONVERSION_TIMES
+
+    def conversionTime(self):
+        """
+        Method of obtaining the conversion time of the bus
+        :return: Time in seconds of the slowest sensor conversion with the current resolutions
+        """
+        return max([CONVERSION_TIMES.get(self.getResolution(sid), CONVERSION_TIMES[DEFAULT_RESOLUTION])
+                    for sid in self._sensor_ids] or [0])
+
+    def bulkSupported(self):
+        """
+        Method checks whether the kernel w1_therm driver provides the therm_bulk_read attribute
+        :return: True if bulk conversion can be triggered
+        """
+        return os.path.exists(os.path.join(self._base_dir, 'therm_bulk_read'))
+
+    def triggerBulk(self, timeout=None):
+        """
+        Method starts a simultaneous conversion on all sensors of the bus and waits for its completion
+        :param timeout: Max waiting time in seconds, by default twice the conversion time
+        :return: True if the conversion was completed
+        """
+        path = os.path.join(self._base_dir, 'therm_bulk_read')
+        conversion_time = self.conversionTime()
+        timeout = timeout if timeout is not None else conversion_time * 2
+        try:
+            with open(path, 'w') as f:
+                f.write('trigger\n')
+            deadline = time.monotonic() + timeout
+            time.sleep(conversion_time)
+            while time.monotonic() < deadline:
+                with open(path, 'r') as f:
+                    state = f.read().strip()
+                # -1 - conversion in progress, 1 - results are ready, 0 - nothing was triggered
+                if state != '-1':
+                    return state == '1'
+                time.sleep(self._bulk_poll_interval)
+        except (IOError, OSError):
+            pass
+        return False
+
+    def readFile(self, path):
+        with open(path, 'r') as t_file:
+            return t_file.readlines()
+
+    def readSensor(self, sid):
+        """
+        Method of reading the temperature of one sensor
+        :param sid: Sensor ID
+        :return: Temperature in Celsius degrees or None if the data is missing or corrupted
+        """
+        try:
+            tdata = self.readFile(self.sensorPath(sid))
+            if len(tdata) >= 2 and tdata[0].strip()[-3:] == 'YES' and 't=' in tdata[1]:
+                return float(tdata[1].split('t=')[1]) / 1000
+        except (IOError, OSError, ValueError):
+            pass
+        return None
+
+    def readAll(self):
+        """
+        Method of reading all sensors. When the kernel supports bulk conversion, one conversion is
+        triggered for the whole bus, otherwise the sensors convert concurrently in parallel reads
+        :return: List of temperatures in the order of sensorIds(), None for the failed sensors
+        """
+        if not self._sensor_ids:
+            return []
+        if self.bulkSupported():
+            self.triggerBulk()
+        if len(self._sensor_ids) == 1:
+            return [self.readSensor(self._sensor_ids[0])]
+        if self._executor is None:
+            # Created lazily, so the worker threads belong to the process that reads the sensors
+            self._executor = ThreadPoolExecutor(max_workers=len(self._sensor_ids))
+        return list(self._executor.map(self.readSensor, self._sensor_ids))
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+
+def makeFakeW1Bus(base_dir, temps, bulk=True):
+    """
+    Method creates a fake sysfs tree of the w1 bus master for running the thermometers without device
+    :param base_dir: Directory for the fake bus master
+    :param temps: Dictionary of sensor ID and temperature in Celsius degrees
+    :param bulk: Create the therm_bulk_read attribute
+    :return: Path of the fake bus master
+    """
+    os.makedirs(base_dir, exist_ok=True)
+    for sid, temp in temps.items():
+        sdir = os.path.join(base_dir, DS18B20_FAMILY + '-' + sid)
+        os.makedirs(sdir, exist_ok=True)
+        raw = int(round(temp * 16)) & 0xFFFF
+        crc = '{0:02x} {1:02x} 4b 46 7f ff 0c 10 1c'.format(raw & 0xFF, raw >> 8)
+        with open(os.path.join(sdir, 'w1_slave'), 'w') as f:
+            f.write('{0} : crc=1c YES\n{0} t={1}\n'.format(crc, int(round(temp * 1000))))
+        with open(os.path.join(sdir, 'resolution'), 'w') as f:
+            f.write('{0}\n'.format(DEFAULT_RESOLUTION))
+    if bulk:
+        with open(os.path.join(base_dir, 'therm_bulk_read'), 'w') as f:
+            f.write('0\n')
+    return base_dir
+
+
+class FakeW1Thermometers(PilotThermometers):
+    """
+    Thermometers on a fake bus emulating the conversion delay of the real sensors:
+    every w1_slave read blocks for the conversion time unless a bulk conversion already did it
+    """
+    _bulk_done = False
+
+    def triggerBulk(self, timeout=None):
+        time.sleep(self.conversionTime())
+        self._bulk_done = True
+        return True
+
+    def readFile(self, path):
+        if not self._bulk_done:
+            sid = os.path.basename(os.path.dirname(path))[len(DS18B20_FAMILY) + 1:]
+            time.sleep(CONVERSION_TIMES[self.getResolution(sid)])
+        return super().readFile(path)
+
+    def readAll(self):
+        self._bulk_done = False
+        return super().readAll()
+
+
+def checkThermometers(base_dir):
+    """
+    Method of checking the thermometers library on fake buses: discovery order, temperatures, resolutions,
+    corrupted and missing sensors, and that the sensors of the bus convert at the same time
+    :param base_dir: Empty directory for the fake buses
+    :return: List of descriptions of the failed checks
+    """
+    failed = []
+    temps = {'0000000000{0:02x}'.format(n): 20.5 + n for n in range(4)}
+    preferred = ['000000000003']
+    for bulk in (False, True):
+        mode = 'bulk' if bulk else 'parallel'
+        bus = makeFakeW1Bus(os.path.join(base_dir, mode), temps, bulk=bulk)
+        therms = FakeW1Thermometers(bus, preferred)
+        expected_ids = preferred + sorted(sid for sid in temps if sid not in preferred)
+        if therms.sensorIds() != expected_ids:
+            failed.append('{0}: discovered {1} instead of {2}'.format(mode, therms.sensorIds(), expected_ids))
+        if therms.bulkSupported() != bulk:
+            failed.append('{0}: bulk support is not detected correctly'.format(mode))
+        if therms.setResolution(expected_ids[1], 13) or therms.setResolution('000000000009', 9):
+            failed.append('{0}: wrong resolution or unknown sensor accepted'.format(mode))
+        for sid in temps:
+            if not therms.setResolution(sid, 9) or therms.getResolution(sid) != 9:
+                failed.append('{0}: resolution of {1} is not set'.format(mode, sid))
+        if therms.conversionTime() != CONVERSION_TIMES[9]:
+            failed.append('{0}: conversion time {1} instead of {2}'.format(mode, therms.conversionTime(),
+                                                                          CONVERSION_TIMES[9]))
+        start = time.monotonic()
+        values = therms.readAll()
+        elapsed = time.monotonic() - start
+        expected = [temps.get(sid) for sid in expected_ids]
+        if values != expected:
+            failed.append('{0}: read {1} instead of {2}'.format(mode, values, expected))
+        # Serial reads would take a conversion time per sensor
+        if elapsed >= CONVERSION_TIMES[9] * 2:
+            failed.append('{0}: {1} sensors read in {2:.3f} s'.format(mode, len(temps), elapsed))
+        with open(therms.sensorPath(expected_ids[0]), 'w') as f:
+            f.write('45 01 4b 46 7f ff 0c 10 1c : crc=1c NO\n45 01 4b 46 7f ff 0c 10 1c t=20312\n')
+        if therms.readSensor(expected_ids[0]) is not None:
+            failed.append('{0}: reading with a wrong CRC accepted'.format(mode))
+        therms.close()
+    missing = PilotThermometers(os.path.join(base_dir, 'parallel'), ['000000000009'])
+    if missing.sensorIds()[0] != '000000000009' or missing.readAll()[0] is not None:
+        failed.append('missing sensor is not read as None')
+    missing.close()
+    return failed
+
+
+if __name__ == "__main__":
+    import sys
+    import tempfile
+
+    command = sys.argv[1] if len(sys.argv) > 1 else 'check'
+    if command == 'bench':
+        sensors_num = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+        resolution = int(sys.argv[3]) if len(sys.argv) > 3 else DEFAULT_RESOLUTION
+        with tempfile.TemporaryDirectory() as tmp:
+            temps = {'0000000000{0:02x}'.format(n): 20.5 + n for n in range(sensors_num)}
+            for bulk in (False, True):
+                bus = makeFakeW1Bus(os.path.join(tmp, 'bulk' if bulk else 'plain'), temps, bulk=bulk)
+                therms = FakeW1Thermometers(bus)
+                for sid in therms.sensorIds():
+                    therms.setResolution(sid, resolution)
+                start = time.monotonic()
+                values = therms.readAll()
+                print('{0} sensors, {1} bit, bulk={2}: {3:.3f} s {4}'.format(sensors_num, resolution, bulk,
+                                                                          time.monotonic() - start, values))
+                serial_start = time.monotonic()
+                therms._bulk_done = False
+                for sid in therms.sensorIds():
+                    therms.readSensor(sid)
+                print('{0} sensors, serial reads: {1:.3f} s'.format(sensors_num, time.monotonic() - serial_start))
+                therms.close()
+    else:
+        with tempfile.TemporaryDirectory() as tmp:
+            failed = checkThermometers(tmp)
+        for description in failed:
+            print('FAILED', description)
+        print('{0} failed checks'.format(len(failed)) if failed else 'All thermometer checks passed')
+        sys.exit(1 if failed else 0)
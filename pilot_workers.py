@@ -0,0 +1,556 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Sensor processes library of pilotClock project
+# (c) Hansom 2018
+#
+# Entry module of the sensor processes. The processes are started with the forkserver (spawn on Windows)
+# start method from a server that has imported only this module, so they do not inherit the heap of the
+# main process with its fonts, images and display driver. Every worker imports only the libraries it needs
+
+import os
+import time
+import threading
+import multiprocessing
+
+RSS_REPLACE_MAP = [('«', '"'), ('»', '"'), ('–', '-'), ('—', '-')]
+
+
+def getContext(method=None):
+    """
+    Method of obtaining the multiprocessing context of the sensor processes
+    :param method: Start method, forkserver where available and spawn otherwise by default
+    :return: Multiprocessing context
+    """
+    if method is None:
+        method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+    ctx = multiprocessing.get_context(method)
+    if method == 'forkserver':
+        ctx.set_forkserver_preload([__name__])
+    return ctx
+
+
+def processMemory(pid=None):
+    """
+    Method of obtaining the memory usage of a process from procfs
+    :param pid: Process ID, the current process if not specified
+    :return: Tuple (RSS, PSS) in kB, PSS is None if the kernel does not report it, None if there is no procfs
+    """
+    pid = 'self' if pid is None else pid
+    values = {}
+    for name in ('smaps_rollup', 'status'):
+        try:
+            with open('/proc/{0}/{1}'.format(pid, name), mode='r') as f:
+                for line in f:
+                    key, _, value = line.partition(':')
+                    if key in ('Rss', 'Pss', 'VmRSS'):
+                        values[key] = int(value.split()[0])
+        except (IOError, ValueError):
+            continue
+        if values:
+            break
+    if not values:
+        return None
+    return values.get('Rss', values.get('VmRSS')), values.get('Pss')
+
+
+class StopSignal(object):
+    """
+    Event of stopping the workers. It is a pipe with a byte written to it on stop, so unlike
+    multiprocessing.Event it can not be left locked by a worker killed in the middle of waiting
+    """
+
+    def __init__(self, ctx):
+        """
+        :param ctx: Multiprocessing context of the workers
+        """
+        self._reader, self._writer = ctx.Pipe(duplex=False)
+        self._set = False
+
+    def __getstate__(self):
+        # Workers get only the reading end
+        return {'_reader': self._reader, '_writer': None, '_set': False}
+
+    def set(self):
+        if not self._set and self._writer is not None:
+            self._writer.send_bytes(b'1')
+        self._set = True
+
+    def is_set(self):
+        return self._set or self._reader.poll()
+
+    def wait(self, timeout=None):
+        """
+        Method of waiting for the stop
+        :param timeout: Max time of waiting in seconds
+        :return: True if the stop was requested
+        """
+        return self._set or self._reader.poll(timeout)
+
+
+def runWorker(name, target, args, kwargs):
+    """
+    Entry point of the worker processes, the profiler signals are handled in every worker
+    :param name: Worker name
+    :param target: Worker function
+    :param args: Positional arguments of the function
+    :param kwargs: Keyword arguments of the function
+    :return:
+    """
+    import signal
+    # The profiler signals are ignored until their handlers are installed, their default action terminates the process
+    for signum in ('SIGUSR1', 'SIGUSR2'):
+        if hasattr(signal, signum):
+            signal.signal(getattr(signal, signum), signal.SIG_IGN)
+    from pilot_profiler import PilotProfiler
+
+    PilotProfiler(name).install()
+    target(*args, **kwargs)
+
+
+class WorkerSupervisor(object):
+    """
+    Watcher of the worker processes. Every worker writes the time of its heartbeat to its shared state section,
+    a worker that has crashed or stopped beating is restarted with exponential backoff. A worker that has
+    exited with code 0 was disabled and is not restarted. The workers block on the common stop event,
+    so the shutdown does not wait for their sleep loops
+    """
+    _check_interval = 1  # in seconds
+
+    def __init__(self, ctx, stop, backoff_base=1, backoff_max=300, stable_time=600):
+        """
+        :param ctx: Multiprocessing context of the workers
+        :param stop: Event of stopping all workers
+        :param backoff_base: Delay in seconds before the restart after the first failure
+        :param backoff_max: Max delay in seconds before the restart
+        :param stable_time: Time in seconds a worker has to run for its failures to be forgotten
+        """
+        self._ctx = ctx
+        self._stop = stop
+        self._backoff_base = backoff_base
+        self._backoff_max = backoff_max
+        self._stable_time = stable_time
+        self._names = []
+        self._workers = {}
+        self._thread = None
+
+    def add(self, name, target, args=(), kwargs=None, health=None, timeout=30, on_restart=None):
+        """
+        Method of registering and starting a worker
+        :param name: Worker name
+        :param target: Worker function
+        :param args: Positional arguments of the function
+        :param kwargs: Keyword arguments of the function
+        :param health: Shared state section with the heartbeat time of the worker (monotonic)
+        :param timeout: Time in seconds without heartbeats after which the worker is considered hung
+        :param on_restart: Function called before every restart of the worker, returning its new positional
+                           arguments, for replacing the channels a killed worker may have left locked
+        :return:
+        """
+        self._names.append(name)
+        self._workers[name] = {'target': target, 'args': args, 'kwargs': kwargs or {}, 'health': health,
+                               'timeout': timeout, 'on_restart': on_restart, 'proc': None, 'started': 0,
+                               'restart_at': None, 'failures': 0, 'restarts': 0, 'exitcode': None}
+        self._start(name, time.monotonic())
+
+    def _start(self, name, now):
+        worker = self._workers[name]
+        if worker['health'] is not None:
+            worker['health'].value = now
+        worker['proc'] = self._ctx.Process(target=runWorker, name=name,
+                                           args=(name, worker['target'], worker['args'], worker['kwargs']))
+        worker['proc'].start()
+        worker['started'] = now
+        worker['restart_at'] = None
+
+    @staticmethod
+    def _kill(proc):
+        proc.terminate()
+        proc.join(1)
+        if proc.is_alive() and hasattr(proc, 'kill'):
+            # A stopped process does not handle SIGTERM
+            proc.kill()
+            proc.join(1)
+
+    def process(self, name):
+        return self._workers[name]['proc']
+
+    def sendSignal(self, signum):
+        """
+        Method of sending a signal to all running workers. A worker gets it only after its first heartbeat,
+        before that it may have not installed its signal handlers yet
+        :param signum: Signal number
+        :return:
+        """
+        for name in self._names:
+            worker = self._workers[name]
+            proc = worker['proc']
+            if worker['health'] is not None and worker['health'].value <= worker['started']:
+                continue
+            if proc.pid is not None and proc.is_alive():
+                try:
+                    os.kill(proc.pid, signum)
+                except OSError:
+                    pass
+
+    def check(self, now=None):
+        """
+        Method of checking the workers and restarting the failed ones
+        :param now: Current time (monotonic)
+        :return:
+        """
+        now = time.monotonic() if now is None else now
+        for name in self._names:
+            if self._stop.is_set():
+                return
+            worker = self._workers[name]
+            proc = worker['proc']
+            if worker['restart_at'] is not None:
+                if now >= worker['restart_at']:
+                    worker['restarts'] += 1
+                    if worker['on_restart'] is not None:
+                        worker['args'] = worker['on_restart']()
+                    self._start(name, now)
+                continue
+            if proc.exitcode == 0:
+                continue
+            hung = worker['health'] is not None and now - worker['health'].value > worker['timeout']
+            if proc.exitcode is None and not hung:
+                if now - worker['started'] >= self._stable_time:
+                    worker['failures'] = 0
+                continue
+            if hung:
+                print('Worker {0} does not respond, terminating'.format(name))
+                self._kill(proc)
+            worker['exitcode'] = proc.exitcode
+            delay = min(self._backoff_base * 2 ** worker['failures'], self._backoff_max)
+            worker['failures'] += 1
+            worker['restart_at'] = now + delay
+            print('Worker {0} exited with code {1}, restarting in {2} s'.format(name, proc.exitcode, delay))
+
+    def _run(self):
+        while not self._stop.wait(self._check_interval):
+            self.check()
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=3):
+        """
+        Method of stopping all workers. The workers which have not finished in time are terminated
+        :param timeout: Max time in seconds of waiting for the workers
+        :return:
+        """
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        deadline = time.monotonic() + timeout
+        for name in self._names:
+            proc = self._workers[name]['proc']
+            proc.join(max(deadline - time.monotonic(), 0))
+            if proc.is_alive():
+                print('Worker {0} has not stopped in time, terminating'.format(name))
+                self._kill(proc)
+
+    def stats(self, now=None):
+        """
+        Method of obtaining the state of the workers
+        :param now: Current time (monotonic)
+        :return: Dictionary of worker name and dictionary with the alive flag, number of restarts,
+                 exit code of the last failure and the time in seconds since the last heartbeat
+        """
+        now = time.monotonic() if now is None else now
+        stats = {}
+        for name in self._names:
+            worker = self._workers[name]
+            stats[name] = {'alive': worker['proc'].is_alive(), 'restarts': worker['restarts'],
+                           'exitcode': worker['exitcode'],
+                           'heartbeat_age': now - worker['health'].value if worker['health'] is not None else None}
+        return stats
+
+
+def parseMalformedFeed(data):
+    """
+    Fallback parser of the feeds the streaming parser can not handle. feedparser takes a noticeable time
+    to import, so it is loaded only when the first malformed feed is met
+    """
+    import feedparser
+    return feedparser.parse(data)
+
+
+def headlineCapacity(title_length, extra=2048):
+    """
+    Method of obtaining the size of a headline record with its run line image
+    :param title_length: Number of characters of the longest title published with the image
+    :param extra: Bytes reserved for the other fields of the headline
+    :return: Size in bytes
+    """
+    from pilot_fonts import RUN_LINE_FONT, RUN_LINE_HEIGHT, RUN_LINE_MARGIN
+    char_width = max(len(columns) for columns in RUN_LINE_FONT)
+    row_size = (title_length * char_width + RUN_LINE_MARGIN * 2 + 7) // 8
+    # Up to 3 bytes of UTF-8 per character of the title text
+    return title_length * 3 + RUN_LINE_HEIGHT * row_size + extra
+
+
+def publishHeadline(channel, headline):
+    """
+    Method of publishing a headline together with its run line image rendered in advance,
+    so the render loop does not stall on a new headline. A headline too long for the channel
+    is published without the image, the renderer draws its text then
+    :param channel: MessageChannel of the headlines
+    :param headline: Headline dictionary
+    :return: True if the headline has been published
+    """
+    from pilot_fonts import rasterizeText, RUN_LINE_FONT, RUN_LINE_HEIGHT, RUN_LINE_MARGIN
+    text_width, width, height, bits = rasterizeText(headline['title'], RUN_LINE_FONT, RUN_LINE_HEIGHT, RUN_LINE_MARGIN)
+    if channel.send(dict(headline, raster={'text_width': text_width, 'width': width, 'height': height,
+                                           'margin': RUN_LINE_MARGIN}), bits):
+        return True
+    headline = {key: value for key, value in headline.items() if key not in ('raster', 'data')}
+    if channel.send(headline):
+        return True
+    # Even the text does not fit, the title is shortened
+    title = headline['title']
+    while title:
+        title = title[:len(title) * 3 // 4]
+        if channel.send(dict(headline, title=title + '...', link='')):
+            print('Headline is too long for the channel, shortened to {0} characters'.format(len(title)))
+            return True
+    print('Headline is too long for the channel')
+    return False
+
+
+def lightWorker(state, stop, history, log, devel=False, address=0x48, channel=0, approx_length=20,
+                poll_limits=(0.1, 2.0), poll_threshold=2, log_interval=60, read_time=None):
+    """
+    Code of the logic for reading the ADC data to determine the light intensity and the values of analog sensors.
+    All converter inputs are read in one I2C transaction
+    :param state: Shared state, sections control (continued polling cycle flag and filters), light, analog,
+                  light_poll and light_health are used
+    :param stop: Event of stopping the worker
+    :param history: Shared history of sensors values
+    :param log: Persistent log of the light value
+    :param devel: Emulation mode without the I2C bus
+    :param address: I2C address of the converter
+    :param channel: Input of the photoresistor
+    :param approx_length: Parameter specifying the number of values for obtaining the mean value of illumination in a time interval
+    :param poll_limits: Tuple (floor, ceiling) of the polling interval in seconds
+    :param poll_threshold: Change of the raw value that should be noticed within one polling interval
+    :param log_interval: Interval of the log records in seconds
+    :param read_time: Histogram of the ADC read time
+    :return:
+    """
+    from pilot_adc import PilotADC, CHANNELS_NUM
+    from pilot_polling import AdaptivePoller
+
+    if devel:
+        adc = PilotADC(None, address)
+    else:
+        from smbus2 import SMBus
+        adc = PilotADC(SMBus(1), address)  # 1 for RPi model B rev.2
+    control = state['control']
+    proc_val = state['light']
+    analog = state['analog']
+    stats = state['light_poll']
+    health = state['light_health']
+    next_log = 0
+    next_poll = 0
+    light = 255
+    poller = AdaptivePoller(poll_limits[0], poll_limits[1], poll_threshold)
+    while control.get('light_enable') and not stop.is_set():
+        now = time.monotonic()
+        health.value = now
+        if now < next_poll:
+            stop.wait(min(next_poll - now, 0.5))
+            continue
+        poller.setLimits(control.get('light_poll_min'), control.get('light_poll_max'))
+        for n in range(CHANNELS_NUM):
+            adc.setFilter(n, approx_length if n == channel else control.get('ain{0}_filter'.format(n)))
+        read_start = time.perf_counter()
+        raw, filtered = adc.read()
+        if read_time is not None:
+            read_time.observe(time.perf_counter() - read_start)
+        if not devel:
+            light = 255 - int(filtered[channel])
+        if tuple(filtered) != analog.read():
+            analog.write(*filtered)
+        if proc_val.value != light:
+            # The version of the section is bumped only when the value really changes
+            proc_val.value = light
+        history.append('light', light)
+        if time.monotonic() >= next_log:
+            next_log = time.monotonic() + log_interval
+            log.append(light)
+        next_poll = now + poller.update(raw[channel], now)
+        stats.write(*(poller.stats(now) + (poller.interval(),)))
+    log.flush()
+
+
+def thermWorker(state, stop, history, logs, therms, names, bus_duty=0.0125, poll_max=600, poll_threshold=0.5,
+                read_time=None):
+    """
+    Code of the logic for obtaining data from thermal sensors
+    :param state: Shared state, sections control (continued polling cycle flag and requested sensors resolution),
+                  therm, therm_poll and therm_health are used
+    :param stop: Event of stopping the worker
+    :param history: Shared history of sensors values
+    :param logs: Dictionary of persistent logs of the sensors
+    :param therms: PilotThermometers object
+    :param names: Names of the sensors values in order of the sensor IDs
+    :param bus_duty: Share of time the bus may spend converting, the floor of the polling interval
+                     is derived from it and the conversion time of the current resolution
+    :param poll_max: Ceiling of the polling interval in seconds
+    :param poll_threshold: Change of the temperature that should be noticed within one polling interval
+    :param read_time: Histogram of the time of reading all sensors
+    :return:
+    """
+    from pilot_polling import AdaptivePoller
+
+    control = state['control']
+    proc_val = state['therm']
+    stats = state['therm_poll']
+    health = state['therm_health']
+    next_read = 0
+    sensor_ids = therms.sensorIds()
+    # All sensors are converted together, so the bus is polled at the rate of the fastest changing one
+    pollers = [AdaptivePoller(therms.conversionTime() / bus_duty, poll_max, poll_threshold) for _ in sensor_ids]
+    while control.get('therm_enable') and not stop.is_set():
+        health.value = time.monotonic()
+        for name, sid in zip(names, sensor_ids):
+            res = control.get(name + '_res')
+            if res and res != therms.getResolution(sid):
+                if therms.setResolution(sid, res):
+                    next_read = 0
+        now = time.monotonic()
+        if now >= next_read:
+            temps = list(proc_val.read())
+            intervals = []
+            read_start = time.perf_counter()
+            values = therms.readAll()
+            if read_time is not None:
+                read_time.observe(time.perf_counter() - read_start)
+            for i, temp in enumerate(values):
+                if temp is not None and i < len(temps):
+                    temps[i] = temp
+                    history.append(names[i], temp)
+                    logs[names[i]].append(temp)
+                    pollers[i].setLimits(therms.conversionTime() / bus_duty, control.get('therm_poll_max'))
+                    intervals.append(pollers[i].update(temp, now))
+            if temps != list(proc_val.read()):
+                proc_val.write(*temps)
+            next_read = now + min(intervals or [therms.conversionTime() / bus_duty])
+            if pollers:
+                # Sensors which never returned a value have no polls and add nothing
+                poller_stats = [poller.stats(now) for poller in pollers]
+                stats.write(sum(polls for polls, _ in poller_stats), sum(saved for _, saved in poller_stats),
+                            next_read - now)
+        stop.wait(min(max(next_read - time.monotonic(), 0.01), 1))
+    therms.close()
+    for name in names:
+        logs[name].flush()
+
+
+def rssWorker(state, stop, headlines, cache_path, cache_interval=600, interval=300,
+              queue_size=20, seen_size=2000, max_items=10, poll_time=None):
+    """
+    Code of the logic for reading data from RSS feed channel
+    :param state: Shared state, sections control (continued polling cycle flag and RSS-channel source URL),
+                  rss (number of waiting headlines), rss_stats and rss_health are used
+    :param stop: Event of stopping the worker
+    :param headlines: MessageChannel the headlines are published through
+    :param cache_path: Path of the cache file
+    :param cache_interval: Min interval of the cache writes in seconds
+    :param interval: Sets the polling time interval
+    :param queue_size: Max number of headlines waiting for display
+    :param seen_size: Max number of remembered feed entries
+    :param max_items: Number of the first feed items parsed, the rest of the feed is skipped
+    :param poll_time: Histogram of the time of the polls which fetched feeds
+    :return:
+    """
+    from pilot_rss import FeedAggregator, HeadlineCache, parseFeeds, parseHeadlines
+
+    control = state['control']
+    proc_val = state['rss']
+    stats = state['rss_stats']
+    health = state['rss_health']
+    health.value = time.monotonic()
+    if stop.wait(5):  # Starting delay for accepting configuration
+        return
+    # The state is read from the cache here, so a restarted worker continues from its last saved state
+    cache = HeadlineCache(cache_path, cache_interval)
+    cache_state = cache.load()
+    # Feeds are parsed incrementally up to the first items, feedparser handles only malformed ones
+    parse = lambda data: parseHeadlines(data, max_items, parseMalformedFeed)
+    aggregator = FeedAggregator(parse, interval, queue_size, seen_size)
+    last_next = control.get('rss_next')
+    title = cache_state.get('title')
+    headline = cache_state.get('headline') or {'title': title}
+    published = bool(title)
+    restored = False
+    no_news = False  # The headline of failed feeds is published once when they start failing
+    cache_marker = None
+    while control.get('rss_enable') and not stop.is_set():
+        health.value = time.monotonic()
+        aggregator.setFeeds(parseFeeds(control.get('rss_src').rstrip(b'\0').decode('cp1251')))
+        if not restored:
+            aggregator.setState(cache_state)
+            restored = True
+        poll_start = time.perf_counter()
+        aggregator.poll()
+        fstats = aggregator.stats()
+        if fstats.get('requests', 0) != stats.get('requests'):
+            if poll_time is not None:
+                poll_time.observe(time.perf_counter() - poll_start)
+            stats.write(fstats['requests'], fstats['not_modified'], fstats['failures'],
+                        fstats['bytes_per_hour'], fstats['parse_cpu_per_hour'])
+        # The next headline is published on start and when the renderer asks for it after showing the current one
+        if not published or control.get('rss_next') != last_next:
+            last_next = control.get('rss_next')
+            next_headline = aggregator.pop()
+            if next_headline is not None:
+                headline = next_headline
+                title = headline['title']
+                for rep in RSS_REPLACE_MAP:
+                    title = title.replace(rep[0], rep[1])
+                headline['title'] = title
+                publishHeadline(headlines, headline)
+                published = True
+                no_news = False
+            elif aggregator.failed() and not no_news:
+                publishHeadline(headlines, {'title': 'А новостей на сегодня больше нет... или накрылся интернет :-('})
+                no_news = True
+        if not aggregator.failed():
+            no_news = False
+        if proc_val.get('pending') != aggregator.pending():
+            proc_val.update(pending=aggregator.pending())
+        marker = (fstats.get('requests', 0), title, control.get('rss_shown'))
+        if marker != cache_marker:
+            cache_marker = marker
+            cache.update(dict(aggregator.getState(), title=title, headline=headline,
+                              shown=control.get('rss_shown')))
+        else:
+            cache.flushDue()
+        stop.wait(1)
+    cache.flush()
+    aggregator.close()
+
+
+if __name__ == "__main__":
+    # Memory of the processes with the fork start method from a main process with the display libraries
+    # and fonts loaded, against the processes started from the slim server
+    import sys
+    import pilot
+    from pilot_sensors import PilotSensors
+
+    for name in pilot.BITMAP_FONTS:
+        pilot.bitmapFont(name)
+    methods = sys.argv[1:] or ['fork', None]
+    for method in methods:
+        sensors = PilotSensors(devel=True, start_method=method)
+        time.sleep(3)
+        print('Start method: {0}'.format(method or getContext().get_start_method()))
+        for name, memory in sensors.getMemoryStats().items():
+            if memory is not None:
+                print('  {0:6s} RSS {1:7d} kB  PSS {2} kB'.format(name, memory[0], memory[1]))
+        sensors.stopSensors()